@@ -1,110 +1,191 @@
 import os
+import json
 import time
-from langchain_community.document_loaders import TextLoader, DirectoryLoader
-from langchain_text_splitters import CharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
+import hashlib
+from langchain_core.embeddings import Embeddings
+from embedding_model import get_embeddings, bulk_embed
+from stream_splitter import iter_file_documents
 from langchain_chroma import Chroma
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def load_documents(docs_path="docs"):
-    """Load all text files from the docs directory"""
-    print(f"Loading documents from {docs_path}...")
-    
-    # Check if docs directory exists
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Bulk mode: with INGEST_WORKERS > 1, batches of at least BULK_MIN_CHUNKS
+# chunks are embedded across that many processes (one model copy each).
+BULK_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))
+BULK_MIN_CHUNKS = 1000
+
+
+class LazyEmbeddings(Embeddings):
+    """The shared model, loaded on the first embed call so a run with nothing to embed never loads it"""
+
+    def embed_documents(self, texts):
+        return get_embeddings(EMBED_MODEL, device="cpu").embed_documents(texts)
+
+    def embed_query(self, text):
+        return get_embeddings(EMBED_MODEL, device="cpu").embed_query(text)
+
+
+def chroma_max_batch(vectorstore):
+    """Largest batch Chroma accepts in one write"""
+    try:
+        return vectorstore._client.get_max_batch_size()
+    except Exception:
+        return 5000
+
+
+def bulk_add(vectorstore, chunks, ids, workers=BULK_WORKERS):
+    """Embed chunks across worker processes and stream them into Chroma shard by shard"""
+    print(f"--- Bulk mode: embedding {len(chunks)} chunks with {workers} processes ---")
+    start = time.time()
+    texts = [c.page_content for c in chunks]
+    shard = min(256, chroma_max_batch(vectorstore))
+    for offset, vectors in bulk_embed(texts, EMBED_MODEL, workers, shard_size=shard):
+        end = offset + len(vectors)
+        vectorstore._collection.upsert(
+            ids=ids[offset:end],
+            embeddings=vectors,
+            documents=texts[offset:end],
+            metadatas=[c.metadata or None for c in chunks[offset:end]],
+        )
+        if (end // shard) % 20 == 0 or end == len(chunks):
+            print(f"  {end}/{len(chunks)} chunks")
+    elapsed = time.time() - start
+    print(f"--- Bulk embedded {len(chunks)} chunks in {elapsed:.1f}s "
+          f"({len(chunks) / max(elapsed, 1e-9):.1f} chunks/sec) ---")
+
+
+def add_chunks(vectorstore, chunks, ids):
+    """Embed and store chunks; large batches go through bulk mode when INGEST_WORKERS > 1"""
+    if not chunks:
+        return
+    if BULK_WORKERS > 1 and len(chunks) >= BULK_MIN_CHUNKS:
+        bulk_add(vectorstore, chunks, ids)
+        return
+    # Chroma rejects writes above its max batch size
+    step = chroma_max_batch(vectorstore)
+    for i in range(0, len(chunks), step):
+        vectorstore.add_documents(chunks[i:i + step], ids=ids[i:i + step])
+
+
+MANIFEST_FILE = "ingest_manifest.json"
+
+
+def file_sha256(path):
+    """SHA-256 of a file, read in 1 MB blocks"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest(persist_directory):
+    """{file name: {size, mtime, sha256, ids}} from the last run, or None if there is none"""
+    path = os.path.join(persist_directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(persist_directory, manifest):
+    os.makedirs(persist_directory, exist_ok=True)
+    path = os.path.join(persist_directory, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def sync_vector_store(docs_path="docs", persist_directory="db/chroma_db"):
+    """Bring the vector store in line with docs_path, embedding only new or changed files"""
     if not os.path.exists(docs_path):
         raise FileNotFoundError(f"The directory {docs_path} does not exist. Please create it and add your company files.")
-    
-    # Load all .txt files from the docs directory
-    loader = DirectoryLoader(
-        path=docs_path,
-        glob="*.txt",
-        loader_cls=TextLoader,
-        loader_kwargs={'encoding': 'utf-8'}
-    )
-    
-    documents = loader.load()
-    
-    if len(documents) == 0:
-        raise FileNotFoundError(f"No .txt files found in {docs_path}. Please add your company documents.")
-    
-   
-    for i, doc in enumerate(documents[:2]):  # Show first 2 documents
-        '''
-        print(f"\nDocument {i+1}:")
-        print(f"  Source: {doc.metadata['source']}")
-        print(f"  Content length: {len(doc.page_content)} characters")
-        print(f"  Content preview: {doc.page_content[:100]}...")
-        print(f"  metadata: {doc.metadata}")
-
-        '''
-        
-    return documents
-
-
-def split_documents(documents, chunk_size=1000, chunk_overlap=0):
-    """Split documents into smaller chunks with overlap"""
-    print("Splitting documents into chunks...")
-    
-    text_splitter = CharacterTextSplitter(
-        chunk_size=chunk_size, 
-        chunk_overlap=chunk_overlap,
-    #    separator="\n\n" ["\n\n","\n","."," "] 
-    )
-    
-    chunks = text_splitter.split_documents(documents)
-    
-    if chunks:
-    
-        for i, chunk in enumerate(chunks[:5]):
-            '''
-            print(f"\n--- Chunk {i+1} ---")
-            print(f"Source: {chunk.metadata['source']}")
-            print(f"Length: {len(chunk.page_content)} characters")
-            print(f"Content:")
-            print(chunk.page_content)
-            print("-" * 50)
-            '''
-            
-        
-        if len(chunks) > 5:
-            print(f"\n... and {len(chunks) - 5} more chunks")
-    
-    return chunks
-
-
-def create_vector_store(chunks, persist_directory="db/chroma_db"):
-    """Create and persist ChromaDB vector store using local Hugging Face models"""
-    print(f"Creating local embeddings for {len(chunks)} chunks...")
-    
-    # This model is small, fast, and free. It will download once (about 80MB) 
-    # and then run offline.
-    embedding_model = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={'device': 'cpu'} # Use 'cuda' if you have an NVIDIA GPU
-    )
-    
-    print("--- Creating vector store ---")
-    # No batching needed for local models!
-    vectorstore = Chroma.from_documents(
-        documents=chunks,
-        embedding=embedding_model,
+
+    start = time.time()
+    vectorstore = Chroma(
         persist_directory=persist_directory,
+        embedding_function=LazyEmbeddings(),
         collection_metadata={"hnsw:space": "cosine"}
     )
-    
-    print(f"--- Finished! Vector store saved to {persist_directory} ---")
+
+    manifest = load_manifest(persist_directory)
+    if manifest is None:
+        # vectors written before the manifest existed can't be matched to files
+        untracked = vectorstore.get(include=[])["ids"]
+        if untracked:
+            print(f"No manifest found - removing {len(untracked)} untracked vectors")
+            vectorstore.delete(ids=untracked)
+        manifest = {}
+
+    current = sorted(name for name in os.listdir(docs_path) if name.endswith(".txt"))
+    counts = {"new": 0, "changed": 0, "removed": 0, "unchanged": 0}
+
+    # changed files are embedded together so bulk mode sees large batches
+    pending, pending_chunks, pending_ids = {}, [], []
+
+    def flush(partial=None):
+        # files are recorded complete only once all of their chunks are stored;
+        # a file cut by a mid-file flush is recorded as partial (no hash), so
+        # the next run deletes its stored ids if this one never finishes it
+        add_chunks(vectorstore, pending_chunks, pending_ids)
+        manifest.update(pending)
+        if partial:
+            name, ids = partial
+            manifest[name] = {"size": None, "mtime": None, "sha256": None, "ids": list(ids)}
+        save_manifest(persist_directory, manifest)   # an interrupted run resumes from here
+        pending.clear()
+        pending_chunks.clear()
+        pending_ids.clear()
+
+    for name in current:
+        path = os.path.join(docs_path, name)
+        stat = os.stat(path)
+        entry = manifest.get(name)
+
+        # same size + mtime -> unchanged, not even hashed
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            counts["unchanged"] += 1
+            continue
+        digest = file_sha256(path)
+        if entry and entry["sha256"] == digest:
+            entry["mtime"] = stat.st_mtime      # touched, same content
+            counts["unchanged"] += 1
+            continue
+
+        if entry and entry["ids"]:
+            vectorstore.delete(ids=entry["ids"])
+        # streamed: same chunks as CharacterTextSplitter, without loading the file whole
+        ids = []
+        for chunk in iter_file_documents(path, chunk_size=1000, chunk_overlap=0):
+            ids.append(f"{name}:{digest[:12]}:{len(ids)}")
+            pending_chunks.append(chunk)
+            pending_ids.append(ids[-1])
+            if len(pending_chunks) >= 10 * BULK_MIN_CHUNKS:
+                flush(partial=(name, ids))
+        counts["changed" if entry else "new"] += 1
+        pending[name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest, "ids": ids}
+    flush()
+
+    for name in sorted(set(manifest) - set(current)):
+        ids = manifest.pop(name)["ids"]
+        if ids:
+            vectorstore.delete(ids=ids)
+        counts["removed"] += 1
+
+    save_manifest(persist_directory, manifest)
+    print(f"--- Synced {docs_path} in {time.time() - start:.1f}s: "
+          f"{counts['new']} new, {counts['changed']} changed, "
+          f"{counts['removed']} removed, {counts['unchanged']} unchanged ---")
     return vectorstore
 
 
 def main():
-    #1. Loading the files
-    documents = load_documents(docs_path="docs")
-    #2. Chunking the files
-    chunks = split_documents(documents)
-    #3. Embedding and Storing in Vector DB
-    vectorstore = create_vector_store(chunks)
+    # Re-runs only load, chunk and embed new or changed files, and drop the
+    # vectors of deleted ones (see sync_vector_store).
+    vectorstore = sync_vector_store(docs_path="docs", persist_directory="db/chroma_db")
 
 
 if __name__ == "__main__":
@@ -1,5 +1,5 @@
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from embedding_model import get_embeddings
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,9 +7,7 @@ load_dotenv()
 persistent_directory = "db/chroma_db"
 
 # Load embeddings and vector store
-embedding_model = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={'device': 'cpu'})
+embedding_model = get_embeddings("sentence-transformers/all-MiniLM-L6-v2", device="cpu")
 
 db = Chroma(
     persist_directory=persistent_directory,
@@ -1,7 +1,7 @@
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
-from langchain_huggingface import HuggingFaceEmbeddings
+from embedding_model import get_embeddings
 from langchain_google_genai import ChatGoogleGenerativeAI
 
 # Load environment variables
@@ -9,9 +9,7 @@ load_dotenv()
 
 # Connect to your document database
 persistent_directory = "db/chroma_db"
-embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={'device': 'cpu'})
+embeddings = get_embeddings("sentence-transformers/all-MiniLM-L6-v2", device="cpu")
 
 db = Chroma(persist_directory=persistent_directory, embedding_function=embeddings)
 
@@ -4,10 +4,24 @@ import os
 import base64
 import hashlib
 import tempfile
+import shutil
 import time
 import re
 import uuid
 
+import ingest_cache
+import page_cache
+import image_norm
+import llm_cache
+import embedding_model
+import embed_cache
+import dedup
+import llm_client
+import ingest_jobs
+import post_index
+from ingest_pipeline import resolve_image
+from chunk_pages import ChunkPages
+
 # ════════════════════════════════════════════════════════
 # ── BRANDING — edit these lines ──────────────────────────
 BRAND_NAME   = "Sadiq Shehu"           # ← your name or company
@@ -22,7 +36,38 @@ DEFAULT_COMBINE     = 500
 DEFAULT_TOP_K       = 3
 DEFAULT_PERSIST_DIR = "chroma_db"
 DEFAULT_EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
-DEFAULT_LLM_MODEL   = "models/gemini-2.5-flash"
+DEFAULT_LLM_MODEL   = llm_client.DEFAULT_MODEL
+EMBED_BATCH_SIZE          = 64   # records per upsert when copying a cache entry into a store
+DEFAULT_CHUNKER           = os.getenv("CHUNKER", "title")   # "title" (chunk_by_title) | "native"
+DEFAULT_CHUNK_OVERLAP     = 150  # native chunker only
+# partition/OCR worker counts: PARTITION_WORKERS / OCR_WORKERS (ingest_pipeline)
+
+# Everything that changes what the pipeline produces for the same bytes —
+# part of the shared ingestion cache key.
+PIPELINE_SETTINGS = {
+    "max_chars":     DEFAULT_MAX_CHARS,
+    "new_after":     DEFAULT_NEW_AFTER,
+    "combine":       DEFAULT_COMBINE,
+    "chunker":       DEFAULT_CHUNKER,
+    "overlap":       DEFAULT_CHUNK_OVERLAP,
+    "dedup_hamming": dedup.HAMMING,                     # near-duplicate chunks are collapsed
+    "embed_model":   DEFAULT_EMBED_MODEL,
+    "embed_backend": embedding_model.DEFAULT_BACKEND,   # int8 vectors differ slightly; see pipeline_settings
+    "embed_windows": embedding_model.WINDOWING,         # pooled long-chunk vectors
+    "win_overlap":   embedding_model.WINDOW_OVERLAP,    # window layout changes those vectors
+    "max_windows":   embedding_model.MAX_WINDOWS,
+    "llm_model":     DEFAULT_LLM_MODEL,                 # chunk summaries
+}
+
+
+def pipeline_settings() -> dict:
+    """
+    PIPELINE_SETTINGS with the embedding backend that actually loaded, so a
+    torch fallback is never cached under "onnx-int8". Loads the model.
+    """
+    return {**PIPELINE_SETTINGS,
+            "embed_backend": embedding_model.loaded_backend(DEFAULT_EMBED_MODEL)}
+
 
 # ── API keys — reads from Streamlit secrets first, .env fallback ──
 try:
@@ -729,19 +774,23 @@ for k, v in {
     "auth_error": "",
     "auth_ok": "",
     "active_doc_id": None,     # UUID of currently loaded document
+    "unsaved_doc": None,       # {"ref", "persist_dir"} of an indexed document with no DB record
     # ── pipeline ──
     "db": None,
     "processed_chunks": [],
     "pipeline_ran": False,
     "logs": [],
-    "metrics": {"elements": 0, "chunks": 0, "docs": 0},
+    "metrics": {"elements": 0, "chunks": 0, "docs": 0, "duplicates": 0},
     "chat_history": [],
     "pipeline_busy": False,
-    "all_page_images": {},
+    "page_source": {},         # {"doc_hash", "page_count"} of the indexed PDF
+    "ingest_job": None,        # {"id", "name", "ext", "cache_key"} of this session's queued upload
     # ── summary ──
     "summary": None,
     "summary_images": [],
     "summary_tables": [],
+    "summary_task": None,       # post_index key of the summary being generated
+    "summary_error": "",
     "doc_name": "",
     # ── waitlist ──
     "on_waitlist": False,       # True once user joins
@@ -765,52 +814,6 @@ else:
 
 USER_PERSIST_DIR = os.path.join(DEFAULT_PERSIST_DIR, _uid)
 
-# ── Global busy flag (shared across all sessions via a temp file) ──────────
-# Stores JSON: {"user_id": "...", "started_at": unix_timestamp}
-# Auto-expires after PIPELINE_TIMEOUT_SECS so a crashed session never
-# blocks everyone permanently.
-_BUSY_FLAG_PATH      = os.path.join(tempfile.gettempdir(), "rag_pipeline_busy.flag")
-PIPELINE_TIMEOUT_SECS = 600   # 10 minutes — more than enough for any doc
-
-def _flag_data() -> dict:
-    """Read the flag file. Returns {} if missing or corrupt."""
-    try:
-        with open(_BUSY_FLAG_PATH) as f:
-            return json.loads(f.read())
-    except Exception:
-        return {}
-
-def _global_busy() -> bool:
-    """True if a pipeline is running AND hasn't timed out."""
-    d = _flag_data()
-    if not d:
-        return False
-    elapsed = time.time() - d.get("started_at", 0)
-    if elapsed > PIPELINE_TIMEOUT_SECS:
-        _set_global_busy(False)   # auto-expire
-        return False
-    return True
-
-def _set_global_busy(busy: bool, user_id: str = ""):
-    if busy:
-        with open(_BUSY_FLAG_PATH, "w") as f:
-            json.dump({"user_id": user_id, "started_at": time.time()}, f)
-    else:
-        try:
-            os.remove(_BUSY_FLAG_PATH)
-        except FileNotFoundError:
-            pass
-
-def _busy_user() -> str:
-    return _flag_data().get("user_id", "")
-
-def _busy_elapsed_secs() -> int:
-    d = _flag_data()
-    if not d:
-        return 0
-    return int(time.time() - d.get("started_at", time.time()))
-
-
 # ─── Supabase DB helpers ─────────────────────────────────
 
 def db_get_profile(user_id: str) -> dict:
@@ -862,11 +865,22 @@ def db_get_documents(user_id: str) -> list:
     except Exception:
         return []
 
-def db_delete_document(doc_id: str):
+def db_delete_document(doc_id: str, persist_dir: str = ""):
     try:
         supabase.table("documents").delete().eq("id", doc_id).execute()
     except Exception:
         pass
+    release_document(doc_id, persist_dir)
+
+def release_document(doc_id: str, persist_dir: str = ""):
+    """Delete a document's vector store and drop its ingestion cache reference."""
+    # a per-document vector store goes with its document
+    if is_document_store(persist_dir):
+        shutil.rmtree(persist_dir, ignore_errors=True)
+    # drop this document's hold on the shared ingestion cache entry;
+    # the entry is deleted once no document references it, and the source
+    # PDF and image blobs go with the last entry built from them
+    ingest_cache.free_sources(ingest_cache.release(doc_id))
 
 def db_save_chat_session(user_id: str, document_id: str) -> str:
     """Create a chat session, return its UUID."""
@@ -950,18 +964,19 @@ def _hash(s: str) -> str:
     """MD5 fingerprint of a string — used for deduplication."""
     return hashlib.md5(s.encode()).hexdigest()
 
-def collect_content(chunks):
+def collect_content(chunks, max_images: int = 6):
     """
     Walk retrieved chunks and return three deduplicated lists:
-      - unique_images  : base64 strings (no duplicates by content hash)
+      - image_refs     : image references (see resolve_image), at most `max_images`
       - unique_tables  : HTML strings   (no duplicates by content hash)
       - unique_texts   : raw text blocks (no duplicates by content hash)
+    Images are deduplicated by reference and not loaded here.
     """
     seen_imgs   = set()
     seen_tables = set()
     seen_texts  = set()
 
-    unique_images  = []
+    image_refs     = []
     unique_tables  = []
     unique_texts   = []
 
@@ -971,13 +986,22 @@ def collect_content(chunks):
         orig = json.loads(c.metadata["original_content"])
 
         # ── images ──
+        for h in orig.get("image_refs", []):
+            if h and ("blob", h) not in seen_imgs:
+                seen_imgs.add(("blob", h))
+                image_refs.append(("blob", h))
         for b64 in orig.get("images_base64", []):
             if not b64:
                 continue
             h = _hash(b64)
             if h not in seen_imgs:
                 seen_imgs.add(h)
-                unique_images.append(b64)
+                image_refs.append(("b64", b64))
+        for p in orig.get("pages", []):
+            key = (orig.get("doc_hash", ""), p)
+            if key[0] and key not in seen_imgs:
+                seen_imgs.add(key)
+                image_refs.append(("page", *key))
 
         # ── tables ──
         for tbl in orig.get("tables_html", []):
@@ -996,85 +1020,219 @@ def collect_content(chunks):
                 seen_texts.add(h)
                 unique_texts.append(txt)
 
-    return unique_images, unique_tables, unique_texts
+    return image_refs[:max_images], unique_tables, unique_texts
+
+
+def open_store(persist_dir: str):
+    """
+    Chroma store at `persist_dir`. Every document gets its own directory
+    under USER_PERSIST_DIR, so a query only searches the active document;
+    documents indexed before that share the user's directory.
+    """
+    from langchain_chroma import Chroma
+    return Chroma(
+        persist_directory=persist_dir,
+        embedding_function=embedding_model.get_embeddings(DEFAULT_EMBED_MODEL),   # shared, loaded once
+        collection_metadata={"hnsw:space": "cosine"},
+    )
+
 
+def is_document_store(persist_dir: str) -> bool:
+    """True for a per-document store (<persist dir>/<user>/<doc>), not a legacy shared one."""
+    parent = os.path.dirname(os.path.dirname(os.path.normpath(persist_dir)))
+    return bool(persist_dir) and os.path.normpath(parent) == os.path.normpath(DEFAULT_PERSIST_DIR)
 
-# ── Image extraction ──────────────────────────────────────────────────────────
 
-def extract_images_from_pdf(pdf_path: str, dpi: int = 150) -> dict:
+def upsert_vectors(db, ids: list, docs: list, vectors: list, batch_size: int = 1000):
     """
-    Render every page of a PDF as a PNG at `dpi` resolution using PyMuPDF.
-    Returns {page_number (1-based): base64_png_string}.
-    Captures everything — raster images, vector graphics, diagrams, formulas.
+    Write precomputed embeddings into a Chroma store without re-embedding.
+    Batched to stay under Chroma's max batch size.
     """
-    try:
-        import fitz  # PyMuPDF
-        doc    = fitz.open(pdf_path)
-        pages  = {}
-        matrix = fitz.Matrix(dpi / 72, dpi / 72)   # 72 is PDF's default DPI
-        for page in doc:
-            pix  = page.get_pixmap(matrix=matrix, alpha=False)
-            b64  = base64.b64encode(pix.tobytes("png")).decode()
-            pages[page.number + 1] = b64           # 1-based page numbers
-        doc.close()
-        return pages
-    except Exception as e:
-        return {}
+    for i in range(0, len(docs), batch_size):
+        db._collection.upsert(
+            ids=ids[i:i + batch_size],
+            embeddings=vectors[i:i + batch_size],
+            documents=[d.page_content for d in docs[i:i + batch_size]],
+            metadatas=[d.metadata for d in docs[i:i + batch_size]],
+        )
 
 
-def extract_images_from_docx(docx_path: str) -> list:
-    """Extract embedded images from a Word document as base64 PNGs."""
-    try:
-        from docx import Document as DocxDocument
-        doc    = DocxDocument(docx_path)
-        images = []
-        for rel in doc.part.rels.values():
-            if "image" in rel.reltype:
-                img_bytes = rel.target_part.blob
-                images.append(base64.b64encode(img_bytes).decode())
-        return images
-    except Exception:
-        return []
+def apply_backrefs(db, backrefs: dict):
+    """
+    Tag canonical chunks with the near-duplicates collapsed into them
+    ({canonical_id: [{"chunk", "pages"}, ...]}, see dedup.py). Chroma merges
+    metadata on update, so original_content is left as it is.
+    """
+    ids = list(backrefs)
+    for i in range(0, len(ids), 1000):
+        part = ids[i:i + 1000]
+        db._collection.update(
+            ids=part, metadatas=[{"duplicates": json.dumps(backrefs[k])} for k in part]
+        )
 
 
-def extract_images_from_pptx(pptx_path: str) -> list:
-    """Extract one rendered image per slide from a PowerPoint file."""
-    try:
-        from pptx import Presentation
-        from pptx.util import Inches
-        prs    = Presentation(pptx_path)
-        images = []
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if shape.shape_type == 13:          # MSO_SHAPE_TYPE.PICTURE = 13
-                    img_bytes = shape.image.blob
-                    images.append(base64.b64encode(img_bytes).decode())
-        return images
-    except Exception:
+def select_key_pages(pages: list) -> list:
+    """First, last and evenly spaced pages in between — at most 6."""
+    sorted_pages = sorted(pages)
+    if not sorted_pages:
         return []
+    candidates = [sorted_pages[0]]
+    if len(sorted_pages) > 1:
+        step = max(1, len(sorted_pages) // 5)
+        candidates += sorted_pages[1:-1:step]
+        candidates.append(sorted_pages[-1])
+    return list(dict.fromkeys(candidates))[:6]
+
 
+# ── Ingestion jobs ────────────────────────────────────────────────────────────
 
-def attach_page_images_to_chunks(chunks: list, page_images: dict) -> list:
+@st.fragment(run_every=2)
+def render_job_status():
     """
-    For each chunk, find which pages its elements came from and attach
-    the corresponding page renders into the chunk's image list.
-    Stores result in chunk._page_nums (a set of ints).
+    Queue position or progress of this session's ingestion job, refreshed
+    in place. Hands over to a full rerun once the job has finished.
     """
-    for chunk in chunks:
-        page_nums = set()
-        if hasattr(chunk, "metadata"):
-            if hasattr(chunk.metadata, "page_number") and chunk.metadata.page_number:
-                page_nums.add(int(chunk.metadata.page_number))
-            if hasattr(chunk.metadata, "orig_elements"):
-                for el in chunk.metadata.orig_elements:
-                    if hasattr(el, "metadata") and hasattr(el.metadata, "page_number"):
-                        if el.metadata.page_number:
-                            page_nums.add(int(el.metadata.page_number))
+    job_ref = st.session_state.ingest_job
+    job     = ingest_jobs.get(job_ref["id"]) if job_ref else None
+    if job is None or job["status"] in ("done", "failed"):
+        st.rerun()
+    info = ingest_jobs.overview()
+    if job["status"] == "queued":
+        pos = ingest_jobs.queue_position(job["id"])
+        st.markdown(f"""
+        <div class="busy-card">
+            <div class="busy-spinner"></div>
+            <div class="busy-title">Queued — #{pos} in line</div>
+            <div class="busy-sub">
+                <strong>{job_ref['name']}</strong> is uploaded and waiting for a worker
+                ({info['running']} document(s) being indexed now).<br>
+                You can leave this tab open or keep using <strong>Chat</strong> and
+                <strong>Quiz</strong> — indexing starts automatically.
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+        return
+    prog    = job["progress"] or {}
+    elapsed = int(time.time() - (job["started"] or time.time()))
+    st.markdown(f"""
+    <div class="busy-card">
+        <div class="busy-spinner"></div>
+        <div class="busy-title">Indexing {job_ref['name']}</div>
+        <div class="busy-sub">
+            {prog.get('message') or 'Starting…'}<br>
+            <strong>Running for {elapsed // 60}m {elapsed % 60:02d}s</strong>
+            · {ingest_jobs.queued_after(job['id'])} waiting behind
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+    st.progress(min(float(prog.get("fraction", 0.0)), 1.0))
+
+
+def drop_unsaved_document():
+    """Release the session's unsaved document (see finish_ingest), if any."""
+    unsaved = st.session_state.get("unsaved_doc")
+    if unsaved:
+        release_document(unsaved["ref"], unsaved["persist_dir"])
+        st.session_state.unsaved_doc = None
+
+
+def finish_ingest(cache_key: str, name: str, ext: str):
+    """
+    Copy a finished ingest_cache entry into this user's vector store and
+    make it the active document (Supabase record, chat session, summary).
+    The heavy work already happened in a worker, or for an earlier upload
+    of the same bytes.
+    """
+    with st.status("Adding to your library…", expanded=True) as status:
+        pin, persist_dir = None, ""
         try:
-            chunk._page_nums = page_nums
-        except Exception:
-            pass   # some unstructured objects are frozen — we'll fall back below
-    return chunks
+            from langchain_core.documents import Document
+
+            # pinned before the copy, so the entry cannot be freed under it
+            pin  = ingest_cache.pin(cache_key)
+            meta = ingest_cache.load_meta(cache_key) if pin else None
+            if meta is None:
+                raise RuntimeError("The indexed document is no longer cached — please run the pipeline again.")
+
+            drop_unsaved_document()
+            persist_dir = os.path.join(USER_PERSIST_DIR, uuid.uuid4().hex)   # this document only
+            db = open_store(persist_dir)
+            for records, vectors in ingest_cache.iter_records(cache_key, EMBED_BATCH_SIZE):
+                batch = [Document(page_content=r["page_content"], metadata=r["metadata"])
+                         for r in records]
+                upsert_vectors(db, [r["id"] for r in records], batch, vectors)
+            apply_backrefs(db, meta.get("backrefs", {}))
+            docs = ChunkPages(db)      # read back from the store on demand
+
+            doc_hash   = meta.get("doc_hash", "")
+            page_count = meta.get("page_count", 0)
+            st.session_state.metrics = {
+                "elements":   meta.get("elements", 0),
+                "chunks":     meta.get("chunks", len(docs)),
+                "docs":       len(docs),
+                "duplicates": meta.get("duplicates", 0),
+                "dedup_rate": meta.get("dedup_rate", 0.0),
+            }
+            st.write(f"✅ {st.session_state.metrics['elements']} elements · "
+                     f"{st.session_state.metrics['chunks']} chunks")
+
+            st.session_state.db               = db
+            st.session_state.processed_chunks = docs
+            st.session_state.pipeline_ran     = True
+            st.session_state.doc_name         = name
+            st.session_state.page_source      = {"doc_hash": doc_hash, "page_count": page_count}
+            st.session_state.summary          = None
+            log(f"Vector store ready → {persist_dir}", "success")
+            st.write(f"✅ {len(docs)} docs indexed")
+
+            # ── save document record to Supabase ──────
+            doc_id = db_save_document(
+                user_id     = st.session_state.user.id,
+                name        = name,
+                file_type   = ext,
+                chunk_count = len(docs),
+                page_count  = page_count,
+                persist_dir = persist_dir,
+            )
+            st.session_state.active_doc_id = doc_id
+            if doc_id:
+                ingest_cache.acquire(cache_key, doc_id)
+                ingest_cache.release(pin)
+                log(f"Document saved to DB: {doc_id}", "success")
+            else:
+                # no record to release it later — the pin holds the entry (and
+                # this store) for the session, freed when it moves on or the
+                # pin expires
+                st.session_state.unsaved_doc = {"ref": pin, "persist_dir": persist_dir}
+                log("Could not save the document record — it is kept for this session only")
+            pin = None
+
+            # ── trigger upgrade nudge after 3rd document ──
+            if not st.session_state.on_waitlist:
+                _doc_count = len(db_get_documents(st.session_state.user.id))
+                if _doc_count >= 3:
+                    st.session_state.upgrade_trigger = "doc_limit"
+
+            # ── open a fresh chat session ──────────────
+            if doc_id:
+                sess_id = db_save_chat_session(st.session_state.user.id, doc_id)
+                st.session_state.chat_session_id = sess_id
+
+            # 5 ─ summary and other enrichment run after indexing, in the
+            #     background — the document is searchable right away
+            start_summary_task(name)
+            st.write("📝 Summary is being written in the background (see the Summary tab)")
+
+            status.update(label="Pipeline complete ✅", state="complete")
+
+        except Exception as e:
+            if pin:
+                # failed before a document took the entry over: drop the copy and the pin
+                release_document(pin, persist_dir)
+            log(f"Pipeline failed: {e}", "error")
+            status.update(label=f"Failed: {e}", state="error")
+            st.error(str(e))
+
 
 
 # ── General knowledge detection ───────────────────────────────────────────────
@@ -1114,6 +1272,7 @@ def should_use_general_knowledge(query: str, retrieved_docs, scores: list) -> tu
 def render_answer(answer: str, images: list, is_gk: bool = False):
     """
     Render the LLM answer with full markdown + LaTeX support.
+    `images` are references (see resolve_image), loaded only when shown.
     is_gk=True renders with amber styling + disclaimer banner.
     """
     if is_gk:
@@ -1137,54 +1296,18 @@ def render_answer(answer: str, images: list, is_gk: bool = False):
     if images and not is_gk:           # only show doc images for doc answers
         st.markdown('<div class="img-lbl">📷 Referenced figures from document</div>', unsafe_allow_html=True)
         cols = st.columns(min(len(images), 3))
-        for i, b64 in enumerate(images[:6]):
+        for i, ref in enumerate(images[:6]):
             try:
-                cols[i % len(cols)].image(base64.b64decode(b64), use_container_width=True)
+                cols[i % len(cols)].image(base64.b64decode(resolve_image(ref)), use_container_width=True)
             except Exception:
                 pass
 
-def _is_quota_error(e: Exception) -> bool:
-    s = str(e)
-    return "429" in s or "RESOURCE_EXHAUSTED" in s or "quota" in s.lower()
-
-def _groq_messages(gemini_messages):
-    """
-    Convert a LangChain HumanMessage list (which may contain image_url blocks)
-    into plain-text-only messages safe for Groq (no vision support).
-    Images are dropped; everything else is kept.
-    """
-    from langchain_core.messages import HumanMessage as HM
-    plain_parts = []
-    for msg in gemini_messages:
-        if hasattr(msg, "content"):
-            if isinstance(msg.content, str):
-                plain_parts.append(msg.content)
-            elif isinstance(msg.content, list):
-                for block in msg.content:
-                    if isinstance(block, dict) and block.get("type") == "text":
-                        plain_parts.append(block["text"])
-                    # image_url blocks are silently dropped — Groq can't handle them
-    return [HM(content="\n\n".join(plain_parts))]
-
 def invoke_with_fallback(messages, status_slot=None):
     """
-    Tier 1 — Gemini (vision-capable, 20 req/day free).
-    Tier 2 — Groq / llama-3.3-70b (text+tables only, 14,400 req/day free).
-
-    On a quota/rate-limit error from Gemini, switches to Groq immediately
-    and shows the user a small notice. Any non-quota error is re-raised.
+    llm_client.invoke_with_fallback (Gemini, then Groq on a quota error),
+    showing the user a small notice in `status_slot` when it switches.
     """
-    from langchain_google_genai import ChatGoogleGenerativeAI
-    from langchain_core.messages import HumanMessage
-
-    # ── Tier 1: Gemini ───────────────────────────────────
-    try:
-        llm = ChatGoogleGenerativeAI(model=DEFAULT_LLM_MODEL, temperature=0)
-        return llm.invoke(messages), "gemini"
-    except Exception as e:
-        if not _is_quota_error(e):
-            raise
-        # quota hit → fall through to Groq
+    def notice():
         if status_slot:
             status_slot.markdown(
                 '<div style="background:#1a1a1a; border:1px solid #2a2a2a; '
@@ -1194,20 +1317,11 @@ def invoke_with_fallback(messages, status_slot=None):
                 'Images won\'t be analysed this turn but will still display.</div>',
                 unsafe_allow_html=True
             )
+    return llm_client.invoke_with_fallback(messages, DEFAULT_LLM_MODEL, on_fallback=notice)
 
-    # ── Tier 2: Groq ────────────────────────────────────
-    try:
-        from langchain_groq import ChatGroq
-        groq_llm  = ChatGroq(model="llama-3.3-70b-versatile", temperature=0)
-        groq_msgs = _groq_messages(messages)   # strip image blocks
-        return groq_llm.invoke(groq_msgs), "groq"
-    except Exception as e2:
-        if _is_quota_error(e2):
-            raise RuntimeError(
-                "Both Gemini and Groq have hit their rate limits. "
-                "Please wait a few minutes and try again."
-            ) from e2
-        raise
+def invoke_cached(content: list, validate=None) -> str:
+    """llm_client.invoke_cached with the app's model (memoised on disk by llm_cache)."""
+    return llm_client.invoke_cached(content, validate, DEFAULT_LLM_MODEL)
 
 def generate_quiz(num_questions: int, difficulty: str) -> list:
     """
@@ -1218,9 +1332,7 @@ def generate_quiz(num_questions: int, difficulty: str) -> list:
     from langchain_core.messages import HumanMessage
 
     # sample up to 6 chunks as context so we cover the doc breadth
-    docs = st.session_state.processed_chunks
-    import random
-    sample = random.sample(docs, min(6, len(docs)))
+    sample = st.session_state.processed_chunks.sample(6)
     context = "\n\n---\n\n".join(
         json.loads(d.metadata["original_content"]).get("raw_text", d.page_content)[:600]
         for d in sample
@@ -1354,8 +1466,6 @@ def _summarise_batch(texts: list, tables: list, images: list,
     Summarise one batch of text chunks. Returns a partial summary dict.
     Batching prevents context-window overflow on long documents.
     """
-    from langchain_core.messages import HumanMessage
-
     joined = "\n\n---\n\n".join(texts)
     # hard cap per batch — Groq context limit is ~32k tokens (~24k chars safe)
     if len(joined) > 24_000:
@@ -1365,7 +1475,8 @@ def _summarise_batch(texts: list, tables: list, images: list,
     for i, t in enumerate(tables[:3]):
         table_ctx += f"\nTABLE {i+1}:\n{t}\n"
 
-    part_note = f"(Part {batch_num} of {total_batches})" if total_batches > 1 else ""
+    part_note  = f"(Part {batch_num} of {total_batches})" if total_batches > 1 else ""
+    img_blocks = image_norm.image_blocks(images)    # what fits the byte budget
 
     prompt = f"""You are an expert academic summariser. Summarise the document content below {part_note}.
 
@@ -1374,7 +1485,7 @@ DOCUMENT: {doc_name}
 CONTENT:
 {joined}
 {f"TABLES:{table_ctx}" if table_ctx else ""}
-{f"FIGURES: {len(images)} page image(s) attached." if images else ""}
+{f"FIGURES: {len(img_blocks)} page image(s) attached." if img_blocks else ""}
 
 Return ONLY a valid JSON object — no markdown fences, no explanation, no text outside the JSON.
 If a value would contain a double-quote character, escape it as \\".
@@ -1411,13 +1522,9 @@ RULES:
 - takeaways[] = 5-10 items minimum
 - Return ONLY the JSON object. Nothing else."""
 
-    content = [{"type": "text", "text": prompt}]
-    for b64 in images[:2]:
-        mime = "image/png" if b64.startswith("iVBOR") else "image/jpeg"
-        content.append({"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64}"}})
-
-    response, _ = invoke_with_fallback([HumanMessage(content=content)])
-    return _safe_parse_json(response.content)
+    content = [{"type": "text", "text": prompt}] + img_blocks
+    raw     = invoke_cached(content, validate=lambda r: bool(_safe_parse_json(r)))
+    return _safe_parse_json(raw)
 
 
 def _merge_summaries(parts: list) -> dict:
@@ -1473,20 +1580,22 @@ def _merge_summaries(parts: list) -> dict:
     return merged
 
 
-def generate_summary(doc_name: str) -> dict:
+def generate_summary(docs, source: dict, doc_name: str, progress=None) -> tuple:
     """
-    Generate a full structured summary of the indexed document.
+    Generate a full structured summary of the indexed document. Runs as a
+    post_index task, so it must not touch st.* — returns
+    (summary, key page images, tables) for the session to pick up, and
+    reports progress(done, total, message) per batch. `docs` is any
+    iterable of chunks — a ChunkPages is read a page at a time.
 
     Strategy:
     - Collect all unique text chunks and tables
     - Split into batches of ~20k chars to stay within Groq's context limit
     - Summarise each batch independently
     - Merge all partial summaries into one coherent result
-    - Cache key page images for display
+    - Return key page images for display
     """
-    docs        = st.session_state.processed_chunks
-    page_images = st.session_state.get("all_page_images", {})
-
+    progress = progress or (lambda *a: None)
     # ── Collect unique texts and tables ───────────────────
     all_texts  = []
     all_tables = []
@@ -1510,16 +1619,9 @@ def generate_summary(doc_name: str) -> dict:
 
     # ── Select key page images (first, last, evenly spaced) ───────────────
     key_images = []
-    if page_images:
-        sorted_pages = sorted(page_images.keys())
-        total        = len(sorted_pages)
-        candidates   = [sorted_pages[0]]
-        if total > 1:
-            step = max(1, total // 5)
-            candidates += sorted_pages[1:-1:step]
-            candidates.append(sorted_pages[-1])
-        candidates = list(dict.fromkeys(candidates))[:6]
-        key_images = [page_images[p] for p in candidates]
+    if source.get("doc_hash"):
+        key_pages  = select_key_pages(list(range(1, source.get("page_count", 0) + 1)))
+        key_images = [b for b in (page_cache.get_page(source["doc_hash"], p) for p in key_pages) if b]
 
     # ── Batch texts into ~20k char chunks ─────────────────
     BATCH_CHAR_LIMIT = 20_000
@@ -1544,6 +1646,7 @@ def generate_summary(doc_name: str) -> dict:
     parts = []
     total_batches = len(batches)
     for i, batch_texts in enumerate(batches):
+        progress(i, total_batches + 1, f"Summarising part {i + 1} of {total_batches}…")
         # distribute images across batches (2 per batch max)
         batch_imgs = key_images[i * 2: i * 2 + 2]
         # tables only on first batch
@@ -1555,12 +1658,9 @@ def generate_summary(doc_name: str) -> dict:
         parts.append(part)
 
     # ── Merge all parts ────────────────────────────────────
+    progress(total_batches, total_batches + 1, "Merging parts…")
     summary = _merge_summaries(parts)
 
-    # ── Cache images and tables for the UI ────────────────
-    st.session_state.summary_images = key_images
-    st.session_state.summary_tables = all_tables
-
     # ── Ensure required keys always exist ─────────────────
     for key, default in {
         "topic": doc_name, "plain_english": "",
@@ -1570,7 +1670,74 @@ def generate_summary(doc_name: str) -> dict:
         if key not in summary:
             summary[key] = default
 
-    return summary
+    return summary, key_images, all_tables
+
+
+def start_summary_task(doc_name: str):
+    """
+    Generate the summary in the background (post_index) from this session's
+    chunks; the Summary tab shows progress and collects the result.
+    """
+    cancel_summary_task()
+    key = f"summary:{_uid}:{uuid.uuid4().hex}"
+    post_index.submit(key, generate_summary,
+                      st.session_state.processed_chunks,
+                      dict(st.session_state.get("page_source") or {}),
+                      doc_name)
+    st.session_state.summary_task  = key
+    st.session_state.summary_error = ""
+
+
+def cancel_summary_task():
+    """Stop the session's running summary, so it stops using LLM rate-limit slots."""
+    if st.session_state.get("summary_task"):
+        post_index.cancel(st.session_state.summary_task)
+        st.session_state.summary_task = None
+
+
+def collect_summary() -> str:
+    """
+    Move a finished summary task's result into session state. Returns the
+    task state ("running", "done", "failed") or None when there is no task.
+    """
+    key  = st.session_state.summary_task
+    task = post_index.get(key) if key else None
+    if task is None:
+        st.session_state.summary_task = None
+        return None
+    if task["state"] == "done":
+        (st.session_state.summary,
+         st.session_state.summary_images,
+         st.session_state.summary_tables) = task["result"]
+        log("Summary generated", "success")
+    elif task["state"] == "failed":
+        st.session_state.summary_error = task["error"]
+        log(f"Summary generation failed: {task['error']}", "error")
+    if task["state"] != "running":
+        post_index.discard(key)
+        st.session_state.summary_task = None
+    return task["state"]
+
+
+@st.fragment(run_every=2)
+def render_summary_status():
+    """Progress of the background summary; reruns the app once it lands."""
+    if collect_summary() != "running":
+        st.rerun()
+    prog = post_index.get(st.session_state.summary_task)["progress"]
+    st.markdown(f"""
+    <div class="busy-card">
+        <div class="busy-spinner"></div>
+        <div class="busy-title">Writing your summary…</div>
+        <div class="busy-sub">
+            {prog.get('message') or 'Starting…'}<br>
+            The document is already indexed — <strong>Chat</strong> and <strong>Quiz</strong>
+            work while this runs.
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+    if prog.get("total"):
+        st.progress(min(prog["done"] / prog["total"], 1.0))
 
 
 # ─── Auth UI ─────────────────────────────────────────────
@@ -1804,14 +1971,16 @@ if _qp.get("action") == "signout":
         supabase.auth.sign_out()
     except Exception:
         pass
+    drop_unsaved_document()
+    cancel_summary_task()
     for _k, _v in {
         "user": None, "profile": None, "db": None,
         "summary": None, "active_doc_id": None,
         "processed_chunks": [], "chat_history": [],
-        "summary_images": [], "summary_tables": [],
+        "summary_images": [], "summary_tables": [], "summary_task": None,
         "quiz_questions": [], "logs": [],
-        "all_page_images": {}, "quiz_answers": {},
-        "metrics": {"elements": 0, "chunks": 0, "docs": 0},
+        "page_source": {}, "quiz_answers": {}, "ingest_job": None, "unsaved_doc": None,
+        "metrics": {"elements": 0, "chunks": 0, "docs": 0, "duplicates": 0},
         "pipeline_ran": False, "quiz_submitted": False,
         "doc_name": "", "anon_uid": "",
         "auth_screen": "signin", "auth_error": "", "auth_ok": "",
@@ -1924,22 +2093,27 @@ with tab_ingest:
                     persist = doc.get("persist_dir", "")
                     if persist and os.path.exists(persist):
                         try:
-                            from langchain_huggingface import HuggingFaceEmbeddings
-                            from langchain_chroma import Chroma
-                            embeddings = HuggingFaceEmbeddings(
-                                model_name=DEFAULT_EMBED_MODEL,
-                                model_kwargs={"device": "cpu"},
-                            )
-                            st.session_state.db = Chroma(
-                                persist_directory=persist,
-                                embedding_function=embeddings,
-                                collection_metadata={"hnsw:space": "cosine"},
-                            )
+                            drop_unsaved_document()
+                            db    = open_store(persist)
+                            pages = ChunkPages(db)     # nothing read until a tab needs it
+                            st.session_state.db               = db
+                            st.session_state.processed_chunks = pages
+                            st.session_state.page_source      = {
+                                **pages.source(), "page_count": doc.get("page_count") or 0,
+                            }
+                            st.session_state.metrics          = {
+                                "elements":   "—",
+                                "chunks":     doc.get("chunk_count") or len(pages),
+                                "docs":       len(pages),
+                                "duplicates": 0,
+                            }
                             st.session_state.pipeline_ran  = True
                             st.session_state.doc_name      = doc["name"]
                             st.session_state.active_doc_id = doc["id"]
                             st.session_state.chat_history  = []
                             st.session_state.summary       = None
+                            st.session_state.summary_error = ""
+                            cancel_summary_task()
                             st.success(f"✅ Loaded: {doc['name']}")
                             st.rerun()
                         except Exception as e:
@@ -1949,11 +2123,13 @@ with tab_ingest:
             with col_del:
                 if st.button("🗑️", key=f"del_{doc['id']}",
                              help="Delete this document"):
-                    db_delete_document(doc["id"])
+                    db_delete_document(doc["id"], doc.get("persist_dir", ""))
                     if st.session_state.active_doc_id == doc["id"]:
+                        cancel_summary_task()
                         st.session_state.pipeline_ran  = False
-                        st.session_state.db            = None
-                        st.session_state.active_doc_id = None
+                        st.session_state.db               = None
+                        st.session_state.processed_chunks = []
+                        st.session_state.active_doc_id    = None
                     st.rerun()
 
         st.markdown('<div class="sec-div"><hr/><span class="sec-lbl">Index New Document</span><hr/></div>',
@@ -1979,44 +2155,27 @@ with tab_ingest:
         </div>
         """, unsafe_allow_html=True)
 
+    job_ref = st.session_state.ingest_job
     run_btn = st.button(
         "Run Pipeline →",
-        disabled=(uploaded_file is None or (_global_busy() and _busy_user() != _uid))
+        disabled=(uploaded_file is None or job_ref is not None)
     )
 
-    # ── busy notice for OTHER users ──────────────────────
-    if _global_busy() and _busy_user() != _uid:
-        elapsed  = _busy_elapsed_secs()
-        remain   = max(0, PIPELINE_TIMEOUT_SECS - elapsed)
-        mins_el  = elapsed // 60
-        secs_el  = elapsed % 60
-        mins_rem = remain // 60
-
-        st.markdown(f"""
-        <div class="busy-card">
-            <div class="busy-spinner"></div>
-            <div class="busy-title">Pipeline in use</div>
-            <div class="busy-sub">
-                Another user is currently indexing a document.<br>
-                <strong>Running for {mins_el}m {secs_el:02d}s</strong>
-                · auto-unlocks in ~{mins_rem} min if stuck.<br><br>
-                You can still use the <strong>Chat</strong> and <strong>Quiz</strong> tabs
-                if you've already indexed a document, or wait here and the button
-                will unlock automatically when they're done.
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
-
-        col_refresh, col_force = st.columns([3, 1])
-        with col_force:
-            if st.button("🔓 Force unlock", help="Use this if the pipeline has been stuck for more than 10 minutes"):
-                _set_global_busy(False)
-                st.success("Unlocked. You can now run the pipeline.")
+    # ── this session's ingestion job (runs in a worker process) ──
+    if job_ref:
+        job = ingest_jobs.get(job_ref["id"])
+        if job is None or job["status"] in ("done", "failed"):
+            st.session_state.logs.extend(ingest_jobs.logs(job_ref["id"]))
+            ingest_jobs.forget(job_ref["id"])
+            st.session_state.ingest_job = None
+            if job and job["status"] == "done":
+                finish_ingest(job_ref["cache_key"], job_ref["name"], job_ref["ext"])
                 st.rerun()
-
-        # auto-refresh every 8s so button unlocks without manual reload
-        time.sleep(8)
-        st.rerun()
+            log(f"Pipeline failed: {(job or {}).get('error') or 'job lost'}", "error")
+            st.error(f"Indexing {job_ref['name']} failed: {(job or {}).get('error') or 'job lost'}. "
+                     "Run the pipeline again on the same file to resume from where it stopped.")
+        else:
+            render_job_status()
 
     # supported formats strip
     st.markdown("""
@@ -2043,6 +2202,7 @@ with tab_ingest:
             <div class="metric-tile"><div class="metric-num">{m['elements']}</div><div class="metric-lbl">Elements</div></div>
             <div class="metric-tile"><div class="metric-num">{m['chunks']}</div><div class="metric-lbl">Chunks</div></div>
             <div class="metric-tile"><div class="metric-num">{m['docs']}</div><div class="metric-lbl">Indexed</div></div>
+            <div class="metric-tile"><div class="metric-num">{m.get('dedup_rate', 0):.0%}</div><div class="metric-lbl">Duplicates</div></div>
         </div>
         """, unsafe_allow_html=True)
 
@@ -2052,372 +2212,37 @@ with tab_ingest:
             orig    = json.loads(doc.metadata.get("original_content", "{}"))
             tags    = '<span class="tag t-text">text</span>'
             if orig.get("tables_html"):   tags += '<span class="tag t-table">table</span>'
-            if orig.get("images_base64"): tags += '<span class="tag t-image">image</span>'
+            if orig.get("images_base64") or orig.get("image_refs") or orig.get("pages"):
+                tags += '<span class="tag t-image">image</span>'
             with st.expander(f"Chunk {i + 1}"):
                 st.markdown(f'<div style="margin-bottom:6px">{tags}</div>', unsafe_allow_html=True)
                 st.markdown(f'<div class="chunk-card">{preview}</div>', unsafe_allow_html=True)
 
     # ── pipeline execution ──
-    if run_btn and uploaded_file and not (_global_busy() and _busy_user() != _uid):
+    if run_btn and uploaded_file and st.session_state.ingest_job is None:
         st.session_state.logs = []
-        _set_global_busy(True, _uid)  # 🔒 lock
-
-        with st.status("Running pipeline…", expanded=True) as status:
-            try:
-                st.write("📂 Saving file…")
-                ext      = uploaded_file.name.rsplit(".", 1)[-1].lower()
-                with tempfile.NamedTemporaryFile(delete=False, suffix=f".{ext}") as tmp:
-                    tmp.write(uploaded_file.read())
-                    tmp_path = tmp.name
-                log(f"Saved → {tmp_path}")
-
-                st.write("📦 Loading modules…")
-                from unstructured.chunking.title import chunk_by_title
-                from langchain_core.documents import Document
-                from langchain_huggingface import HuggingFaceEmbeddings
-                from langchain_chroma import Chroma
-                log("Modules loaded", "success")
-
-                # 1 ─ partition (route by file type) ──────────────────────
-                f_label = SUPPORTED_TYPES.get(ext, ("Document", "📄"))[0]
-                st.write(f"📄 Partitioning {f_label}…")
-
-                elements = []
-
-                if ext == "pdf":
-                    # ── Tier 1: unstructured fast (best structured output) ──
-                    try:
-                        from unstructured.partition.pdf import partition_pdf
-                        elements = partition_pdf(
-                            filename=tmp_path,
-                            strategy="fast",
-                            infer_table_structure=True,
-                        )
-                        log(f"Tier 1 (unstructured fast): {len(elements)} elements")
-                    except Exception as e:
-                        log(f"Tier 1 failed: {e}", "error")
-                        elements = []
-
-                    # ── Tier 2: PyMuPDF text extraction ───────────────────
-                    if not elements:
-                        st.write("⚠️ Standard extraction got 0 elements — trying PyMuPDF text…")
-                        try:
-                            import fitz
-                            from unstructured.documents.elements import Text, Title
-                            doc_fitz = fitz.open(tmp_path)
-                            for page in doc_fitz:
-                                page_text = page.get_text("text").strip()
-                                if page_text:
-                                    # split into paragraphs on double newlines
-                                    blocks = [b.strip() for b in page_text.split("\n\n") if b.strip()]
-                                    for j, block in enumerate(blocks):
-                                        # first block of each page treated as title candidate
-                                        if j == 0 and len(block) < 120:
-                                            el = Title(text=block)
-                                        else:
-                                            el = Text(text=block)
-                                        el.metadata.page_number = page.number + 1
-                                        elements.append(el)
-                            doc_fitz.close()
-                            log(f"Tier 2 (PyMuPDF text): {len(elements)} elements")
-                            if elements:
-                                st.write(f"✅ PyMuPDF extracted {len(elements)} text blocks")
-                        except Exception as e:
-                            log(f"Tier 2 failed: {e}", "error")
-                            elements = []
-
-                    # ── Tier 3: Tesseract OCR on page renders ─────────────
-                    if not elements:
-                        st.write("⚠️ No text layer found — running OCR on page images…")
-                        try:
-                            import fitz
-                            import pytesseract
-                            from PIL import Image as PILImage
-                            import io
-                            from unstructured.documents.elements import Text
-                            doc_fitz  = fitz.open(tmp_path)
-                            matrix    = fitz.Matrix(2.0, 2.0)   # 2x scale for better OCR
-                            for page in doc_fitz:
-                                pix      = page.get_pixmap(matrix=matrix, alpha=False)
-                                img      = PILImage.open(io.BytesIO(pix.tobytes("png")))
-                                ocr_text = pytesseract.image_to_string(img).strip()
-                                if ocr_text:
-                                    blocks = [b.strip() for b in ocr_text.split("\n\n") if b.strip()]
-                                    for block in blocks:
-                                        el = Text(text=block)
-                                        el.metadata.page_number = page.number + 1
-                                        elements.append(el)
-                            doc_fitz.close()
-                            log(f"Tier 3 (OCR): {len(elements)} elements")
-                            if elements:
-                                st.write(f"✅ OCR extracted {len(elements)} text blocks")
-                        except Exception as e:
-                            log(f"Tier 3 (OCR) failed: {e}", "error")
-
-                elif ext == "docx":
-                    from unstructured.partition.docx import partition_docx
-                    elements = partition_docx(filename=tmp_path)
-                elif ext == "pptx":
-                    from unstructured.partition.pptx import partition_pptx
-                    elements = partition_pptx(filename=tmp_path)
-                elif ext == "xlsx":
-                    from unstructured.partition.xlsx import partition_xlsx
-                    elements = partition_xlsx(filename=tmp_path)
-                elif ext in ("png", "jpg", "jpeg"):
-                    # images: OCR directly
-                    try:
-                        import pytesseract
-                        from PIL import Image as PILImage
-                        from unstructured.documents.elements import Text
-                        img      = PILImage.open(tmp_path)
-                        ocr_text = pytesseract.image_to_string(img).strip()
-                        if ocr_text:
-                            for block in [b.strip() for b in ocr_text.split("\n\n") if b.strip()]:
-                                elements.append(Text(text=block))
-                    except Exception:
-                        from unstructured.partition.image import partition_image
-                        elements = partition_image(filename=tmp_path, strategy="fast")
-                elif ext == "html":
-                    from unstructured.partition.html import partition_html
-                    elements = partition_html(filename=tmp_path)
-                elif ext == "csv":
-                    from unstructured.partition.csv import partition_csv
-                    elements = partition_csv(filename=tmp_path)
-                elif ext in ("txt", "md"):
-                    from unstructured.partition.text import partition_text
-                    elements = partition_text(filename=tmp_path)
-                else:
-                    from unstructured.partition.auto import partition
-                    elements = partition(filename=tmp_path)
-
-                # final check — if still empty after all fallbacks, abort cleanly
-                if not elements:
-                    raise ValueError(
-                        "Could not extract any text from this document after trying "
-                        "three methods (unstructured, PyMuPDF text layer, OCR). "
-                        "The file may be corrupted, password-protected, or contain "
-                        "only non-readable content."
-                    )
-
-                st.session_state.metrics["elements"] = len(elements)
-                log(f"{len(elements)} elements extracted total", "success")
-                st.write(f"✅ {len(elements)} elements extracted")
-
-                # 1b ─ extract page images ────────────────────────────────
-                st.write("🖼️ Extracting images…")
-                page_images  = {}
-                loose_images = []
-
-                if ext == "pdf":
-                    page_images = extract_images_from_pdf(tmp_path, dpi=150)
-                    log(f"{len(page_images)} page renders captured", "success")
-                elif ext == "docx":
-                    loose_images = extract_images_from_docx(tmp_path)
-                    log(f"{len(loose_images)} images from DOCX", "success")
-                elif ext == "pptx":
-                    loose_images = extract_images_from_pptx(tmp_path)
-                    log(f"{len(loose_images)} images from PPTX", "success")
-
-                if page_images or loose_images:
-                    st.write(f"✅ {len(page_images) or len(loose_images)} image(s) captured")
-
-                # 2 ─ chunk ───────────────────────────────────────────────
-                st.write("🔨 Chunking…")
-                try:
-                    chunks = chunk_by_title(
-                        elements,
-                        max_characters=DEFAULT_MAX_CHARS,
-                        new_after_n_chars=DEFAULT_NEW_AFTER,
-                        combine_text_under_n_chars=DEFAULT_COMBINE,
-                    )
-                except Exception:
-                    # chunk_by_title occasionally fails on synthetic elements
-                    # fall back to simple fixed-size chunking
-                    from langchain_core.documents import Document as LC_Doc
-                    from unstructured.documents.elements import Text as UText
-                    chunk_size = DEFAULT_MAX_CHARS
-                    all_text   = "\n\n".join(el.text for el in elements if hasattr(el, "text") and el.text)
-                    raw_chunks = [all_text[i:i+chunk_size] for i in range(0, len(all_text), chunk_size)]
-
-                    # wrap as minimal objects with .text attribute
-                    class _SimpleChunk:
-                        def __init__(self, text, page_num=None):
-                            self.text = text
-                            class _Meta:
-                                pass
-                            self.metadata         = _Meta()
-                            self.metadata.page_number    = page_num
-                            self.metadata.orig_elements  = []
-                    chunks = [_SimpleChunk(t) for t in raw_chunks if t.strip()]
-                    log("Used simple fixed-size chunking fallback", "error")
-
-                if page_images:
-                    chunks = attach_page_images_to_chunks(chunks, page_images)
-
-                st.session_state.metrics["chunks"] = len(chunks)
-                log(f"{len(chunks)} chunks created", "success")
-                st.write(f"✅ {len(chunks)} chunks")
-
-                # 3 ─ AI summarise
-                st.write("🧠 Generating AI summaries…")
-                prog = st.progress(0)
-
-                def separate(chunk, chunk_idx=0):
-                    d = {"text": chunk.text, "tables": [], "images": []}
-
-                    # ── resolve page numbers from chunk metadata ──────────
-                    page_nums = set()
-                    if hasattr(chunk, "_page_nums"):
-                        page_nums = chunk._page_nums
-                    elif hasattr(chunk, "metadata"):
-                        if hasattr(chunk.metadata, "page_number") and chunk.metadata.page_number:
-                            page_nums.add(int(chunk.metadata.page_number))
-                        if hasattr(chunk.metadata, "orig_elements"):
-                            for el in chunk.metadata.orig_elements:
-                                if hasattr(el, "metadata") and hasattr(el.metadata, "page_number"):
-                                    if el.metadata.page_number:
-                                        page_nums.add(int(el.metadata.page_number))
-
-                    # ── PDF: pull rendered page images by page number ──────
-                    if page_images:
-                        if page_nums:
-                            for p in sorted(page_nums):
-                                if p in page_images:
-                                    d["images"].append(page_images[p])
-                        else:
-                            # no page number metadata — distribute proportionally
-                            total_pages = len(page_images)
-                            total_chunks = max(len(chunks), 1)
-                            pages_per_chunk = max(1, total_pages // total_chunks)
-                            start_page = chunk_idx * pages_per_chunk + 1
-                            end_page   = start_page + pages_per_chunk
-                            sorted_pages = sorted(page_images.keys())
-                            for p in sorted_pages[start_page - 1 : end_page - 1]:
-                                d["images"].append(page_images[p])
-
-                    # ── DOCX/PPTX: distribute loose images evenly ─────────
-                    if loose_images:
-                        total_chunks = max(len(chunks), 1)
-                        per_chunk    = max(1, len(loose_images) // total_chunks)
-                        start        = chunk_idx * per_chunk
-                        d["images"].extend(loose_images[start: start + per_chunk])
-
-                    # ── tables from unstructured elements ─────────────────
-                    if hasattr(chunk, "metadata") and hasattr(chunk.metadata, "orig_elements"):
-                        for el in chunk.metadata.orig_elements:
-                            if type(el).__name__ == "Table":
-                                d["tables"].append(getattr(el.metadata, "text_as_html", el.text))
-
-                    return d
-
-                def ai_summary(text, tables, images):
-                    try:
-                        from langchain_core.messages import HumanMessage
-                        p = f"Create a detailed, searchable description for retrieval.\n\nTEXT:\n{text}\n\n"
-                        for i, t in enumerate(tables):
-                            p += f"TABLE {i+1}:\n{t}\n\n"
-                        p += "Cover key facts, numbers, topics, questions this answers, search terms, and describe any visible diagrams, figures, or formulas.\n\nDESCRIPTION:"
-                        content = [{"type": "text", "text": p}]
-                        # cap at 2 images per summary — page renders are large
-                        for img in images[:2]:
-                            # page renders are PNG; embedded images may be JPEG
-                            mime = "image/png" if img.startswith("iVBOR") else "image/jpeg"
-                            content.append({
-                                "type": "image_url",
-                                "image_url": {"url": f"data:{mime};base64,{img}"}
-                            })
-                        response, _ = invoke_with_fallback([HumanMessage(content=content)])
-                        return response.content
-                    except Exception as e:
-                        log(f"AI summary error: {e}", "error")
-                        return text
-
-                docs = []
-                for i, chunk in enumerate(chunks):
-                    cd = separate(chunk, chunk_idx=i)
-                    enhanced = (
-                        ai_summary(cd["text"], cd["tables"], cd["images"])
-                        if (cd["tables"] or cd["images"]) else cd["text"]
-                    )
-                    docs.append(Document(
-                        page_content=enhanced,
-                        metadata={"original_content": json.dumps({
-                            "raw_text":     cd["text"],
-                            "tables_html":  cd["tables"],
-                            "images_base64": cd["images"],
-                        })}
-                    ))
-                    prog.progress((i + 1) / len(chunks))
-
-                log(f"{len(docs)} docs processed", "success")
-                st.write(f"✅ {len(docs)} docs processed")
-
-                # 4 ─ vector store
-                st.write("🔮 Building vector store…")
-                embeddings = HuggingFaceEmbeddings(
-                    model_name=DEFAULT_EMBED_MODEL,
-                    model_kwargs={"device": "cpu"},
-                )
-                db = Chroma.from_documents(
-                    documents=docs,
-                    embedding=embeddings,
-                    persist_directory=USER_PERSIST_DIR,
-                    collection_metadata={"hnsw:space": "cosine"},
-                )
-
-                st.session_state.db               = db
-                st.session_state.processed_chunks = docs
-                st.session_state.metrics["docs"]  = len(docs)
-                st.session_state.pipeline_ran      = True
-                st.session_state.doc_name          = uploaded_file.name
-                st.session_state.all_page_images   = page_images
-                st.session_state.summary           = None
-                log(f"Vector store ready → {USER_PERSIST_DIR}", "success")
-                st.write(f"✅ {len(docs)} docs indexed")
-
-                # ── save document record to Supabase ──────
-                doc_id = db_save_document(
-                    user_id     = st.session_state.user.id,
-                    name        = uploaded_file.name,
-                    file_type   = ext,
-                    chunk_count = len(docs),
-                    page_count  = len(page_images),
-                    persist_dir = USER_PERSIST_DIR,
-                )
-                st.session_state.active_doc_id = doc_id
-                log(f"Document saved to DB: {doc_id}", "success")
-
-                # ── trigger upgrade nudge after 3rd document ──
-                if not st.session_state.on_waitlist:
-                    _doc_count = len(db_get_documents(st.session_state.user.id))
-                    if _doc_count >= 3:
-                        st.session_state.upgrade_trigger = "doc_limit"
-
-                # ── open a fresh chat session ──────────────
-                if doc_id:
-                    sess_id = db_save_chat_session(st.session_state.user.id, doc_id)
-                    st.session_state.chat_session_id = sess_id
-
-                # 5 ─ generate summary
-                st.write("📝 Generating document summary…")
-                try:
-                    st.session_state.summary = generate_summary(uploaded_file.name)
-                    log("Summary generated", "success")
-                    st.write("✅ Summary ready")
-                except Exception as e:
-                    log(f"Summary generation failed: {e}", "error")
-                    st.write(f"⚠️ Summary failed (you can regenerate from the Summary tab): {e}")
-
-                os.unlink(tmp_path)
-                _set_global_busy(False)              # 🔓 unlock on success
-                status.update(label="Pipeline complete ✅", state="complete")
-
-            except Exception as e:
-                log(f"Pipeline failed: {e}", "error")
-                _set_global_busy(False)              # 🔓 unlock on error too
-                status.update(label=f"Failed: {e}", state="error")
-                st.error(str(e))
-
+        ext        = uploaded_file.name.rsplit(".", 1)[-1].lower()
+        file_bytes = uploaded_file.getvalue()
+        settings   = pipeline_settings()
+        cache_key  = ingest_cache.cache_key(file_bytes, settings)
+        if ingest_cache.load_meta(cache_key):
+            # same bytes + settings already indexed (by anyone) — no queue
+            if ext == "pdf":
+                doc_hash = page_cache.document_hash(file_bytes)
+                if not page_cache.has_source(doc_hash):
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+                        tmp.write(file_bytes)
+                    page_cache.register_source(doc_hash, tmp.name)
+                    os.unlink(tmp.name)
+            log(f"Ingestion cache hit {cache_key[:12]}…", "success")
+            finish_ingest(cache_key, uploaded_file.name, ext)
+        else:
+            job_id = ingest_jobs.submit(_uid, uploaded_file.name, ext, file_bytes,
+                                        cache_key, settings)
+            st.session_state.ingest_job = {
+                "id": job_id, "name": uploaded_file.name, "ext": ext, "cache_key": cache_key,
+            }
+            log(f"Queued ingestion job {job_id[:12]}…", "success")
         st.rerun()
 
 # ════════════════════════════════════════════════════════
@@ -2448,135 +2273,141 @@ with tab_summary:
                 unsafe_allow_html=True
             )
         with col_btn:
-            if st.button("🔄 Regenerate", help="Re-generate the summary from scratch"):
-                st.session_state.summary = None
+            if st.button("🔄 Regenerate", help="Re-generate the summary from scratch",
+                         disabled=bool(st.session_state.summary_task)):
+                cancel_summary_task()
+                st.session_state.summary       = None
+                st.session_state.summary_error = ""
+
+        # ── generate in the background if missing ────────
+        if st.session_state.summary_task:
+            collect_summary()
+        if st.session_state.summary is None and not st.session_state.summary_task:
+            if st.session_state.summary_error:
+                st.error(f"Summary failed: {st.session_state.summary_error}. Click Regenerate to try again.")
+            else:
+                start_summary_task(st.session_state.doc_name)
 
-        # ── generate if missing ──────────────────────────
-        if st.session_state.summary is None:
-            with st.spinner("Reading your document and generating summary… this may take a minute for long documents."):
-                try:
-                    st.session_state.summary = generate_summary(st.session_state.doc_name)
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"Summary failed: {e}. Click Regenerate to try again.")
-                    st.stop()
+        if st.session_state.summary_task:
+            render_summary_status()
 
-        s = st.session_state.summary
+        elif st.session_state.summary is not None:
+            s = st.session_state.summary
 
-        # ════ HERO — what is this document? ══════════════
-        st.markdown(f"""
-        <div class="sum-hero">
-            <div class="sum-doc-type">📄 Document Summary</div>
-            <div class="sum-doc-title">{s.get("topic", st.session_state.doc_name)}</div>
-            <div class="sum-plain-english">{s.get("plain_english", "").replace(chr(10), "<br>")}</div>
-        </div>
-        """, unsafe_allow_html=True)
+            # ════ HERO — what is this document? ══════════════
+            st.markdown(f"""
+            <div class="sum-hero">
+                <div class="sum-doc-type">📄 Document Summary</div>
+                <div class="sum-doc-title">{s.get("topic", st.session_state.doc_name)}</div>
+                <div class="sum-plain-english">{s.get("plain_english", "").replace(chr(10), "<br>")}</div>
+            </div>
+            """, unsafe_allow_html=True)
 
-        # ════ KEY FIGURES ═════════════════════════════════
-        key_imgs = st.session_state.summary_images
-        if key_imgs:
-            st.markdown('<div class="sum-section"><div class="sum-section-title">🖼️ Key Figures from Document</div>', unsafe_allow_html=True)
-            cols = st.columns(min(len(key_imgs), 3))
-            for i, b64 in enumerate(key_imgs):
-                try:
-                    cols[i % 3].image(base64.b64decode(b64), use_container_width=True)
-                    cols[i % 3].markdown(f'<div class="sum-fig-caption">Figure {i+1}</div>', unsafe_allow_html=True)
-                except Exception:
-                    pass
-            st.markdown('</div>', unsafe_allow_html=True)
-
-        # ════ SECTION-BY-SECTION BREAKDOWN ═══════════════
-        sections = s.get("sections", [])
-        if sections:
-            st.markdown('<div class="sum-section"><div class="sum-section-title">📖 Full Document Breakdown</div>', unsafe_allow_html=True)
-            for sec in sections:
-                st.markdown(f"### {sec.get('title', 'Section')}")
-                st.markdown(sec.get("summary", ""))
-
-                # inline formulas for this section
-                sec_formulas = sec.get("formulas", [])
-                if sec_formulas:
-                    for f in sec_formulas:
-                        st.markdown(f)
-
-                # key point callout
-                kp = sec.get("key_point", "")
-                if kp:
+            # ════ KEY FIGURES ═════════════════════════════════
+            key_imgs = st.session_state.summary_images
+            if key_imgs:
+                st.markdown('<div class="sum-section"><div class="sum-section-title">🖼️ Key Figures from Document</div>', unsafe_allow_html=True)
+                cols = st.columns(min(len(key_imgs), 3))
+                for i, b64 in enumerate(key_imgs):
+                    try:
+                        cols[i % 3].image(base64.b64decode(b64), use_container_width=True)
+                        cols[i % 3].markdown(f'<div class="sum-fig-caption">Figure {i+1}</div>', unsafe_allow_html=True)
+                    except Exception:
+                        pass
+                st.markdown('</div>', unsafe_allow_html=True)
+
+            # ════ SECTION-BY-SECTION BREAKDOWN ═══════════════
+            sections = s.get("sections", [])
+            if sections:
+                st.markdown('<div class="sum-section"><div class="sum-section-title">📖 Full Document Breakdown</div>', unsafe_allow_html=True)
+                for sec in sections:
+                    st.markdown(f"### {sec.get('title', 'Section')}")
+                    st.markdown(sec.get("summary", ""))
+
+                    # inline formulas for this section
+                    sec_formulas = sec.get("formulas", [])
+                    if sec_formulas:
+                        for f in sec_formulas:
+                            st.markdown(f)
+
+                    # key point callout
+                    kp = sec.get("key_point", "")
+                    if kp:
+                        st.markdown(f"""
+                        <div style="background:rgba(249,115,22,.07);border-left:3px solid var(--orange);
+                                    border-radius:0 8px 8px 0;padding:.6rem 1rem;margin:.6rem 0;
+                                    font-size:.83rem;color:#fb923c;">
+                            💡 <strong>Key point:</strong> {kp}
+                        </div>
+                        """, unsafe_allow_html=True)
+
+                    st.markdown("<hr style='border-color:#2a2a2a;margin:1rem 0'>", unsafe_allow_html=True)
+                st.markdown('</div>', unsafe_allow_html=True)
+
+            # ════ KEY CONCEPTS GLOSSARY ═══════════════════════
+            concepts = s.get("concepts", [])
+            if concepts:
+                st.markdown('<div class="sum-section"><div class="sum-section-title">🔑 Key Concepts & Terms</div>', unsafe_allow_html=True)
+                for c in concepts:
                     st.markdown(f"""
-                    <div style="background:rgba(249,115,22,.07);border-left:3px solid var(--orange);
-                                border-radius:0 8px 8px 0;padding:.6rem 1rem;margin:.6rem 0;
-                                font-size:.83rem;color:#fb923c;">
-                        💡 <strong>Key point:</strong> {kp}
+                    <div class="sum-concept-card">
+                        <div class="sum-concept-term">{c.get("term", "")}</div>
+                        <div class="sum-concept-def">{c.get("definition", "")}</div>
                     </div>
                     """, unsafe_allow_html=True)
+                st.markdown('</div>', unsafe_allow_html=True)
+
+            # ════ FORMULAS ════════════════════════════════════
+            formulas = s.get("formulas", [])
+            if formulas:
+                st.markdown('<div class="sum-section"><div class="sum-section-title">🧮 Formulas & Equations</div>', unsafe_allow_html=True)
+                for f in formulas:
+                    label = f.get("label", "")
+                    latex = f.get("latex", "")
+                    expl  = f.get("explanation", "")
+                    if label:
+                        st.markdown(f"**{label}**")
+                    if latex:
+                        st.markdown(latex)
+                    if expl:
+                        st.markdown(f'<div style="font-size:.82rem;color:#a3a3a3;margin-bottom:.8rem;">{expl}</div>', unsafe_allow_html=True)
+                    st.markdown("<div style='height:.3rem'></div>", unsafe_allow_html=True)
+                st.markdown('</div>', unsafe_allow_html=True)
+
+            # ════ TABLES ══════════════════════════════════════
+            tables = s.get("tables", [])
+            if tables:
+                st.markdown('<div class="sum-section"><div class="sum-section-title">📊 Tables</div>', unsafe_allow_html=True)
+                for t in tables:
+                    title = t.get("title", "")
+                    md    = t.get("markdown", "")
+                    if title:
+                        st.markdown(f"**{title}**")
+                    if md:
+                        st.markdown(md)
+                    st.markdown("<div style='height:.5rem'></div>", unsafe_allow_html=True)
+                st.markdown('</div>', unsafe_allow_html=True)
+
+            # ════ TAKEAWAYS ═══════════════════════════════════
+            takeaways = s.get("takeaways", [])
+            if takeaways:
+                st.markdown('<div class="sum-section"><div class="sum-section-title">💡 What You Must Remember</div>', unsafe_allow_html=True)
+                for i, t in enumerate(takeaways):
+                    st.markdown(f"""
+                    <div class="sum-takeaway">
+                        <div class="sum-takeaway-num">{i+1}</div>
+                        <div>{t}</div>
+                    </div>
+                    """, unsafe_allow_html=True)
+                st.markdown('</div>', unsafe_allow_html=True)
 
-                st.markdown("<hr style='border-color:#2a2a2a;margin:1rem 0'>", unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-
-        # ════ KEY CONCEPTS GLOSSARY ═══════════════════════
-        concepts = s.get("concepts", [])
-        if concepts:
-            st.markdown('<div class="sum-section"><div class="sum-section-title">🔑 Key Concepts & Terms</div>', unsafe_allow_html=True)
-            for c in concepts:
-                st.markdown(f"""
-                <div class="sum-concept-card">
-                    <div class="sum-concept-term">{c.get("term", "")}</div>
-                    <div class="sum-concept-def">{c.get("definition", "")}</div>
-                </div>
-                """, unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-
-        # ════ FORMULAS ════════════════════════════════════
-        formulas = s.get("formulas", [])
-        if formulas:
-            st.markdown('<div class="sum-section"><div class="sum-section-title">🧮 Formulas & Equations</div>', unsafe_allow_html=True)
-            for f in formulas:
-                label = f.get("label", "")
-                latex = f.get("latex", "")
-                expl  = f.get("explanation", "")
-                if label:
-                    st.markdown(f"**{label}**")
-                if latex:
-                    st.markdown(latex)
-                if expl:
-                    st.markdown(f'<div style="font-size:.82rem;color:#a3a3a3;margin-bottom:.8rem;">{expl}</div>', unsafe_allow_html=True)
-                st.markdown("<div style='height:.3rem'></div>", unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-
-        # ════ TABLES ══════════════════════════════════════
-        tables = s.get("tables", [])
-        if tables:
-            st.markdown('<div class="sum-section"><div class="sum-section-title">📊 Tables</div>', unsafe_allow_html=True)
-            for t in tables:
-                title = t.get("title", "")
-                md    = t.get("markdown", "")
-                if title:
-                    st.markdown(f"**{title}**")
-                if md:
-                    st.markdown(md)
-                st.markdown("<div style='height:.5rem'></div>", unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-
-        # ════ TAKEAWAYS ═══════════════════════════════════
-        takeaways = s.get("takeaways", [])
-        if takeaways:
-            st.markdown('<div class="sum-section"><div class="sum-section-title">💡 What You Must Remember</div>', unsafe_allow_html=True)
-            for i, t in enumerate(takeaways):
-                st.markdown(f"""
-                <div class="sum-takeaway">
-                    <div class="sum-takeaway-num">{i+1}</div>
-                    <div>{t}</div>
-                </div>
-                """, unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-
-        # ── bottom CTA ───────────────────────────────────
-        st.markdown("""
-        <div style="text-align:center;padding:1.5rem 0 .5rem 0;color:#525252;font-size:.8rem;">
-            Still have questions? Switch to the <strong style="color:#a3a3a3">Chat</strong> tab
-            to ask anything, or test yourself in the <strong style="color:#a3a3a3">Quiz</strong> tab.
-        </div>
-        """, unsafe_allow_html=True)
+            # ── bottom CTA ───────────────────────────────────
+            st.markdown("""
+            <div style="text-align:center;padding:1.5rem 0 .5rem 0;color:#525252;font-size:.8rem;">
+                Still have questions? Switch to the <strong style="color:#a3a3a3">Chat</strong> tab
+                to ask anything, or test yourself in the <strong style="color:#a3a3a3">Quiz</strong> tab.
+            </div>
+            """, unsafe_allow_html=True)
 
 
 # ════════════════════════════════════════════════════════
@@ -2657,14 +2488,13 @@ Formatting rules — follow these strictly:
                                 doc_prompt += "\n--- Tables ---\n"
                                 for j, tbl in enumerate(chunk_tables):
                                     doc_prompt += f"Table {j+1}:\n{tbl}\n\n"
-                            if chunk_images:
-                                doc_prompt += f"\n{len(chunk_images)} document image(s) attached — reference them where relevant.\n"
+                            # the byte budget may drop images — count what is actually sent
+                            img_blocks = image_norm.image_blocks(map(resolve_image, chunk_images))
+                            if img_blocks:
+                                doc_prompt += f"\n{len(img_blocks)} document image(s) attached — reference them where relevant.\n"
                             doc_prompt += FORMAT_RULES + "\nProvide a clear, complete answer from the document. If the document does not contain enough information, say so explicitly.\n\nANSWER:"
 
-                            content = [{"type": "text", "text": doc_prompt}]
-                            for b64 in chunk_images[:4]:
-                                mime = "image/png" if b64.startswith("iVBOR") else "image/jpeg"
-                                content.append({"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64}"}})
+                            content = [{"type": "text", "text": doc_prompt}] + img_blocks
 
                             doc_response, provider = invoke_with_fallback([HumanMessage(content=content)], status_slot=notice_slot)
                             doc_answer = doc_response.content
@@ -2959,6 +2789,34 @@ with tab_quiz:
 # TAB 5 — LOGS
 # ════════════════════════════════════════════════════════
 with tab_logs:
+    # ── process-wide caches (shared by every session on this server) ──
+    lc = llm_cache.stats()
+    ec = embed_cache.stats()
+    st.markdown(f"""
+    <div class="metrics-row">
+        <div class="metric-tile"><div class="metric-num">{lc['hits']}</div><div class="metric-lbl">LLM cache hits</div></div>
+        <div class="metric-tile"><div class="metric-num">{lc['misses']}</div><div class="metric-lbl">LLM cache misses</div></div>
+        <div class="metric-tile"><div class="metric-num">{lc['entries']}</div><div class="metric-lbl">Cached · {lc['bytes'] / 1e6:.1f} MB</div></div>
+    </div>
+    <div class="metrics-row">
+        <div class="metric-tile"><div class="metric-num">{ec['hits']}</div><div class="metric-lbl">Embedding cache hits</div></div>
+        <div class="metric-tile"><div class="metric-num">{ec['misses']}</div><div class="metric-lbl">Embedding cache misses</div></div>
+        <div class="metric-tile"><div class="metric-num">{ec['entries']}</div><div class="metric-lbl">Vectors · {ec['bytes'] / 1e6:.1f} MB</div></div>
+    </div>
+    """, unsafe_allow_html=True)
+    for em in embedding_model.stats():
+        st.markdown(
+            f'<div style="color:#525252; font-size:.78rem; margin-bottom:6px">'
+            f'🧬 {em["model"]} ({em["device"]}, {em["backend"]}'
+            + (f' — {em["fallback"]}' if em.get("fallback") else "")
+            + f') · {em["process"]} · loaded in {em["load_s"]:.1f}s · '
+            f'weights {em["param_bytes"] / 1e6:.0f} MB · process RSS +{em["rss_delta"] / 1e6:.0f} MB'
+            + (f' · encode p50 {em["p50_ms"]:.0f} ms · p99 {em["p99_ms"]:.0f} ms · '
+               f'{em["avg_batch"]:.1f} requests/batch' if "p50_ms" in em else "")
+            + '</div>',
+            unsafe_allow_html=True,
+        )
+
     st.markdown("### Pipeline logs")
     if not st.session_state.logs:
         st.markdown('<div style="color:#525252; font-size:.82rem; padding:.5rem 0">No logs yet.</div>', unsafe_allow_html=True)
@@ -0,0 +1,63 @@
+import os
+import base64
+import hashlib
+import threading
+
+# ════════════════════════════════════════════════════════
+# Content-addressed store for images embedded in uploaded documents.
+#
+#   <CACHE_DIR>/<h[:2]>/<h>      — raw image bytes, h = SHA-256 of the bytes
+#
+# Each image is written once no matter how many chunks, users or documents
+# use it; chunks keep only the hash ("image_refs" in original_content), so
+# the vector store metadata stays small and retrieval never drags image data
+# back. Blobs are resolved lazily, when a summary prompt or a chat answer
+# actually needs them. PDF pages are not stored here — see page_cache.
+# ════════════════════════════════════════════════════════
+
+CACHE_DIR = os.getenv("BLOB_STORE_DIR", "blob_store")
+
+
+def _path(h: str) -> str:
+    return os.path.join(CACHE_DIR, h[:2], h)
+
+
+def put(data: bytes) -> str:
+    """Store `data` (idempotent) and return its hash."""
+    h    = hashlib.sha256(data).hexdigest()
+    path = _path(h)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return h
+
+
+def get(h: str) -> bytes:
+    """Raw bytes for a hash, b"" if missing."""
+    try:
+        with open(_path(h), "rb") as f:
+            return f.read()
+    except (OSError, TypeError):
+        return b""
+
+
+def get_b64(h: str) -> str:
+    """Base64 for a hash ("" if missing) — the form LLM prompts and st.image use."""
+    data = get(h)
+    return base64.b64encode(data).decode() if data else ""
+
+
+def exists(h: str) -> bool:
+    return bool(h) and os.path.exists(_path(h))
+
+
+def remove(hashes):
+    """Delete blobs; callers make sure nothing references them any more."""
+    for h in hashes:
+        try:
+            os.remove(_path(h))
+        except OSError:
+            pass
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import pickle
+import shutil
+
+try:
+    import fcntl
+except ImportError:            # no advisory locks (Windows): one worker per entry is assumed
+    fcntl = None
+
+# ════════════════════════════════════════════════════════
+# Per-stage ingestion checkpoints, so a failed or killed job resumes
+# instead of starting again from partitioning.
+#
+# One directory per ingest_cache key (bytes + settings). A retry of the
+# same job and a re-upload of the same file share it:
+#   <CHECKPOINT_DIR>/<key>/state.json        — doc info, chunks done, writer position
+#   <CHECKPOINT_DIR>/<key>/elements/<n>.pkl  — partitioned element batches, in order
+#   <CHECKPOINT_DIR>/<key>/summaries.jsonl   — {"chunk": n, "text": ...} per summarised chunk
+#   <CHECKPOINT_DIR>/<key>/entry/            — the ingest_cache entry being written
+# Page renders and images need no checkpoint: page_cache and blob_store are
+# persistent already. The directory is locked while a worker uses it; a job
+# waits at most LOCK_TIMEOUT_SECS for the lock, so a stuck worker can't hang
+# every later upload of the same file. The directory is removed when the
+# entry is committed, and pruned after TTL_SECS otherwise.
+# ════════════════════════════════════════════════════════
+
+CHECKPOINT_DIR    = os.getenv("INGEST_CHECKPOINT_DIR", "ingest_checkpoints")
+TTL_SECS          = int(os.getenv("INGEST_CHECKPOINT_TTL_DAYS", "7")) * 86400
+LOCK_TIMEOUT_SECS = int(os.getenv("INGEST_CHECKPOINT_LOCK_SECS", "1800"))
+LOCK_POLL_SECS    = 1.0
+
+
+class Checkpoint:
+    def __init__(self, key: str, timeout: float = LOCK_TIMEOUT_SECS):
+        self.dir = os.path.join(CHECKPOINT_DIR, key)
+        os.makedirs(os.path.join(self.dir, "elements"), exist_ok=True)
+        self._lock = open(os.path.join(self.dir, "lock"), "w")
+        if fcntl:
+            self._acquire(timeout)                  # waits for a concurrent job on the same key
+        self.state     = _read_json(os.path.join(self.dir, "state.json"), {})
+        self.summaries = {}
+        try:
+            with open(os.path.join(self.dir, "summaries.jsonl")) as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        continue                       # torn line from a killed worker
+                    self.summaries[row["chunk"]] = row["text"]
+        except OSError:
+            pass
+        self._summaries = open(os.path.join(self.dir, "summaries.jsonl"), "a")
+
+    def _acquire(self, timeout: float):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except OSError:
+                if time.time() >= deadline:
+                    self._lock.close()
+                    raise TimeoutError(f"Another job has been indexing this file for over "
+                                       f"{int(timeout)}s — try again later")
+                time.sleep(LOCK_POLL_SECS)
+
+    @property
+    def entry_dir(self) -> str:
+        return os.path.join(self.dir, "entry")
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self.state)
+
+    def update(self, **fields):
+        self.state.update(fields)
+        _write_json(os.path.join(self.dir, "state.json"), self.state)
+
+    # ── partition ─────────────────────────────────────────
+    def element_batches(self) -> int:
+        return self.state.get("element_batches", 0)
+
+    def load_elements(self, i: int) -> list:
+        with open(os.path.join(self.dir, "elements", f"{i:05d}.pkl"), "rb") as f:
+            return pickle.load(f)
+
+    def save_elements(self, i: int, elements: list):
+        path = os.path.join(self.dir, "elements", f"{i:05d}.pkl")
+        with open(f"{path}.tmp", "wb") as f:
+            pickle.dump(elements, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.tmp", path)
+        self.update(element_batches=i + 1)
+
+    # ── per-chunk summaries ───────────────────────────────
+    def save_summary(self, chunk: int, text: str):
+        self.summaries[chunk] = text
+        self._summaries.write(json.dumps({"chunk": chunk, "text": text}) + "\n")
+        self._summaries.flush()
+
+    # ── lifecycle ─────────────────────────────────────────
+    def close(self):
+        """Keep everything for the next attempt and release the lock."""
+        for fh in (self._summaries, self._lock):
+            try:
+                fh.close()
+            except Exception:
+                pass
+
+    def clear(self):
+        """The entry is committed — nothing left to resume."""
+        self.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def prune():
+    """Remove checkpoints untouched for TTL_SECS (abandoned uploads)."""
+    cutoff = time.time() - TTL_SECS
+    try:
+        names = os.listdir(CHECKPOINT_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(CHECKPOINT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:       # bumped by every state.json write
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def _write_json(path: str, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception:
+        return default
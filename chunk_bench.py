@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import random
+import argparse
+from types import SimpleNamespace
+
+from chunker import chunk_elements
+
+# ════════════════════════════════════════════════════════
+# chunk_by_title vs the native chunker on real PDFs.
+#
+#   python chunk_bench.py docs/report.pdf
+#   python chunk_bench.py docs/*.pdf --repeat 10     # replicate elements ×10
+#   python chunk_bench.py --check-stream             # streamed == whole, no PDFs
+#
+# Elements come from the fast partition (same as the text route in the
+# pipeline), so only chunking is timed. Defaults match app.py.
+# ════════════════════════════════════════════════════════
+
+
+def load_elements(paths: list) -> list:
+    from extraction import _partition_page_range, pdf_page_count
+    elements = []
+    for path in paths:
+        elements += _partition_page_range(path, 0, pdf_page_count(path))
+    return elements
+
+
+def run(name: str, fn, elements: list, repeats: int = 3):
+    best, chunks = float("inf"), []
+    for _ in range(repeats):
+        t0     = time.perf_counter()
+        chunks = fn(elements)
+        best   = min(best, time.perf_counter() - t0)
+    sizes = [len(c.text) for c in chunks] or [0]
+    print(f"{name:>14}: {best:7.3f}s · {len(elements) / best:9.0f} elements/s · "
+          f"{len(chunks)} chunks · avg {sum(sizes) / len(sizes):.0f} / max {max(sizes)} chars")
+    return best
+
+
+def check_stream(trials: int = 200) -> int:
+    """
+    Streamed chunking (iter_title_chunks over element batches) must give the
+    same chunks as chunk_elements over the whole list. Random elements, many
+    of them longer than max_characters so one element spans several chunks.
+    """
+    from extraction import iter_title_chunks
+    words, bad = ["alpha.", "beta", "gamma!", "delta?", "epsilon"], 0
+    for seed in range(trials):
+        rnd = random.Random(seed)
+        els = [SimpleNamespace(text=" ".join(rnd.choice(words) for _ in range(rnd.randint(1, 80))),
+                               metadata=SimpleNamespace(page_number=i // 3 + 1))
+               for i in range(rnd.randint(1, 30))]
+        kwargs = {"max_characters":             rnd.choice([100, 300, 1000]),
+                  "combine_text_under_n_chars": rnd.choice([0, 50]),
+                  "overlap":                    rnd.choice([0, 20, 40])}
+        whole = [c.text for c in chunk_elements(els, **kwargs)]
+        for size in (1, 2, 3, 7):
+            batches  = [els[i:i + size] for i in range(0, len(els), size)]
+            streamed = [c.text for cs in iter_title_chunks(batches, chunker=chunk_elements, **kwargs)
+                        for c in cs]
+            if streamed != whole:
+                bad += 1
+                print(f"seed {seed}, batch {size}: {len(streamed)} streamed vs {len(whole)} whole chunks")
+    print(f"check-stream: {bad} mismatch(es) over {trials} inputs × 4 batch sizes")
+    return bad
+
+
+def main():
+    ap = argparse.ArgumentParser(description="chunk_by_title vs native chunker")
+    ap.add_argument("pdfs", nargs="*")
+    ap.add_argument("--check-stream", action="store_true",
+                    help="check streamed chunking against whole-list chunking and exit")
+    ap.add_argument("--repeat", type=int, default=1, help="replicate the elements N times")
+    ap.add_argument("--max-chars", type=int, default=3000)
+    ap.add_argument("--new-after", type=int, default=2400)
+    ap.add_argument("--combine", type=int, default=500)
+    ap.add_argument("--overlap", type=int, default=150)
+    args = ap.parse_args()
+
+    if args.check_stream:
+        sys.exit(1 if check_stream() else 0)
+    if not args.pdfs:
+        ap.error("no PDFs given")
+
+    missing = [p for p in args.pdfs if not os.path.isfile(p)]
+    if missing:
+        print(f"not found: {', '.join(missing)}")
+        sys.exit(2)
+
+    elements = load_elements(args.pdfs) * args.repeat
+    print(f"--- {len(elements)} elements from {len(args.pdfs)} PDF(s) ---")
+
+    from unstructured.chunking.title import chunk_by_title
+    kwargs = {"max_characters":             args.max_chars,
+              "new_after_n_chars":          args.new_after,
+              "combine_text_under_n_chars": args.combine}
+    title  = run("chunk_by_title", lambda els: chunk_by_title(els, **kwargs), elements)
+    native = run("native", lambda els: chunk_elements(els, overlap=args.overlap, **kwargs), elements)
+    print(f"speed-up: {title / native:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import json
+import random
+
+# ════════════════════════════════════════════════════════
+# Read-only, paginated view of the chunks in a document's vector store.
+#
+# Session state holds a ChunkPages instead of a list of every chunk's
+# Document. Loading a saved document therefore costs nothing until a reader
+# asks for chunks, and each reader fetches only what it uses: the chunk
+# preview reads the first few, the quiz a handful of random offsets, and
+# the summary walks the store PAGE_SIZE chunks at a time.
+# ════════════════════════════════════════════════════════
+
+PAGE_SIZE = 200
+
+
+class ChunkPages:
+    def __init__(self, db, page_size: int = PAGE_SIZE):
+        self._col      = db._collection
+        self.page_size = page_size
+        self._count    = None
+
+    def __len__(self) -> int:
+        if self._count is None:
+            self._count = self._col.count()
+        return self._count
+
+    def page(self, offset: int, limit: int) -> list:
+        """Documents [offset, offset + limit) in insertion order."""
+        from langchain_core.documents import Document
+        if limit <= 0 or offset >= len(self):
+            return []
+        got = self._col.get(offset=offset, limit=limit, include=["documents", "metadatas"])
+        return [Document(page_content=text or "", metadata=meta or {})
+                for text, meta in zip(got["documents"], got["metadatas"])]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            docs = self.page(start, stop - start)
+            return docs[::step] if step != 1 else docs
+        if key < 0:
+            key += len(self)
+        docs = self.page(key, 1)
+        if not docs:
+            raise IndexError(key)
+        return docs[0]
+
+    def __iter__(self):
+        for offset in range(0, len(self), self.page_size):
+            yield from self.page(offset, self.page_size)
+
+    def sample(self, k: int) -> list:
+        """Up to k chunks at random offsets, one small read each."""
+        offsets = sorted(random.sample(range(len(self)), min(k, len(self))))
+        return [d for o in offsets for d in self.page(o, 1)]
+
+    def source(self) -> dict:
+        """{"doc_hash"} of the PDF the chunks came from, read off the first chunk."""
+        first = self.page(0, 1)
+        if not first:
+            return {}
+        try:
+            orig = json.loads(first[0].metadata.get("original_content", "{}"))
+        except ValueError:
+            return {}
+        return {"doc_hash": orig.get("doc_hash", "")} if orig.get("doc_hash") else {}
@@ -0,0 +1,133 @@
+import re
+from types import SimpleNamespace
+
+# ════════════════════════════════════════════════════════
+# Native sentence- and heading-aware chunker.
+#
+# One linear pass over the elements, no per-chunk re-measuring of the
+# whole section like chunk_by_title:
+#   - a Title starts a new chunk, unless the current one is still under
+#     combine_text_under_n_chars (small sections are merged forward);
+#   - a chunk is closed once it passes new_after_n_chars, or when the next
+#     piece would push it past max_characters;
+#   - elements longer than max_characters are cut at sentence ends (word
+#     boundaries for run-on sentences), never mid-word; closing quotes and
+#     brackets stay with their sentence and line breaks are kept;
+#   - a chunk closed for size starts the next one with its last `overlap`
+#     characters, trimmed to a sentence/word start; no overlap across headings.
+# Chunks look like unstructured's: .text, .metadata.page_number (first
+# element's page) and .metadata.orig_elements, so separate() and the
+# streaming carry in extraction.iter_title_chunks work with them. The
+# overlap is text only: it is not listed in the next chunk's orig_elements,
+# so consecutive chunks share an element only when it was split between
+# them, and the carry stays one chunk long. Each chunk keeps the overlap it
+# started with in .metadata.lead; the carry passes it back as `lead` so a
+# re-chunked chunk starts exactly as it did.
+# ════════════════════════════════════════════════════════
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+
+
+class Chunk:
+    __slots__ = ("text", "metadata")
+
+    def __init__(self, text: str, page_number, orig_elements: list, lead: str = ""):
+        self.text     = text
+        self.metadata = SimpleNamespace(page_number=page_number, orig_elements=orig_elements,
+                                        lead=lead)
+
+
+def _page(el):
+    return getattr(getattr(el, "metadata", None), "page_number", None)
+
+
+def _sentences(text: str) -> list:
+    """`text` cut after each sentence end; pieces keep their punctuation and whitespace."""
+    out, start = [], 0
+    for m in _SENTENCE_END.finditer(text):
+        out.append(text[start:m.end()])
+        start = m.end()
+    if start < len(text):
+        out.append(text[start:])
+    return out
+
+
+def _segments(text: str, limit: int) -> list:
+    """Cut `text` into pieces of at most `limit` chars at sentence, then word, boundaries."""
+    if len(text) <= limit:
+        return [text]
+    out, cur = [], ""
+    for sent in _sentences(text):
+        while len(sent.rstrip()) > limit:
+            cut = max(sent.rfind(" ", 0, limit), sent.rfind("\n", 0, limit))
+            cut = cut if cut > limit // 2 else limit
+            if cur.strip():
+                out.append(cur.rstrip())
+            cur = ""
+            out.append(sent[:cut].rstrip())
+            sent = sent[cut:].lstrip()
+        if cur and len(cur) + len(sent.rstrip()) > limit:
+            out.append(cur.rstrip())
+            cur = sent
+        else:
+            cur += sent
+    if cur.strip():
+        out.append(cur.rstrip())
+    return [s for s in out if s]
+
+
+def _tail(text: str, n: int) -> str:
+    """Last ~n chars of `text`, starting at a sentence (or at least word) boundary."""
+    if n <= 0 or len(text) <= n:
+        return ""
+    tail = text[-n:]
+    m = _SENTENCE_END.search(tail)
+    if m and m.end() < len(tail):
+        return tail[m.end():]
+    space = tail.find(" ")
+    return tail[space + 1:] if 0 <= space < len(tail) - 1 else ""
+
+
+def chunk_elements(elements, max_characters: int = 3000, new_after_n_chars: int = None,
+                   combine_text_under_n_chars: int = 0, overlap: int = 0, lead: str = "") -> list:
+    """
+    Chunk unstructured elements (anything with .text) in one pass. `lead`
+    is overlap text the first chunk starts with (see the module comment).
+    """
+    soft   = min(new_after_n_chars or max_characters, max_characters)
+    chunks = []
+    parts, size, els, page = ([lead], len(lead), [], None) if lead else ([], 0, [], None)
+
+    def close(carry: bool):
+        nonlocal parts, size, els, page, lead
+        if not parts:
+            return
+        text = "\n\n".join(parts)
+        chunks.append(Chunk(text, page, els, lead))
+        tail = _tail(text, overlap) if carry else ""
+        # the overlap is text only — its element belongs to the closed chunk
+        parts, size, els, page = ([tail], len(tail), [], None) if tail else ([], 0, [], None)
+        lead = tail
+
+    for el in elements:
+        text = (getattr(el, "text", "") or "").strip()
+        if not text:
+            continue
+        if type(el).__name__ == "Title" and size >= combine_text_under_n_chars:
+            close(carry=False)
+
+        for seg in _segments(text, max_characters):
+            if parts and (size >= soft or size + 2 + len(seg) > max_characters):
+                close(carry=True)
+                if parts and size + 2 + len(seg) > max_characters:
+                    parts, size, els, page = [], 0, [], None    # overlap doesn't fit
+                    lead = ""
+            size += len(seg) + (2 if parts else 0)
+            parts.append(seg)
+            if not els or els[-1] is not el:
+                if not els:
+                    page = _page(el)
+                els.append(el)
+
+    close(carry=False)
+    return chunks
@@ -0,0 +1,82 @@
+import os
+import re
+import hashlib
+
+# ════════════════════════════════════════════════════════
+# Near-duplicate chunk detection (64-bit SimHash over word shingles).
+#
+# Repeated headers/footers, template slides and re-printed exam rubrics
+# chunk into near-identical text. NearDupIndex sees each chunk once, between
+# chunking and summarisation: the first of a group is canonical, later ones
+# within HAMMING bits of it are reported as its duplicates and are neither
+# summarised nor embedded. Candidates come from HAMMING+1 bit bands — two
+# hashes within HAMMING bits agree exactly on at least one band — so lookup
+# stays O(1) per chunk instead of a scan over everything seen. Texts too
+# short to shingle meaningfully only match exactly (after normalising).
+# ════════════════════════════════════════════════════════
+
+HAMMING   = int(os.getenv("DEDUP_HAMMING", "6"))
+SHINGLE   = 3                    # words per shingle
+MIN_WORDS = 8                    # below this, exact matches only
+BITS      = 64
+
+_WORD = re.compile(r"\w+")
+
+
+def _h64(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+
+
+def simhash(words: list) -> int:
+    """64-bit SimHash of the word shingles of `words`."""
+    counts = {}
+    for i in range(max(1, len(words) - SHINGLE + 1)):
+        sh = " ".join(words[i:i + SHINGLE])
+        counts[sh] = counts.get(sh, 0) + 1
+    acc = [0] * BITS
+    for sh, w in counts.items():
+        h = _h64(sh)
+        for b in range(BITS):
+            acc[b] += w if (h >> b) & 1 else -w
+    return sum(1 << b for b in range(BITS) if acc[b] > 0)
+
+
+class NearDupIndex:
+    """Per-document index; add() returns the canonical key a text duplicates, or None."""
+
+    def __init__(self, hamming: int = HAMMING):
+        self.hamming = max(0, hamming)
+        n            = self.hamming + 1
+        width        = BITS // n
+        self._bands  = [(i * width, BITS if i == n - 1 else (i + 1) * width) for i in range(n)]
+        self._tables = [{} for _ in self._bands]
+        self._exact  = {}
+        self.seen       = 0
+        self.duplicates = 0
+
+    def add(self, text: str, key):
+        self.seen += 1
+        words = _WORD.findall(text.lower())
+        norm  = hashlib.sha256(" ".join(words).encode()).hexdigest()
+        canon = self._exact.get(norm)
+        if canon is None and len(words) >= MIN_WORDS:
+            sig   = simhash(words)
+            canon = self._lookup(sig)
+            if canon is None:
+                for (lo, hi), table in zip(self._bands, self._tables):
+                    table.setdefault((sig >> lo) & ((1 << (hi - lo)) - 1), []).append((sig, key))
+        if canon is not None:
+            self.duplicates += 1
+            return canon
+        self._exact[norm] = key
+        return None
+
+    def _lookup(self, sig: int):
+        for (lo, hi), table in zip(self._bands, self._tables):
+            for other, key in table.get((sig >> lo) & ((1 << (hi - lo)) - 1), ()):
+                if bin(sig ^ other).count("1") <= self.hamming:
+                    return key
+        return None
+
+    def rate(self) -> float:
+        return self.duplicates / self.seen if self.seen else 0.0
@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+# ════════════════════════════════════════════════════════
+# Persistent embedding cache, keyed by (model, normalised text hash).
+#
+# Boilerplate headers, repeated slides, the same chapter uploaded twice and
+# repeated questions all map to the same key, so they are encoded once per
+# model. Vectors are stored as float16 (EMBED_CACHE_DTYPE=float32 to keep
+# full precision) blobs in one SQLite file; least recently used rows are
+# dropped once the payload exceeds MAX_BYTES. Several processes write the
+# file, so the payload size is re-read every EVICT_EVERY bytes a process
+# stores rather than tracked in memory. Used transparently by
+# embedding_model.SharedEmbeddings, so the pipeline, the 01 script and query
+# embedding all go through it. Hit/miss counters, and the stats each process
+# publishes about its loaded model, are kept in the same file so the Logs
+# tab sees the ingestion workers too.
+# ════════════════════════════════════════════════════════
+
+DB_PATH   = os.getenv("EMBED_CACHE_PATH", "embed_cache.sqlite3")
+MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_MB", "256")) * 1024 * 1024
+DTYPE     = os.getenv("EMBED_CACHE_DTYPE", "float16")
+
+_LOCK     = threading.Lock()
+_CONN     = None
+_COUNTERS = ("hits", "misses", "evicted")
+_WS       = re.compile(r"\s+")
+
+_written    = 0                # bytes this process stored since its last eviction pass
+EVICT_EVERY = MAX_BYTES // 20
+
+
+def _conn() -> sqlite3.Connection:
+    global _CONN
+    if _CONN is None:
+        _CONN = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _CONN.execute("PRAGMA journal_mode=WAL")
+        _CONN.execute(
+            "CREATE TABLE IF NOT EXISTS embed_cache ("
+            " key TEXT PRIMARY KEY, vec BLOB NOT NULL, dtype TEXT NOT NULL, used REAL NOT NULL)"
+        )
+        _CONN.execute("CREATE INDEX IF NOT EXISTS embed_cache_used ON embed_cache(used)")
+        _CONN.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        _CONN.execute(
+            "CREATE TABLE IF NOT EXISTS model_stats ("
+            " process TEXT PRIMARY KEY, host TEXT, pid INTEGER, data TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        _CONN.commit()
+    return _CONN
+
+
+def _count(name: str, n: int = 1):
+    """Add to a shared counter. Caller holds _LOCK and commits."""
+    if n:
+        _conn().execute("INSERT INTO counters (name, value) VALUES (?, ?)"
+                        " ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, n))
+
+
+def text_key(model: str, text: str) -> str:
+    """Key for `text` under `model`: NFC, collapsed whitespace, stripped."""
+    norm = _WS.sub(" ", unicodedata.normalize("NFC", text)).strip()
+    return hashlib.sha256(f"{model}\x00{norm}".encode()).hexdigest()
+
+
+def get_many(keys: list) -> dict:
+    """{key: vector (list of float)} for the keys that are cached."""
+    import numpy as np
+    found = {}
+    if not keys:
+        return found
+    try:
+        with _LOCK:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = _conn().execute(
+                    f"SELECT key, vec, dtype FROM embed_cache WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                for key, blob, dtype in rows:
+                    found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32).tolist()
+            if found:
+                now = time.time()
+                _conn().executemany("UPDATE embed_cache SET used = ? WHERE key = ?",
+                                    [(now, k) for k in found])
+            _count("hits", len(found))
+            _count("misses", len(set(keys)) - len(found))
+            _conn().commit()
+    except sqlite3.Error:
+        return {}
+    return found
+
+
+def put_many(items: dict):
+    """Store {key: vector}."""
+    global _written
+    import numpy as np
+    if not items:
+        return
+    now = time.time()
+    rows = [(k, np.asarray(v, dtype=DTYPE).tobytes(), DTYPE, now) for k, v in items.items()]
+    try:
+        with _LOCK:
+            _conn().executemany(
+                "INSERT OR REPLACE INTO embed_cache (key, vec, dtype, used) VALUES (?, ?, ?, ?)", rows
+            )
+            _written += sum(len(r[1]) for r in rows)
+            if _written >= EVICT_EVERY:
+                _written = 0
+                _evict()
+            _conn().commit()
+    except sqlite3.Error:
+        pass
+
+
+def _evict():
+    """Delete least-recently-used rows until under 90% of MAX_BYTES. Caller holds _LOCK."""
+    # the real total: other processes write to the same file
+    total  = _conn().execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embed_cache").fetchone()[0]
+    if total <= MAX_BYTES:
+        return
+    target = MAX_BYTES * 0.9
+    drop   = []
+    for key, size in _conn().execute("SELECT key, LENGTH(vec) FROM embed_cache ORDER BY used").fetchall():
+        if total <= target:
+            break
+        drop.append((key,))
+        total -= size
+    _conn().executemany("DELETE FROM embed_cache WHERE key = ?", drop)
+    _count("evicted", len(drop))
+
+
+def stats() -> dict:
+    """Counters (all processes) plus current entry count and payload size."""
+    out = dict.fromkeys(_COUNTERS, 0)
+    try:
+        with _LOCK:
+            out.update(_conn().execute("SELECT name, value FROM counters").fetchall())
+            out["entries"], out["bytes"] = _conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vec)), 0) FROM embed_cache"
+            ).fetchone()
+    except sqlite3.Error:
+        out["entries"], out["bytes"] = 0, 0
+    return out
+
+
+# ── Model stats, published by every process ───────────────────────────────────
+
+def publish_model_stats(process: str, host: str, pid: int, data: list):
+    """Store `process`'s embedding_model stats (one dict per loaded model)."""
+    try:
+        with _LOCK:
+            _conn().execute(
+                "INSERT OR REPLACE INTO model_stats (process, host, pid, data, updated) VALUES (?, ?, ?, ?, ?)",
+                (process, host, pid, json.dumps(data), time.time()),
+            )
+            _conn().commit()
+    except sqlite3.Error:
+        pass
+
+
+def model_stats() -> list:
+    """[(process, host, pid, [stats dicts])] for every process that published."""
+    try:
+        with _LOCK:
+            rows = _conn().execute("SELECT process, host, pid, data FROM model_stats").fetchall()
+    except sqlite3.Error:
+        return []
+    return [(p, h, pid, json.loads(d)) for p, h, pid, d in rows]
+
+
+def forget_model_stats(processes: list):
+    try:
+        with _LOCK:
+            _conn().executemany("DELETE FROM model_stats WHERE process = ?", [(p,) for p in processes])
+            _conn().commit()
+    except sqlite3.Error:
+        pass
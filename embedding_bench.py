@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import argparse
+
+from embedding_model import DEFAULT_MODEL, OnnxEmbeddings, get_embeddings
+
+# ════════════════════════════════════════════════════════
+# Parity check and throughput benchmark for the embedding backends.
+#
+#   python embedding_bench.py                   # docs/*.txt, else built-in sentences
+#   python embedding_bench.py --docs docs --n 2000
+#
+# Parity: cosine between the torch and onnx-int8 vector of every text, plus
+# top-5 neighbour overlap, which is what retrieval actually sees. Exits 1 if
+# min cosine < --min-cos. Throughput is timed on the raw models (.inner):
+# the shared wrappers read embed_cache, so repeats would time cache hits.
+# ════════════════════════════════════════════════════════
+
+SAMPLE = [
+    "Tesla began production of the Roadster in 2008.",
+    "Microsoft acquired GitHub for 7.5 billion dollars in stock.",
+    "The transformer relies entirely on attention, dispensing with recurrence.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "The derivative of sin(x) is cos(x).",
+    "NVIDIA's first graphics accelerator was the NV1.",
+    "Table 3 reports BLEU scores for English-to-German translation.",
+    "A balanced binary search tree has O(log n) lookup time.",
+]
+
+
+def load_texts(docs_path: str, n: int) -> list:
+    texts = []
+    if os.path.isdir(docs_path):
+        for name in sorted(os.listdir(docs_path)):
+            if name.endswith(".txt"):
+                with open(os.path.join(docs_path, name), encoding="utf-8") as f:
+                    texts += [p.strip() for p in f.read().split("\n\n") if p.strip()]
+    texts = texts or SAMPLE
+    while len(texts) < n:
+        texts = texts + texts
+    return texts[:n]
+
+
+def parity(a, b) -> dict:
+    import numpy as np
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    b /= np.linalg.norm(b, axis=1, keepdims=True)
+    cos = (a * b).sum(axis=1)
+    k   = min(5, len(a) - 1)
+    overlap = 1.0
+    if k > 0:
+        top_a = np.argsort(-(a @ a.T), axis=1)[:, 1:k + 1]
+        top_b = np.argsort(-(b @ b.T), axis=1)[:, 1:k + 1]
+        overlap = float(np.mean([len(set(x) & set(y)) / k for x, y in zip(top_a, top_b)]))
+    return {"mean_cos": float(cos.mean()), "min_cos": float(cos.min()), "top5_overlap": overlap}
+
+
+def throughput(emb, texts: list, repeats: int = 3) -> float:
+    """Texts/s of the best of `repeats` passes. Pass an uncached model."""
+    emb.embed_documents(texts[:8])                        # warm-up
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        emb.embed_documents(texts)
+        best = min(best, time.perf_counter() - t0)
+    return len(texts) / best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Embedding backend parity + throughput")
+    ap.add_argument("--model", default=DEFAULT_MODEL)
+    ap.add_argument("--docs", default="docs")
+    ap.add_argument("--n", type=int, default=512)
+    ap.add_argument("--min-cos", type=float, default=0.98)
+    args = ap.parse_args()
+
+    texts = load_texts(args.docs, args.n)
+    torch_emb = get_embeddings(args.model, backend="torch")
+    onnx_emb  = get_embeddings(args.model, backend="onnx-int8")
+    if not isinstance(onnx_emb.inner, OnnxEmbeddings):
+        print("onnx-int8 backend unavailable (needs onnxruntime, transformers, torch)")
+        sys.exit(2)
+
+    print(f"--- {len(texts)} texts · {args.model} ---")
+    p = parity(torch_emb.embed_documents(texts[:256]), onnx_emb.embed_documents(texts[:256]))
+    print(f"parity: mean cos {p['mean_cos']:.4f} · min cos {p['min_cos']:.4f} · "
+          f"top-5 overlap {p['top5_overlap']:.2%}")
+
+    for name, emb in (("torch fp32", torch_emb), ("onnx int8", onnx_emb)):
+        print(f"{name:>10}: {throughput(emb.inner, texts):8.1f} texts/s")
+
+    if p["min_cos"] < args.min_cos:
+        print(f"FAIL: min cosine below {args.min_cos}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+import os
+import time
+import queue
+import socket
+import threading
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import Future
+
+import embed_cache
+
+# ════════════════════════════════════════════════════════
+# One embedding model per process.
+#
+# Loading sentence-transformers weights takes seconds and hundreds of MB, so
+# every Streamlit session, the pipeline and the 01–04 scripts share the
+# instance returned by get_embeddings(). Streamlit keeps this module in
+# sys.modules across reruns, so the model outlives any single script run.
+# Encoding goes through one worker thread: every caller (query encodes from
+# chat sessions, chunk batches from the pipeline) queues its texts and gets a
+# Future; the worker merges whatever arrives within EMBED_MAX_WAIT_MS into a
+# single forward pass of up to EMBED_MAX_BATCH texts. This is also what keeps
+# the fast tokenizer, which is not thread-safe, on a single thread. Texts
+# already in embed_cache never reach the worker. Every process publishes
+# its model stats to embed_cache, so stats() also covers ingestion workers.
+#
+# Windowing (EMBED_WINDOWING): MiniLM only sees its first 256 word pieces,
+# but chunks run to 3000 characters. The worker tokenises each text once,
+# slices the token ids into overlapping model windows, encodes every window
+# of the micro-batch in one pass and returns the token-weighted mean of each
+# text's window vectors (re-normalised). One vector per chunk, so index size
+# and retrieval cost are unchanged; the whole chunk now contributes to it.
+#
+# Backends (EMBED_BACKEND):
+#   torch      — HuggingFaceEmbeddings, PyTorch fp32 (default)
+#   onnx-int8  — the same model exported to ONNX and dynamically quantised
+#                to int8, run on ONNX Runtime. Same pooling + normalisation,
+#                so vectors go into the existing cosine collections; see
+#                embedding_bench.py for the parity check and benchmark.
+# ════════════════════════════════════════════════════════
+
+DEFAULT_MODEL   = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+DEFAULT_DEVICE  = os.getenv("EMBED_DEVICE", "cpu")
+DEFAULT_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+ONNX_DIR        = os.getenv("ONNX_MODEL_DIR", "onnx_models")
+MAX_BATCH       = int(os.getenv("EMBED_MAX_BATCH", "64"))
+MAX_WAIT_S      = float(os.getenv("EMBED_MAX_WAIT_MS", "5")) / 1000
+WINDOWING       = os.getenv("EMBED_WINDOWING", "1") == "1"
+WINDOW_OVERLAP  = int(os.getenv("EMBED_WINDOW_OVERLAP", "32"))     # tokens
+MAX_WINDOWS     = int(os.getenv("EMBED_MAX_WINDOWS", "8"))         # per text
+PUBLISH_SECS    = 10           # how often a busy process refreshes its published stats
+
+_LOCK   = threading.Lock()     # guards _MODELS
+_MODELS = {}                   # (model_name, device, backend) → SharedEmbeddings
+_STATS  = {}                   # (model_name, device, backend) → load stats
+_HOST   = socket.gethostname()
+
+
+def _rss_bytes() -> int:
+    """Resident memory of this process (0 if it can't be read)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return 0
+
+
+def _param_bytes(client) -> int:
+    try:
+        return sum(p.numel() * p.element_size() for p in client.parameters())
+    except Exception:
+        return 0
+
+
+# ── ONNX Runtime int8 backend ─────────────────────────────────────────────────
+
+def _onnx_dir(model_name: str) -> str:
+    return os.path.join(ONNX_DIR, model_name.replace("/", "__"))
+
+
+def export_int8(model_name: str) -> str:
+    """
+    Export `model_name` to ONNX and quantise its weights to int8 (once; the
+    result is reused from ONNX_DIR). Needs torch, transformers and
+    onnxruntime. Returns the path of the quantised model.
+    """
+    d    = _onnx_dir(model_name)
+    int8 = os.path.join(d, "model_int8.onnx")
+    if os.path.exists(int8):
+        return int8
+
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(d, exist_ok=True)
+    tok   = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tok.save_pretrained(d)
+
+    sample = tok(["export"], return_tensors="pt")
+    names  = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    axes   = {n: {0: "batch", 1: "seq"} for n in names + ["last_hidden_state"]}
+    fp32   = os.path.join(d, f"model_fp32.{os.getpid()}.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(sample[n] for n in names), fp32,
+            input_names=names, output_names=["last_hidden_state"],
+            dynamic_axes=axes, opset_version=14,
+        )
+    tmp = os.path.join(d, f"model_int8.{os.getpid()}.onnx")
+    quantize_dynamic(fp32, tmp, weight_type=QuantType.QInt8)
+    os.replace(tmp, int8)
+    os.remove(fp32)
+    return int8
+
+
+class OnnxEmbeddings:
+    """
+    Mean-pooled, L2-normalised sentence embeddings from the int8 ONNX model —
+    the same post-processing sentence-transformers applies to MiniLM.
+    """
+
+    def __init__(self, model_name: str, max_length: int = 256, batch_size: int = 32):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        path = export_int8(model_name)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.intra_op_num_threads     = int(os.getenv("OMP_NUM_THREADS", "0"))   # 0 = all cores
+        self.session    = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.inputs     = {i.name for i in self.session.get_inputs()}
+        self.tokenizer  = AutoTokenizer.from_pretrained(os.path.dirname(path))
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.model_path = path
+
+    def _pool(self, enc) -> list:
+        import numpy as np
+        feed = {k: np.asarray(v).astype(np.int64) for k, v in enc.items() if k in self.inputs}
+        if "token_type_ids" in self.inputs and "token_type_ids" not in feed:
+            feed["token_type_ids"] = np.zeros_like(feed["input_ids"])
+        hidden = self.session.run(None, feed)[0]
+        mask   = np.asarray(enc["attention_mask"])[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.tolist()
+
+    def embed_documents(self, texts):
+        texts, out = list(texts), []
+        for i in range(0, len(texts), self.batch_size):
+            out.extend(self._pool(self.tokenizer(texts[i:i + self.batch_size], padding=True,
+                                                 truncation=True, max_length=self.max_length,
+                                                 return_tensors="np")))
+        return out
+
+    def embed_ids(self, id_lists: list) -> list:
+        """Like embed_documents, for texts already tokenised (no special tokens)."""
+        out = []
+        for i in range(0, len(id_lists), self.batch_size):
+            batch = [self.tokenizer.build_inputs_with_special_tokens(ids)
+                     for ids in id_lists[i:i + self.batch_size]]
+            out.extend(self._pool(self.tokenizer.pad({"input_ids": batch}, return_tensors="np")))
+        return out
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+# ── Windowing ─────────────────────────────────────────────────────────────────
+
+def _window_config(inner):
+    """(tokenizer, max content tokens per window) of a loaded model, or (None, 0)."""
+    if isinstance(inner, OnnxEmbeddings):
+        tok, max_len = inner.tokenizer, inner.max_length
+    else:
+        client  = getattr(inner, "_client", None)
+        tok     = getattr(client, "tokenizer", None)
+        max_len = getattr(client, "max_seq_length", 0) or 0
+    if tok is None or max_len <= 2:
+        return None, 0
+    return tok, max_len - 2                     # room for [CLS] / [SEP]
+
+
+def window_spans(tokenizer, text: str, max_tokens: int,
+                 overlap: int = WINDOW_OVERLAP, max_windows: int = MAX_WINDOWS) -> list:
+    """
+    Token ids of `text` (no special tokens) in windows of at most
+    `max_tokens`, overlapping by `overlap`. If more than `max_windows` (at
+    least 2) windows would be needed, the stride grows so they still cover
+    the text, but never beyond `max_tokens`: whatever lies past
+    max_windows × max_tokens tokens is not embedded.
+    """
+    ids = tokenizer(text, add_special_tokens=False, truncation=False)["input_ids"]
+    n   = len(ids)
+    if n <= max_tokens:
+        return [ids]
+    max_windows = max(2, max_windows)
+    step = max(1, max_tokens - overlap)
+    if -(-(n - max_tokens) // step) + 1 > max_windows:
+        step = min(max_tokens, -(-(n - max_tokens) // (max_windows - 1)))
+    spans = []
+    for start in range(0, n, step):
+        spans.append(ids[start:start + max_tokens])
+        if start + max_tokens >= n or len(spans) == max_windows:
+            break
+    return spans
+
+
+def _embed_ids(inner, id_lists: list, batch_size: int = 32) -> list:
+    """Vectors for tokenised windows, without decoding them back to text."""
+    if isinstance(inner, OnnxEmbeddings):
+        return inner.embed_ids(id_lists)
+    # sentence-transformers: its module pipeline (pooling, normalisation) is
+    # what encode() runs, fed with our ids instead of re-tokenised text
+    import torch
+    client = inner._client
+    tok    = client.tokenizer
+    out    = []
+    for i in range(0, len(id_lists), batch_size):
+        batch = [tok.build_inputs_with_special_tokens(ids) for ids in id_lists[i:i + batch_size]]
+        enc   = tok.pad({"input_ids": batch}, return_tensors="pt")
+        with torch.no_grad():
+            vecs = client.forward({k: v.to(client.device) for k, v in enc.items()})["sentence_embedding"]
+        if getattr(inner, "encode_kwargs", {}).get("normalize_embeddings"):
+            vecs = torch.nn.functional.normalize(vecs, p=2, dim=1)
+        out.extend(vecs.cpu().tolist())
+    return out
+
+
+def pool_vectors(vectors: list, weights: list) -> list:
+    """Weighted mean of unit vectors, re-normalised."""
+    if len(vectors) == 1:
+        return vectors[0]
+    dim    = len(vectors[0])
+    total  = float(sum(weights))
+    pooled = [sum(v[i] * w for v, w in zip(vectors, weights)) / total for i in range(dim)]
+    norm   = sum(x * x for x in pooled) ** 0.5 or 1.0
+    return [x / norm for x in pooled]
+
+
+# ── Shared instances ──────────────────────────────────────────────────────────
+
+def _make_class():
+    from langchain_core.embeddings import Embeddings
+
+    class SharedEmbeddings(Embeddings):
+        """LangChain Embeddings over one shared model, fed by a dynamic-batching worker."""
+
+        def __init__(self, inner, backend: str, cache_ns: str, max_batch: int = MAX_BATCH,
+                     max_wait: float = MAX_WAIT_S):
+            self.inner     = inner
+            self.backend   = backend              # what actually loaded: "torch" | "onnx-int8"
+            self.cache_ns  = cache_ns             # model + backend: vectors differ across both
+            self.max_batch = max_batch
+            self.max_wait  = max_wait
+            self.latencies = deque(maxlen=2000)   # seconds, enqueue → result
+            self.batches   = 0
+            self.requests  = 0
+            self._queue    = queue.Queue()
+            self._published = time.perf_counter()
+            self._tok, self._window = _window_config(inner) if WINDOWING else (None, 0)
+            threading.Thread(target=self._run, name="embed-batcher", daemon=True).start()
+
+        def _submit(self, texts: list) -> Future:
+            fut = Future()
+            self._queue.put((texts, fut, time.perf_counter()))
+            return fut
+
+        def embed_documents(self, texts):
+            texts = list(texts)
+            if not texts:
+                return []
+            keys    = [embed_cache.text_key(self.cache_ns, t) for t in texts]
+            found   = embed_cache.get_many(keys)
+            missing = {k: t for k, t in zip(keys, texts) if k not in found}   # also dedups
+            if missing:
+                fresh = dict(zip(missing, self._submit(list(missing.values())).result()))
+                embed_cache.put_many(fresh)
+                found.update(fresh)
+            return [found[k] for k in keys]
+
+        def embed_query(self, text):
+            return self.embed_documents([text])[0]
+
+        def _run(self):
+            while True:
+                batch = [self._queue.get()]
+                n     = len(batch[0][0])
+                # gather whatever else arrives before the deadline
+                deadline = time.perf_counter() + self.max_wait
+                while n < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        req = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    batch.append(req)
+                    n += len(req[0])
+
+                try:
+                    vectors = self._encode([t for texts, _, _ in batch for t in texts])
+                except Exception as e:
+                    for _, fut, _ in batch:
+                        fut.set_exception(e)
+                    continue
+                i, now = 0, time.perf_counter()
+                for texts, fut, t0 in batch:
+                    fut.set_result(vectors[i:i + len(texts)])
+                    i += len(texts)
+                    self.latencies.append(now - t0)
+                self.batches  += 1
+                self.requests += len(batch)
+                if now - self._published > PUBLISH_SECS:
+                    self._published = now
+                    _publish()
+
+        def _encode(self, texts: list) -> list:
+            """One forward pass over every window of `texts`; one pooled vector per text."""
+            if self._tok is None:
+                return self.inner.embed_documents(texts)
+            spans, owners = [], []
+            for i, text in enumerate(texts):
+                parts   = window_spans(self._tok, text, self._window)
+                spans  += parts
+                owners += [i] * len(parts)
+            weights = [max(len(ids), 1) for ids in spans]
+            vectors = _embed_ids(self.inner, spans)
+            grouped = [([], []) for _ in texts]
+            for owner, vec, w in zip(owners, vectors, weights):
+                grouped[owner][0].append(vec)
+                grouped[owner][1].append(w)
+            return [pool_vectors(vs, ws) for vs, ws in grouped]
+
+        def latency_stats(self) -> dict:
+            lat = sorted(self.latencies)
+            if not lat:
+                return {}
+            return {
+                "p50_ms":    1000 * lat[len(lat) // 2],
+                "p99_ms":    1000 * lat[min(len(lat) - 1, int(len(lat) * 0.99))],
+                "avg_batch": self.requests / max(self.batches, 1),
+            }
+
+    return SharedEmbeddings
+
+
+def _load(model_name: str, device: str, backend: str):
+    """(inner embeddings, backend actually used, weight bytes, fallback note)."""
+    note = ""
+    if backend == "onnx-int8":
+        if device != "cpu":
+            note = f"onnx-int8 is CPU-only, not {device}"
+        else:
+            try:
+                inner = OnnxEmbeddings(model_name)
+                return inner, backend, os.path.getsize(inner.model_path), note
+            except Exception as e:
+                note = f"onnx-int8 unavailable: {type(e).__name__}"
+    from langchain_huggingface import HuggingFaceEmbeddings
+    inner = HuggingFaceEmbeddings(model_name=model_name, model_kwargs={"device": device})
+    return inner, "torch", _param_bytes(getattr(inner, "_client", None)), note
+
+
+def get_embeddings(model_name: str = DEFAULT_MODEL, device: str = DEFAULT_DEVICE,
+                   backend: str = DEFAULT_BACKEND):
+    """The process-wide embedding model, loaded on first use."""
+    key = (model_name, device, backend)
+    with _LOCK:
+        if key in _MODELS:
+            return _MODELS[key]
+        rss0 = _rss_bytes()
+        t0   = time.time()
+        inner, used, weights, note = _load(model_name, device, backend)
+        _STATS[key] = {
+            "model":       model_name,
+            "device":      device,
+            "backend":     used,
+            "fallback":    note,
+            "load_s":      time.time() - t0,
+            "rss_delta":   max(0, _rss_bytes() - rss0),
+            "param_bytes": weights,
+            "loaded_at":   time.time(),
+        }
+        # window settings change the pooled vectors, so they key the cache too
+        ns = f"{model_name}|{used}" + (f"|win{WINDOW_OVERLAP}x{MAX_WINDOWS}" if WINDOWING else "")
+        _MODELS[key] = _make_class()(inner, used, cache_ns=ns)
+    _publish()
+    return _MODELS[key]
+
+
+def loaded_backend(model_name: str = DEFAULT_MODEL, device: str = DEFAULT_DEVICE,
+                   backend: str = DEFAULT_BACKEND) -> str:
+    """The backend get_embeddings() actually runs for these arguments (onnx-int8 may fall back to torch)."""
+    return get_embeddings(model_name, device, backend).backend
+
+
+# ── Bulk mode: one model per worker process ──────────────────────────────────
+
+def _bulk_init(threads: int):
+    # each process gets its share of the cores instead of all of them
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except Exception:
+        pass
+
+
+def _bulk_embed_shard(model_name: str, texts: list) -> list:
+    return get_embeddings(model_name, device="cpu").embed_documents(texts)
+
+
+def bulk_embed(texts: list, model_name: str = DEFAULT_MODEL, workers: int = None,
+               shard_size: int = 256):
+    """
+    Embed `texts` across `workers` spawned processes, each loading its own
+    model. Yields (offset, vectors) per shard in input order, with at most
+    2×workers shards in flight so results can be streamed to the store.
+    """
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(workers, mp_context=mp.get_context("spawn"),
+                             initializer=_bulk_init, initargs=(threads,)) as pool:
+        pending = deque()
+        for offset in range(0, len(texts), shard_size):
+            pending.append((offset, pool.submit(_bulk_embed_shard, model_name,
+                                                texts[offset:offset + shard_size])))
+            if len(pending) >= 2 * workers:
+                off, fut = pending.popleft()
+                yield off, fut.result()
+        while pending:
+            off, fut = pending.popleft()
+            yield off, fut.result()
+
+
+def local_stats() -> list:
+    """Load and latency stats for every model loaded in this process."""
+    with _LOCK:
+        return [{**s, **_MODELS[k].latency_stats()} for k, s in _STATS.items()]
+
+
+def _process_label() -> str:
+    return f"{mp.current_process().name} (pid {os.getpid()})"
+
+
+def _publish():
+    stats_ = local_stats()
+    if stats_:
+        embed_cache.publish_model_stats(_process_label(), _HOST, os.getpid(), stats_)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass                              # exists, owned by someone else
+    return True
+
+
+def stats() -> list:
+    """
+    Stats of every model loaded by any live process on the machine (the app,
+    ingestion workers, scripts), each labelled with its "process".
+    """
+    _publish()
+    out, dead = [], []
+    for process, host, pid, data in embed_cache.model_stats():
+        if host == _HOST and not _alive(pid):
+            dead.append(process)
+            continue
+        out += [{**d, "process": process} for d in data]
+    if dead:
+        embed_cache.forget_model_stats(dead)
+    return out
@@ -0,0 +1,474 @@
+import os
+import tempfile
+import threading
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# ════════════════════════════════════════════════════════
+# Document extraction helpers that run outside the Streamlit script thread.
+# Worker functions live here (not in app.py) because process-pool workers
+# must be importable by name from a fresh interpreter.
+# ════════════════════════════════════════════════════════
+
+
+# ── Shared process pool ───────────────────────────────────────────────────────
+# One pool per server process, reused by every Streamlit session so workers
+# only pay the unstructured / PyMuPDF import cost once. "spawn" rather than
+# "fork" because the Streamlit server is multi-threaded.
+
+_POOLS     = {}
+_POOL_LOCK = threading.Lock()
+
+
+def get_process_pool(workers: int, name: str = "partition") -> ProcessPoolExecutor:
+    """
+    Return the shared worker pool called `name`, creating (or re-creating
+    if broken) it. Partitioning and OCR use separate pools so each can be
+    sized on its own.
+    """
+    with _POOL_LOCK:
+        pool = _POOLS.get(name)
+        if pool is None or getattr(pool, "_broken", False):
+            pool = ProcessPoolExecutor(
+                max_workers=max(1, workers),
+                mp_context=mp.get_context("spawn"),
+            )
+            _POOLS[name] = pool
+        return pool
+
+
+def pdf_page_count(pdf_path: str) -> int:
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+# ── Tier 1: unstructured fast ─────────────────────────────────────────────────
+
+def _partition_page_range(pdf_path: str, first: int, last: int) -> list:
+    """
+    Partition pages [first, last) (0-based) of `pdf_path` with unstructured's
+    fast strategy. A partial range is copied into a temporary sub-PDF, so
+    page numbers are shifted back to the original document's numbering and
+    filename metadata points at the original file.
+    """
+    import fitz  # PyMuPDF
+    from unstructured.partition.pdf import partition_pdf
+
+    with fitz.open(pdf_path) as src:
+        whole = first == 0 and last >= src.page_count
+        if not whole:
+            part = fitz.open()
+            part.insert_pdf(src, from_page=first, to_page=last - 1)
+
+    if whole:
+        return partition_pdf(filename=pdf_path, strategy="fast", infer_table_structure=True)
+
+    fd, part_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        part.save(part_path)
+        part.close()
+        elements = partition_pdf(
+            filename=part_path,
+            strategy="fast",
+            infer_table_structure=True,
+        )
+    finally:
+        try:
+            os.unlink(part_path)
+        except OSError:
+            pass
+
+    for el in elements:
+        if el.metadata.page_number:
+            el.metadata.page_number += first
+        el.metadata.filename       = os.path.basename(pdf_path)
+        el.metadata.file_directory = os.path.dirname(pdf_path)
+    return elements
+
+
+# ── Tier 2: PyMuPDF text layer ────────────────────────────────────────────────
+
+def _pymupdf_text_elements(pdf_path: str, first: int, last: int) -> list:
+    import fitz
+    from unstructured.documents.elements import Text, Title
+    elements = []
+    with fitz.open(pdf_path) as doc:
+        for page in doc.pages(first, last):
+            page_text = page.get_text("text").strip()
+            if not page_text:
+                continue
+            # split into paragraphs on double newlines
+            blocks = [b.strip() for b in page_text.split("\n\n") if b.strip()]
+            for j, block in enumerate(blocks):
+                # first block of each page treated as title candidate
+                el = Title(text=block) if j == 0 and len(block) < 120 else Text(text=block)
+                el.metadata.page_number = page.number + 1
+                elements.append(el)
+    return elements
+
+
+# ── Tier 3: Tesseract OCR on page renders ────────────────────────────────────
+# One task per page on the "ocr" pool. Each page image is hashed and its text
+# cached on disk, so a retry after a failure skips pages already done. The
+# cache is bounded: least-recently-used texts are evicted once it exceeds
+# OCR_CACHE_MAX_BYTES. Pages with (almost) no ink never reach Tesseract.
+
+OCR_CACHE_DIR       = os.getenv("OCR_CACHE_DIR", "ocr_cache")
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_MB", "64")) * 1024 * 1024
+BLANK_INK_DELTA     = 48       # grey levels away from the page background that count as ink
+BLANK_INK_FRACTION  = 1e-5     # pages with a smaller share of ink pixels are blank
+
+_ocr_written = 0               # bytes this process wrote since its last eviction pass
+
+
+def _ocr_cache_path(digest: str) -> str:
+    return os.path.join(OCR_CACHE_DIR, digest[:2], f"{digest}.txt")
+
+
+def _evict_ocr_cache():
+    """Drop least-recently-used OCR texts until under 90% of OCR_CACHE_MAX_BYTES."""
+    entries = []
+    for dirpath, _, files in os.walk(OCR_CACHE_DIR):
+        for name in files:
+            if name.endswith(".txt"):
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                    entries.append((st.st_mtime, st.st_size, os.path.join(dirpath, name)))
+                except OSError:
+                    pass
+    total = sum(size for _, size, _ in entries)
+    if total <= OCR_CACHE_MAX_BYTES:
+        return
+    entries.sort()
+    for _, size, p in entries:
+        if total <= OCR_CACHE_MAX_BYTES * 0.9:
+            break
+        try:
+            os.remove(p)
+            total -= size
+        except OSError:
+            pass
+
+
+def is_blank_image(img) -> bool:
+    """
+    True if almost no pixel differs from the page background. Counted at
+    full resolution, so a lone page number or a one-line caption is ink.
+    """
+    hist = img.convert("L").histogram()
+    bg   = max(range(256), key=hist.__getitem__)
+    ink  = sum(hist[:max(bg - BLANK_INK_DELTA, 0)]) + sum(hist[bg + BLANK_INK_DELTA + 1:])
+    return ink < BLANK_INK_FRACTION * sum(hist)
+
+
+def ocr_image_bytes(data: bytes) -> tuple:
+    """
+    Worker: OCR one encoded image. Returns (text, status) where status is
+    "cached", "blank" or "ocr".
+    """
+    import io
+    import hashlib
+    from PIL import Image as PILImage
+
+    global _ocr_written
+    path = _ocr_cache_path(hashlib.sha256(data).hexdigest())
+    try:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        os.utime(path)                    # mark as recently used
+        return text, "cached"
+    except OSError:
+        pass
+
+    img = PILImage.open(io.BytesIO(data))
+    if is_blank_image(img):
+        text, status = "", "blank"
+    else:
+        import pytesseract
+        text, status = pytesseract.image_to_string(img).strip(), "ocr"
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+    # OCR runs in several processes, so sizes are re-read from disk rather
+    # than tracked here; a pass every ~5% of the cap keeps that cheap
+    _ocr_written += len(text) + 1
+    if _ocr_written >= OCR_CACHE_MAX_BYTES // 20:
+        _ocr_written = 0
+        _evict_ocr_cache()
+    return text, status
+
+
+def _ocr_pdf_page(pdf_path: str, index: int) -> tuple:
+    """Worker: render page `index` (0-based) at 2x and OCR it."""
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        pix = doc[index].get_pixmap(matrix=fitz.Matrix(2.0, 2.0), alpha=False)   # 2x scale for better OCR
+        png = pix.tobytes("png")
+    return ocr_image_bytes(png)
+
+
+def text_to_elements(text: str, page_number: int = None) -> list:
+    """Split OCR output into unstructured Text elements on blank lines."""
+    from unstructured.documents.elements import Text
+    elements = []
+    for block in [b.strip() for b in text.split("\n\n") if b.strip()]:
+        el = Text(text=block)
+        if page_number:
+            el.metadata.page_number = page_number
+        elements.append(el)
+    return elements
+
+
+def ocr_pdf_pages(pdf_path: str, indices: list, workers: int) -> tuple:
+    """
+    OCR the given 0-based pages across the "ocr" pool.
+    Returns (elements in page order, {status: page count}).
+    """
+    pool    = get_process_pool(workers, name="ocr")
+    futures = [pool.submit(_ocr_pdf_page, pdf_path, i) for i in indices]
+    elements, stats = [], {}
+    for i, fut in zip(indices, futures):
+        text, status  = fut.result()
+        stats[status] = stats.get(status, 0) + 1
+        elements.extend(text_to_elements(text, page_number=i + 1))
+    return elements, stats
+
+
+def ocr_image_file(path: str, workers: int) -> list:
+    """OCR an uploaded image file on the "ocr" pool; returns Text elements."""
+    with open(path, "rb") as f:
+        data = f.read()
+    text, _ = get_process_pool(workers, name="ocr").submit(ocr_image_bytes, data).result()
+    return text_to_elements(text)
+
+
+# ── Preflight profiler ────────────────────────────────────────────────────────
+# One cheap PyMuPDF pass (text layer + image placement, no rendering) decides
+# each page's tier up front:
+#   "text"    — real text layer → unstructured fast (PyMuPDF text if it fails)
+#   "pymupdf" — a few characters, no big images → PyMuPDF text only
+#   "ocr"     — no usable text layer, or a scan with a stray text line → OCR
+# Consecutive pages with the same route are grouped into runs.
+
+MIN_TEXT_CHARS     = 50     # characters for a page to count as having a text layer
+OCR_IMAGE_COVERAGE = 0.30   # image-covered fraction above which thin text means a scan
+
+
+def _image_coverage(page) -> float:
+    import fitz
+    area = abs(page.rect)
+    if not area:
+        return 0.0
+    covered = 0.0
+    for info in page.get_image_info():
+        covered += abs(fitz.Rect(info["bbox"]) & page.rect)
+    return min(covered / area, 1.0)
+
+
+def route_page(chars: int, coverage: float) -> str:
+    if chars >= MIN_TEXT_CHARS:
+        return "text"
+    if chars and coverage < OCR_IMAGE_COVERAGE:
+        return "pymupdf"
+    return "ocr"
+
+
+def profile_pdf(pdf_path: str) -> list:
+    """Per-page preflight: [{"page", "chars", "image_coverage", "route"}]."""
+    import fitz
+    profile = []
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            chars    = len(page.get_text("text").strip())
+            coverage = _image_coverage(page)
+            profile.append({
+                "page":           page.number + 1,
+                "chars":          chars,
+                "image_coverage": round(coverage, 3),
+                "route":          route_page(chars, coverage),
+            })
+    return profile
+
+
+def plan_page_runs(profile: list, pages_per_range: int = 20) -> list:
+    """Group consecutive same-route pages into (first, last, route) runs, 0-based, last exclusive."""
+    runs = []
+    for p in profile:
+        i = p["page"] - 1
+        if runs and runs[-1][2] == p["route"] and runs[-1][1] == i \
+                and runs[-1][1] - runs[-1][0] < pages_per_range:
+            runs[-1] = (runs[-1][0], i + 1, p["route"])
+        else:
+            runs.append((i, i + 1, p["route"]))
+    return runs
+
+
+# ── Running the plan ──────────────────────────────────────────────────────────
+
+def extract_page_range(pdf_path: str, first: int, last: int, route: str = "text") -> tuple:
+    """
+    Worker: run the text-layer tiers for a "text" or "pymupdf" run over
+    pages [first, last), falling through only when a tier found nothing.
+    Returns (elements, tier_name, errors).
+    """
+    tiers = [("PyMuPDF text", _pymupdf_text_elements)]
+    if route == "text":
+        tiers.insert(0, ("unstructured fast", _partition_page_range))
+    errors = []
+    for name, tier in tiers:
+        try:
+            elements = tier(pdf_path, first, last)
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+            continue
+        if elements:
+            return elements, name, errors
+    return [], "", errors
+
+
+def _collect_ocr(first: int, futures: list, errors: list) -> tuple:
+    elements, stats = [], {}
+    try:
+        for i, fut in enumerate(futures):
+            text, status  = fut.result()
+            stats[status] = stats.get(status, 0) + 1
+            elements.extend(text_to_elements(text, page_number=first + i + 1))
+    except Exception as e:
+        return [], "", errors + [f"OCR: {e}"]
+    detail = ", ".join(f"{n} {k}" for k, n in sorted(stats.items()))
+    return elements, f"OCR — {detail}", errors
+
+
+def _submit_run(pdf_path, first, last, route, pool, ocr_pool):
+    """
+    Start a run. Returns (collect, futures): collect() waits for and returns
+    the run's result; futures lets the caller cancel work it no longer needs.
+    """
+    futures = []
+    if route == "ocr":
+        futures += [ocr_pool.submit(_ocr_pdf_page, pdf_path, i) for i in range(first, last)]
+        return (lambda: _collect_ocr(first, futures, [])), futures
+
+    if pool is None:
+        result = extract_page_range(pdf_path, first, last, route)
+    else:
+        futures.append(pool.submit(extract_page_range, pdf_path, first, last, route))
+
+    def collect():
+        elements, tier, errors = futures[0].result() if futures else result
+        if elements:
+            return elements, tier, errors
+        # the profiler expected text but the tiers found none — OCR the run
+        ocr_futures = [ocr_pool.submit(_ocr_pdf_page, pdf_path, i) for i in range(first, last)]
+        return _collect_ocr(first, ocr_futures, errors)
+    return collect, futures
+
+
+def iter_pdf_ranges(pdf_path: str, plan: list, workers: int, ocr_workers: int = 1):
+    """
+    Yield (first, last, elements, tier, errors) for each (first, last, route)
+    run of a preflight plan, in page order. Text runs go to the partition
+    pool and OCR runs fan out per page on the "ocr" pool at the same time,
+    with at most 2 × workers runs in flight so finished-but-unconsumed
+    results stay bounded while the caller is busy with later stages.
+    With workers <= 1 (or a one-run plan) text runs execute in-process.
+    """
+    ocr_pool = get_process_pool(ocr_workers, name="ocr")   # workers start on first submit
+    pool     = get_process_pool(workers) if workers > 1 and len(plan) > 1 else None
+    window   = workers * 2 if pool else 1
+
+    todo    = iter(plan)
+    pending = deque()
+    for run in plan[:window]:
+        next(todo)
+        pending.append((run[0], run[1], *_submit_run(pdf_path, *run, pool, ocr_pool)))
+    try:
+        while pending:
+            a, b, collect, _ = pending.popleft()
+            result = collect()
+            nxt    = next(todo, None)
+            if nxt:
+                pending.append((nxt[0], nxt[1], *_submit_run(pdf_path, *nxt, pool, ocr_pool)))
+            yield (a, b, *result)
+    finally:
+        for *_, futures in pending:
+            for fut in futures:
+                fut.cancel()
+
+
+# ── Streaming chunk_by_title ──────────────────────────────────────────────────
+
+def _element_key(el):
+    # Identity, not el.id: the synthetic Text/Title elements hash their text
+    # only, so repeated headers, footers and bullets would share an id.
+    return id(el)
+
+
+def iter_title_chunks(element_batches, fallback=None, chunker=None, **chunk_kwargs):
+    """
+    Run chunk_by_title (or `chunker`, same signature) over a stream of
+    element batches, yielding one list of finished chunks per batch.
+
+    The trailing chunk of a batch may continue into the next one, so its
+    elements (and those of any earlier chunk split from the same element)
+    are held back and re-chunked with the next batch. Elements are matched
+    by identity, and chunking is greedy left-to-right, so the output
+    matches chunking the whole list at once. A held chunk that began with
+    overlap text (chunker.chunk_elements: .metadata.lead) is re-chunked
+    with the same `lead`.
+    If the chunker raises, `fallback(elements)` chunks the batch instead.
+    """
+    if chunker is None:
+        from unstructured.chunking.title import chunk_by_title as chunker
+
+    carry, lead = [], ""
+    for batch in element_batches:
+        elements = carry + list(batch)
+        kwargs   = {**chunk_kwargs, "lead": lead} if lead else chunk_kwargs
+        carry, lead = [], ""
+        if not elements:
+            continue
+        try:
+            chunks = chunker(elements, **kwargs)
+        except Exception:
+            if fallback is None:
+                raise
+            yield fallback(elements)
+            continue
+
+        held = list(getattr(chunks[-1].metadata, "orig_elements", None) or []) if chunks else []
+        if held:
+            held_keys = {_element_key(e) for e in held}
+            k = len(chunks) - 1
+            # Follow the whole chain: an element split over several chunks
+            # pulls in every chunk it touches, and those chunks' elements too.
+            while k > 0:
+                prev = [_element_key(e) for e in
+                        (getattr(chunks[k - 1].metadata, "orig_elements", None) or [])]
+                if not held_keys.intersection(prev):
+                    break
+                held_keys.update(prev)
+                k -= 1
+            lead = getattr(chunks[k].metadata, "lead", "") or ""
+            seen = set()
+            for c in chunks[k:]:
+                for e in c.metadata.orig_elements:
+                    if _element_key(e) not in seen:
+                        seen.add(_element_key(e))
+                        carry.append(e)
+            chunks = chunks[:k]
+        yield chunks
+
+    if carry:
+        try:
+            yield chunker(carry, **({**chunk_kwargs, "lead": lead} if lead else chunk_kwargs))
+        except Exception:
+            if fallback is None:
+                raise
+            yield fallback(carry)
@@ -0,0 +1,87 @@
+import io
+import os
+import base64
+
+# ════════════════════════════════════════════════════════
+# Image normalisation before storage and LLM upload.
+#
+# Page renders and embedded DOCX/PPTX images are downscaled to what the
+# vision model can actually use (longest side MAX_SIDE px), flattened to
+# RGB, re-encoded as JPEG or WebP and stripped of EXIF/ICC metadata. Prompts
+# then attach images against a byte budget instead of a fixed count, so a
+# request never uploads more than REQUEST_BUDGET bytes of images.
+# ════════════════════════════════════════════════════════
+
+MAX_SIDE       = int(os.getenv("IMAGE_MAX_SIDE", "1024"))
+FORMAT         = os.getenv("IMAGE_FORMAT", "JPEG").upper()          # JPEG | WEBP
+QUALITY        = int(os.getenv("IMAGE_QUALITY", "80"))
+REQUEST_BUDGET = int(os.getenv("IMAGE_REQUEST_BUDGET_KB", "768")) * 1024
+MIN_IMAGE      = 4 * 1024      # stop filling a budget once less than this is left
+
+EXT  = {"JPEG": "jpg", "WEBP": "webp"}.get(FORMAT, "jpg")
+MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp"}.get(FORMAT, "image/jpeg")
+
+
+def normalise(data: bytes) -> bytes:
+    """Downscale, flatten and re-encode image bytes. Returns `data` unchanged on failure."""
+    try:
+        from PIL import Image, ImageOps
+        img = Image.open(io.BytesIO(data))
+        # already normalised — don't pay for a second lossy encode
+        if (img.format == FORMAT and max(img.size) <= MAX_SIDE
+                and "exif" not in img.info and "icc_profile" not in img.info):
+            return data
+
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "LA", "P"):
+            img    = img.convert("RGBA")
+            canvas = Image.new("RGB", img.size, (255, 255, 255))
+            canvas.paste(img, mask=img.split()[-1])
+            img    = canvas
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+
+        out = io.BytesIO()
+        img.save(out, format=FORMAT, quality=QUALITY, optimize=True)   # no exif/icc passed
+        result = out.getvalue()
+        return result if len(result) < len(data) else data
+    except Exception:
+        return data
+
+
+def normalise_b64(b64: str) -> str:
+    try:
+        return base64.b64encode(normalise(base64.b64decode(b64))).decode()
+    except Exception:
+        return b64
+
+
+def mime_of(b64: str) -> str:
+    if b64.startswith("iVBOR"):
+        return "image/png"
+    if b64.startswith("UklGR"):
+        return "image/webp"
+    return "image/jpeg"
+
+
+def image_blocks(images, budget: int = REQUEST_BUDGET) -> list:
+    """
+    LangChain image_url content blocks for `images` (base64 strings, may be a
+    lazy iterable) until `budget` bytes are spent. Images that don't fit are
+    skipped; iteration stops once the budget is practically exhausted.
+    """
+    blocks = []
+    for b64 in images:
+        if budget < MIN_IMAGE:
+            break
+        if not b64:
+            continue
+        b64  = normalise_b64(b64)
+        size = len(b64) * 3 // 4
+        if size > budget:
+            continue
+        budget -= size
+        blocks.append({"type": "image_url",
+                       "image_url": {"url": f"data:{mime_of(b64)};base64,{b64}"}})
+    return blocks
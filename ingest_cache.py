@@ -0,0 +1,326 @@
+import os
+import json
+import errno
+import shutil
+import hashlib
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:            # no advisory locks (Windows): refs are guarded per process only
+    fcntl = None
+
+# ════════════════════════════════════════════════════════
+# Content-addressed ingestion cache, shared by every user of the deployment.
+#
+# One entry per (uploaded bytes, pipeline settings):
+#   <CACHE_DIR>/<key>/records.jsonl     — one {id, page_content, metadata} per line
+#   <CACHE_DIR>/<key>/vectors.f32       — raw float32 embeddings, same order
+#   <CACHE_DIR>/<key>/meta.json         — counts, vector dim, doc hash, image blobs, settings
+#   <CACHE_DIR>/<key>/refs.json         — document ids that use this entry
+#
+# Entries are written and read in batches so neither side holds the whole
+# document in memory. They are immutable once committed; a user's index gets
+# its own copy of the vectors, so an entry is only freed when its last
+# reference goes. A session pins an entry before copying it; entries nobody
+# collected, and pins nobody released, expire after UNREF_TTL_SECS.
+# ════════════════════════════════════════════════════════
+
+CACHE_DIR      = os.getenv("INGEST_CACHE_DIR", "ingest_cache")
+UNREF_TTL_SECS = float(os.getenv("INGEST_CACHE_UNREF_TTL_HOURS", "24")) * 3600
+
+_LOCK = threading.Lock()   # guards refs.json read-modify-write (with a flock across processes)
+
+
+@contextmanager
+def _refs_locked():
+    with _LOCK:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(os.path.join(CACHE_DIR, ".refs.lock"), "w") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            yield
+
+
+def cache_key(file_bytes: bytes, settings: dict) -> str:
+    """SHA-256 of the uploaded bytes plus the pipeline settings."""
+    h = hashlib.sha256(file_bytes)
+    h.update(json.dumps(settings, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def _entry_dir(key: str) -> str:
+    return os.path.join(CACHE_DIR, key)
+
+
+def _write_json(path: str, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+
+# ── Reading ───────────────────────────────────────────────────────────────────
+
+def load_meta(key: str) -> dict:
+    """Return the entry's meta dict, or None on a miss."""
+    return _read_json(os.path.join(_entry_dir(key), "meta.json"), None)
+
+
+def iter_records(key: str, batch_size: int = 256):
+    """Yield (records, vectors) batches from a committed entry."""
+    import numpy as np
+    d    = _entry_dir(key)
+    meta = _read_json(os.path.join(d, "meta.json"), {})
+    dim  = meta.get("dim", 0)
+    vecs = np.memmap(os.path.join(d, "vectors.f32"), dtype=np.float32, mode="r") \
+             .reshape(-1, dim) if dim else None
+
+    batch, start = [], 0
+    with open(os.path.join(d, "records.jsonl")) as f:
+        for line in f:
+            batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield batch, vecs[start:start + len(batch)].tolist()
+                start += len(batch)
+                batch  = []
+    if batch:
+        yield batch, vecs[start:start + len(batch)].tolist()
+
+
+# ── Writing ───────────────────────────────────────────────────────────────────
+
+class EntryWriter:
+    """
+    Streams a new entry into a temp directory; commit() renames it into
+    place so readers never see a half-written entry. If another session
+    committed the same key first, theirs is kept.
+    """
+
+    def __init__(self, key: str, tmp_dir: str = None, resume: dict = None):
+        """
+        `tmp_dir` places the entry being written somewhere that outlives
+        this process (see checkpoint.py); `resume` is a position() from an
+        earlier attempt to continue from, dropping anything written after it.
+        """
+        self.key   = key
+        self.count = 0
+        self.dim   = 0
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.tmp = tmp_dir or f"{_entry_dir(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(self.tmp, exist_ok=True)
+        records = os.path.join(self.tmp, "records.jsonl")
+        vectors = os.path.join(self.tmp, "vectors.f32")
+        if resume:
+            for path, size in ((records, resume["records_bytes"]), (vectors, resume["vectors_bytes"])):
+                with open(path, "ab") as f:
+                    f.truncate(size)
+            self.count, self.dim = resume["count"], resume["dim"]
+        self._records = open(records, "a" if resume else "w")
+        self._vectors = open(vectors, "ab" if resume else "wb")
+
+    def add(self, records: list, vectors: list):
+        import numpy as np
+        arr = np.asarray(vectors, dtype=np.float32)
+        if arr.size:
+            self.dim = arr.shape[1]
+        for r in records:
+            self._records.write(json.dumps(r) + "\n")
+        self._vectors.write(arr.tobytes())
+        self.count += len(records)
+
+    def position(self) -> dict:
+        """Flush and return where the entry stands, for EntryWriter(resume=...)."""
+        self._records.flush()
+        self._vectors.flush()
+        return {"count": self.count, "dim": self.dim,
+                "records_bytes": self._records.tell(), "vectors_bytes": self._vectors.tell()}
+
+    def close(self):
+        """Stop writing but keep what was written (a later attempt resumes it)."""
+        for fh in (self._records, self._vectors):
+            try:
+                fh.close()
+            except Exception:
+                pass
+
+    def commit(self, meta: dict):
+        """
+        Move the entry into place. Raises (keeping the temp directory for a
+        retry) if that fails for any reason but an entry already being there.
+        """
+        self.close()
+        try:
+            _write_json(os.path.join(self.tmp, "refs.json"), [])
+            _write_json(os.path.join(self.tmp, "meta.json"), {
+                **meta, "count": self.count, "dim": self.dim, "created_at": time.time(),
+            })
+            _move_into_place(self.tmp, _entry_dir(self.key))
+        except OSError:
+            if load_meta(self.key) is None:
+                raise
+            self.abort()                           # someone else's commit won
+
+    def abort(self):
+        self.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def _move_into_place(src: str, dest: str):
+    """
+    Rename `src` to `dest`. A checkpointed entry may sit on another
+    filesystem (INGEST_CHECKPOINT_DIR); it is then copied next to `dest`
+    first, so the final step is still an atomic rename.
+    """
+    try:
+        os.rename(src, dest)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    staging = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.copytree(src, staging)
+    try:
+        os.rename(staging, dest)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    shutil.rmtree(src, ignore_errors=True)
+
+
+# ── Reference counting ────────────────────────────────────────────────────────
+
+def acquire(key: str, doc_id: str) -> bool:
+    """Record that document `doc_id` was indexed from entry `key`. False if the entry is gone."""
+    if not doc_id:
+        return False
+    path = os.path.join(_entry_dir(key), "refs.json")
+    with _refs_locked():
+        if not os.path.exists(_entry_dir(key)):
+            return False
+        refs = _read_json(path, [])
+        if doc_id not in refs:
+            refs.append(doc_id)
+            _write_json(path, refs)
+    return True
+
+
+def pin(key: str) -> str:
+    """
+    Hold entry `key` while a session copies it. Returns the pin (a
+    reference for release()), or None if the entry is gone. Pins expire
+    after UNREF_TTL_SECS.
+    """
+    ref = f"pending-{int(time.time())}-{uuid.uuid4().hex}"
+    return ref if acquire(key, ref) else None
+
+
+def _expired(ref: str, cutoff: float) -> bool:
+    kind, _, rest = ref.partition("-")
+    stamp = rest.split("-", 1)[0]
+    return kind == "pending" and stamp.isdigit() and int(stamp) < cutoff
+
+
+def release(doc_id: str) -> list:
+    """
+    Drop `doc_id`'s reference. When an entry has no references left it is
+    deleted from disk. Returns the meta dicts of the entries freed.
+    """
+    if not doc_id or not os.path.isdir(CACHE_DIR):
+        return []
+    freed = []
+    with _refs_locked():
+        for key in os.listdir(CACHE_DIR):
+            path = os.path.join(CACHE_DIR, key, "refs.json")
+            refs = _read_json(path, None)
+            if refs is None or doc_id not in refs:
+                continue
+            refs.remove(doc_id)
+            if refs:
+                _write_json(path, refs)
+            else:
+                freed.append(_read_json(os.path.join(CACHE_DIR, key, "meta.json"), {}))
+                shutil.rmtree(os.path.join(CACHE_DIR, key), ignore_errors=True)
+    return freed
+
+
+def prune_unreferenced(ttl: float = UNREF_TTL_SECS) -> list:
+    """
+    Drop pins older than `ttl` and delete entries that have had no
+    reference for that long: a worker committed them but no session
+    collected them, or the session holding them went away. Returns the
+    meta dicts of the entries freed.
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    cutoff, freed = time.time() - ttl, []
+    with _refs_locked():
+        for key in os.listdir(CACHE_DIR):
+            path = os.path.join(CACHE_DIR, key, "refs.json")
+            refs = _read_json(path, None)
+            if refs is None:
+                continue                          # temp dirs, the lock file
+            live = [r for r in refs if not _expired(r, cutoff)]
+            if live:
+                if live != refs:
+                    _write_json(path, live)
+                continue
+            try:
+                # refs.json is last written at commit or when a pin expires here
+                idle = live != refs or os.path.getmtime(path) < cutoff
+            except OSError:
+                continue
+            if idle:
+                freed.append(_read_json(os.path.join(CACHE_DIR, key, "meta.json"), {}))
+                shutil.rmtree(os.path.join(CACHE_DIR, key), ignore_errors=True)
+    return freed
+
+
+def free_sources(freed: list):
+    """Drop the source PDFs and image blobs no remaining entry was built from."""
+    import blob_store
+    import page_cache
+    for meta in freed:
+        h = meta.get("doc_hash")
+        if h and not uses_doc_hash(h):
+            page_cache.drop_source(h)
+    if freed:
+        blobs = set().union(*(m.get("blobs", []) for m in freed))
+        blob_store.remove(blobs - blobs_in_use())
+
+
+def uses_doc_hash(doc_hash: str) -> bool:
+    """True if any committed entry was built from the file with this hash."""
+    if not os.path.isdir(CACHE_DIR):
+        return False
+    return any(
+        _read_json(os.path.join(CACHE_DIR, key, "meta.json"), {}).get("doc_hash") == doc_hash
+        for key in os.listdir(CACHE_DIR)
+    )
+
+
+def blobs_in_use() -> set:
+    """Hashes of image blobs referenced by any committed entry."""
+    if not os.path.isdir(CACHE_DIR):
+        return set()
+    used = set()
+    for key in os.listdir(CACHE_DIR):
+        used.update(_read_json(os.path.join(CACHE_DIR, key, "meta.json"), {}).get("blobs", []))
+    return used
+
+
+def ref_count(key: str) -> int:
+    return len(_read_json(os.path.join(_entry_dir(key), "refs.json"), []))
@@ -0,0 +1,340 @@
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import socket
+import sqlite3
+import argparse
+import threading
+import multiprocessing as mp
+
+# ════════════════════════════════════════════════════════
+# Persistent ingestion job queue, drained by a pool of worker processes.
+#
+# Uploads are saved under UPLOAD_DIR and queued in one SQLite file shared by
+# every Streamlit session (and server process) on the machine. Each worker
+# claims the oldest queued job, runs ingest_pipeline.run and beats a
+# heartbeat every HEARTBEAT_SECS while it works. A running job whose
+# heartbeat is older than STALE_SECS belonged to a worker that died, so it
+# is re-queued, or failed after MAX_ATTEMPTS. Nobody has to guess how long a
+# document may take.
+#
+# Workers are started lazily by the app (ensure_workers), or run on their own:
+#   python ingest_jobs.py --workers 4      # with INGEST_WORKER_PROCESSES=0 in the app
+# Each of N workers gets 1/N of the cores for its partition and OCR pools
+# and its embedding model's threads (PARTITION_WORKERS, OCR_WORKERS and
+# OMP_NUM_THREADS override that). Each worker loads its own model copy; LLM
+# slots (llm_limits) and the cache counters are shared across processes.
+# ════════════════════════════════════════════════════════
+
+DB_PATH        = os.getenv("INGEST_JOBS_PATH", "ingest_jobs.sqlite3")
+UPLOAD_DIR     = os.getenv("INGEST_UPLOAD_DIR", "ingest_uploads")
+WORKERS        = int(os.getenv("INGEST_WORKER_PROCESSES", "2"))
+HEARTBEAT_SECS = 5
+STALE_SECS     = int(os.getenv("INGEST_STALE_SECS", "60"))
+MAX_ATTEMPTS   = 2
+POLL_SECS      = 1.0
+JOB_TTL_SECS   = 24 * 3600      # finished jobs are pruned after a day
+
+_LOCK  = threading.Lock()
+_CONN  = None
+_PROCS = []
+
+
+def _conn() -> sqlite3.Connection:
+    global _CONN
+    if _CONN is None:
+        _CONN = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False, isolation_level=None)
+        _CONN.execute("PRAGMA journal_mode=WAL")
+        _CONN.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, user_id TEXT, name TEXT, ext TEXT, path TEXT,"
+            " cache_key TEXT, settings TEXT, status TEXT NOT NULL, created REAL NOT NULL,"
+            " started REAL, heartbeat REAL, finished REAL, worker TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0, progress TEXT, result TEXT, error TEXT)"
+        )
+        _CONN.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created)")
+        _CONN.execute(
+            "CREATE TABLE IF NOT EXISTS job_logs ("
+            " job_id TEXT NOT NULL, ts REAL NOT NULL, level TEXT, msg TEXT)"
+        )
+        _CONN.execute("CREATE INDEX IF NOT EXISTS job_logs_job ON job_logs(job_id, ts)")
+    return _CONN
+
+
+def _row(cur) -> dict:
+    row = cur.fetchone()
+    if row is None:
+        return None
+    job = dict(zip([c[0] for c in cur.description], row))
+    for k in ("settings", "progress", "result"):
+        job[k] = json.loads(job[k]) if job[k] else None
+    return job
+
+
+# ── App side ──────────────────────────────────────────────────────────────────
+
+def submit(user_id: str, name: str, ext: str, file_bytes: bytes,
+           cache_key: str, settings: dict) -> str:
+    """Save the upload and queue it; returns the job id."""
+    job_id = uuid.uuid4().hex
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_DIR, f"{job_id}.{ext}")
+    with open(path, "wb") as f:
+        f.write(file_bytes)
+    with _LOCK:
+        _conn().execute(
+            "INSERT INTO jobs (id, user_id, name, ext, path, cache_key, settings, status, created)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?)",
+            (job_id, user_id, name, ext, path, cache_key, json.dumps(settings), time.time()),
+        )
+    ensure_workers()
+    return job_id
+
+
+def get(job_id: str) -> dict:
+    with _LOCK:
+        return _row(_conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)))
+
+
+def queue_position(job_id: str) -> int:
+    """1-based position among queued jobs (0 once it has left the queue)."""
+    with _LOCK:
+        return _conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued'"
+            " AND created <= (SELECT created FROM jobs WHERE id = ? AND status = 'queued')",
+            (job_id,),
+        ).fetchone()[0]
+
+
+def queued_after(job_id: str) -> int:
+    """Queued jobs submitted after this one."""
+    with _LOCK:
+        return _conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued'"
+            " AND created > (SELECT created FROM jobs WHERE id = ?)",
+            (job_id,),
+        ).fetchone()[0]
+
+
+def overview() -> dict:
+    """
+    Queued/running job counts and live local workers. Restarts local
+    workers if jobs are waiting and some have died (or this is a new
+    server process whose requeued jobs nobody would pick up).
+    """
+    requeue_stale()
+    with _LOCK:
+        counts = dict(_conn().execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status"
+        ).fetchall())
+    if counts.get("queued", 0) and sum(p.is_alive() for p in _PROCS) < WORKERS:
+        ensure_workers()
+    return {"queued":  counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "workers": sum(p.is_alive() for p in _PROCS)}
+
+
+def logs(job_id: str) -> list:
+    with _LOCK:
+        rows = _conn().execute(
+            "SELECT msg, level FROM job_logs WHERE job_id = ? ORDER BY ts", (job_id,)
+        ).fetchall()
+    return [{"msg": m, "level": lvl} for m, lvl in rows]
+
+
+def forget(job_id: str):
+    """Drop a finished job once the app has picked up its result."""
+    with _LOCK:
+        _conn().execute("DELETE FROM jobs WHERE id = ? AND status IN ('done', 'failed')", (job_id,))
+        _conn().execute("DELETE FROM job_logs WHERE job_id = ?", (job_id,))
+
+
+# ── Worker side ───────────────────────────────────────────────────────────────
+
+def claim(worker: str) -> dict:
+    """Atomically move the oldest queued job to running and return it."""
+    with _LOCK:
+        c = _conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+            ).fetchone()
+            if row is None:
+                c.execute("COMMIT")
+                return None
+            now = time.time()
+            c.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started = ?, heartbeat = ?,"
+                " attempts = attempts + 1, error = NULL WHERE id = ?",
+                (worker, now, now, row[0]),
+            )
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        return _row(c.execute("SELECT * FROM jobs WHERE id = ?", (row[0],)))
+
+
+def heartbeat(job_id: str, worker: str, progress: dict = None):
+    with _LOCK:
+        if progress is None:
+            _conn().execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ?",
+                            (time.time(), job_id, worker))
+        else:
+            _conn().execute("UPDATE jobs SET heartbeat = ?, progress = ? WHERE id = ? AND worker = ?",
+                            (time.time(), json.dumps(progress), job_id, worker))
+
+
+def add_log(job_id: str, msg: str, level: str = "info"):
+    with _LOCK:
+        _conn().execute("INSERT INTO job_logs (job_id, ts, level, msg) VALUES (?, ?, ?, ?)",
+                        (job_id, time.time(), level, msg))
+
+
+def _finish(job_id: str, worker: str, status: str, result: dict = None, error: str = None):
+    with _LOCK:
+        _conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ? AND worker = ?",
+            (status, json.dumps(result) if result is not None else None, error,
+             time.time(), job_id, worker),
+        )
+
+
+def requeue_stale():
+    """Re-queue (or fail, after MAX_ATTEMPTS) running jobs whose worker stopped beating."""
+    cutoff = time.time() - STALE_SECS
+    with _LOCK:
+        _conn().execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,"
+            " error = 'Ingestion worker stopped responding', worker = NULL,"
+            " finished = CASE WHEN attempts >= ? THEN ? ELSE NULL END"
+            " WHERE status = 'running' AND heartbeat < ?",
+            (MAX_ATTEMPTS, MAX_ATTEMPTS, time.time(), cutoff),
+        )
+
+
+def prune():
+    """
+    Delete uploads and rows of jobs that finished more than JOB_TTL_SECS
+    ago, and ingestion cache entries left without a reference.
+    """
+    import checkpoint
+    import ingest_cache
+    checkpoint.prune()
+    ingest_cache.free_sources(ingest_cache.prune_unreferenced())
+    cutoff = time.time() - JOB_TTL_SECS
+    with _LOCK:
+        rows = _conn().execute(
+            "SELECT id, path FROM jobs WHERE status IN ('done', 'failed') AND finished < ?", (cutoff,)
+        ).fetchall()
+        for job_id, path in rows:
+            _remove(path)
+            _conn().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            _conn().execute("DELETE FROM job_logs WHERE job_id = ?", (job_id,))
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except (OSError, TypeError):
+        pass
+
+
+def run_job(job: dict, worker: str):
+    """Run one claimed job, beating its heartbeat from a side thread."""
+    job_id = job["id"]
+    stop   = threading.Event()
+
+    def beat():
+        while not stop.wait(HEARTBEAT_SECS):
+            heartbeat(job_id, worker)
+
+    def progress(fraction: float, message: str = ""):
+        heartbeat(job_id, worker, {"fraction": round(fraction, 4), "message": message})
+
+    threading.Thread(target=beat, daemon=True).start()
+    try:
+        import ingest_pipeline
+        meta = ingest_pipeline.run(
+            job["path"], job["ext"], job["cache_key"], job["settings"],
+            log=lambda msg, level="info": add_log(job_id, msg, level),
+            progress=progress,
+        )
+        _finish(job_id, worker, "done", result=meta)
+        _remove(job["path"])
+    except Exception as e:
+        add_log(job_id, f"Pipeline failed: {e}", "error")
+        _finish(job_id, worker, "failed", error=str(e))
+        _remove(job["path"])
+    finally:
+        stop.set()
+
+
+def cpu_share(n_workers: int) -> int:
+    """Cores per worker when `n_workers` share the machine."""
+    return max(1, (os.cpu_count() or 1) // max(1, n_workers))
+
+
+def worker_main(parent_pid: int = None, cpus: int = None):
+    """Claim and run jobs until the parent process (if any) goes away."""
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except Exception:
+        pass
+    # before ingest_pipeline (pool sizes) and torch (thread count) are imported
+    cpus = cpus or os.cpu_count() or 1
+    for var in ("PARTITION_WORKERS", "OCR_WORKERS", "OMP_NUM_THREADS"):
+        os.environ.setdefault(var, str(cpus))
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    last_prune = 0.0
+    while parent_pid is None or os.getppid() == parent_pid:
+        requeue_stale()
+        if time.time() - last_prune > 3600:
+            prune()
+            last_prune = time.time()
+        job = claim(worker)
+        if job is None:
+            time.sleep(POLL_SECS)
+            continue
+        run_job(job, worker)
+
+
+# ── Local worker processes ────────────────────────────────────────────────────
+# Not daemonic: workers start their own partition/OCR process pools, which
+# daemonic processes may not do. They exit with the server (atexit) or on
+# their own once they notice their parent has gone.
+
+def ensure_workers(n: int = WORKERS):
+    """Start local workers until `n` are alive. No-op for n <= 0."""
+    with _LOCK:
+        _PROCS[:] = [p for p in _PROCS if p.is_alive()]
+        ctx = mp.get_context("spawn")
+        while len(_PROCS) < n:
+            p = ctx.Process(target=worker_main, args=(os.getpid(), cpu_share(n)),
+                            name=f"ingest-worker-{len(_PROCS)}")
+            p.start()
+            _PROCS.append(p)
+
+
+@atexit.register
+def _stop_workers():
+    for p in _PROCS:
+        if p.is_alive():
+            p.terminate()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Run ingestion workers")
+    ap.add_argument("--workers", type=int, default=max(WORKERS, 1))
+    args = ap.parse_args()
+    if args.workers <= 1:
+        worker_main()
+        sys.exit(0)
+    ensure_workers(args.workers)
+    for p in _PROCS:
+        p.join()
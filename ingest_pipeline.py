@@ -0,0 +1,487 @@
+import os
+import json
+import hashlib
+
+import blob_store
+import checkpoint
+import dedup
+import image_norm
+import ingest_cache
+import llm_client
+import llm_limits
+import page_cache
+
+# ════════════════════════════════════════════════════════
+# Indexing pipeline (partition → chunk → dedup → summarise → embed) without
+# Streamlit, so it can run in an ingest_jobs worker process.
+#
+# The output is a committed ingest_cache entry: records, vectors and meta.
+# Nothing is written to a user's vector store here. The app copies the
+# finished entry into the user's Chroma collection (the cache-hit path), so
+# only the Streamlit process ever opens a user's store.
+# ════════════════════════════════════════════════════════
+
+PARTITION_WORKERS = int(os.getenv("PARTITION_WORKERS", os.cpu_count() or 1))
+PAGES_PER_RANGE   = 20   # PDF pages per parallel partition task
+OCR_WORKERS       = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+EMBED_BATCH_SIZE  = 64   # chunks per embed + cache write
+
+PAGE_ROUTE_LABELS = {
+    "text":    "text-layer pages",
+    "pymupdf": "light-text pages",
+    "ocr":     "scanned pages (OCR)",
+}
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+def resolve_image(ref) -> str:
+    """
+    Base64 for an image reference, loaded on demand:
+      ("blob", hash)            → blob_store
+      ("page", doc_hash, page)  → page_cache render
+      ("b64", data) / str       → inline data (chunks indexed before the blob store)
+    """
+    if isinstance(ref, str):
+        return ref
+    kind = ref[0]
+    if kind == "blob":
+        return blob_store.get_b64(ref[1])
+    if kind == "page":
+        return page_cache.get_page(ref[1], ref[2])
+    return ref[1]
+
+
+# ── Image extraction ──────────────────────────────────────────────────────────
+
+def extract_images_from_docx(docx_path: str) -> list:
+    """Store a Word document's embedded images in the blob store; returns their hashes."""
+    try:
+        from docx import Document as DocxDocument
+        doc    = DocxDocument(docx_path)
+        images = []
+        for rel in doc.part.rels.values():
+            if "image" in rel.reltype:
+                images.append(blob_store.put(image_norm.normalise(rel.target_part.blob)))
+        return images
+    except Exception:
+        return []
+
+
+def extract_images_from_pptx(pptx_path: str) -> list:
+    """Store a PowerPoint file's pictures in the blob store; returns their hashes."""
+    try:
+        from pptx import Presentation
+        prs    = Presentation(pptx_path)
+        images = []
+        for slide in prs.slides:
+            for shape in slide.shapes:
+                if shape.shape_type == 13:          # MSO_SHAPE_TYPE.PICTURE = 13
+                    images.append(blob_store.put(image_norm.normalise(shape.image.blob)))
+        return images
+    except Exception:
+        return []
+
+
+# ── Chunks ────────────────────────────────────────────────────────────────────
+
+def chunk_page_numbers(chunk) -> set:
+    """1-based page numbers a chunk's elements came from."""
+    page_nums = set()
+    meta      = getattr(chunk, "metadata", None)
+    if getattr(meta, "page_number", None):
+        page_nums.add(int(meta.page_number))
+    for el in getattr(meta, "orig_elements", None) or []:
+        pn = getattr(getattr(el, "metadata", None), "page_number", None)
+        if pn:
+            page_nums.add(int(pn))
+    return page_nums
+
+
+def separate(chunk, paged: bool = False, loose_images=(), chunk_idx: int = 0, n_chunks: int = 1) -> dict:
+    """
+    Split a chunk into its text, table HTML and image references. PDF
+    chunks (paged) get the numbers of the pages they came from; DOCX/PPTX
+    chunks get an even share of the embedded images' blob hashes. Nothing
+    is loaded or rendered here.
+    """
+    d = {"text": chunk.text, "tables": [], "images": [], "pages": []}
+
+    # ── PDF: page references, not renders ─────────────────
+    if paged:
+        d["pages"] = sorted(chunk_page_numbers(chunk))
+
+    # ── DOCX/PPTX: distribute loose images evenly ─────────
+    if loose_images:
+        per_chunk = max(1, len(loose_images) // max(n_chunks, 1))
+        start     = chunk_idx * per_chunk
+        d["images"].extend(loose_images[start: start + per_chunk])
+
+    # ── tables from unstructured elements ─────────────────
+    for el in getattr(chunk.metadata, "orig_elements", None) or []:
+        if type(el).__name__ == "Table":
+            d["tables"].append(getattr(el.metadata, "text_as_html", el.text))
+
+    return d
+
+
+def ai_summary(text, tables, images, model: str = llm_client.DEFAULT_MODEL):
+    """
+    Searchable description of a chunk with tables/images. Runs on the
+    summary thread pool — errors propagate and the caller logs them and
+    falls back to the raw text.
+    """
+    p = f"Create a detailed, searchable description for retrieval.\n\nTEXT:\n{text}\n\n"
+    for i, t in enumerate(tables):
+        p += f"TABLE {i+1}:\n{t}\n\n"
+    p += "Cover key facts, numbers, topics, questions this answers, search terms, and describe any visible diagrams, figures, or formulas.\n\nDESCRIPTION:"
+    # images are attached against a byte budget, not a count
+    content = [{"type": "text", "text": p}] + image_norm.image_blocks(images)
+    return llm_client.invoke_cached(content, model=model)
+
+
+# ── Partitioning ──────────────────────────────────────────────────────────────
+
+def partition_non_pdf(tmp_path: str, ext: str) -> list:
+    """Partition any supported non-PDF upload into unstructured elements."""
+    if ext == "docx":
+        from unstructured.partition.docx import partition_docx
+        return partition_docx(filename=tmp_path)
+    if ext == "pptx":
+        from unstructured.partition.pptx import partition_pptx
+        return partition_pptx(filename=tmp_path)
+    if ext == "xlsx":
+        from unstructured.partition.xlsx import partition_xlsx
+        return partition_xlsx(filename=tmp_path)
+    if ext in ("png", "jpg", "jpeg"):
+        # images: OCR directly (cached by image hash, blank images skipped)
+        try:
+            from extraction import ocr_image_file
+            return ocr_image_file(tmp_path, workers=OCR_WORKERS)
+        except Exception:
+            from unstructured.partition.image import partition_image
+            return partition_image(filename=tmp_path, strategy="fast")
+    if ext == "html":
+        from unstructured.partition.html import partition_html
+        return partition_html(filename=tmp_path)
+    if ext == "csv":
+        from unstructured.partition.csv import partition_csv
+        return partition_csv(filename=tmp_path)
+    if ext in ("txt", "md"):
+        return [el for batch in iter_text_batches(tmp_path) for el in batch]
+    from unstructured.partition.auto import partition
+    return partition(filename=tmp_path)
+
+
+def iter_text_batches(tmp_path: str, on_batch=None, batch_chars: int = 1_000_000):
+    """
+    txt/md uploads: stream paragraphs off disk (stream_splitter) and run
+    partition_text on about `batch_chars` of them at a time, so a multi-GB
+    dump is never held in memory whole. The encoding is detected from the
+    head of the file, as partition_text would; bytes it can't decode
+    further in are replaced.
+    """
+    from unstructured.partition.text import partition_text
+    from stream_splitter import detect_encoding, file_size, iter_file_splits
+
+    size         = max(file_size(tmp_path), 1)
+    encoding     = detect_encoding(tmp_path)
+    group, chars = [], 0
+    for piece, offset in iter_file_splits(tmp_path, encoding=encoding, errors="replace"):
+        group.append(piece)
+        chars += len(piece)
+        if chars >= batch_chars:
+            elements = partition_text(text="\n\n".join(group))
+            if on_batch:
+                on_batch(elements, min(offset / size, 1.0))
+            yield elements
+            group, chars = [], 0
+    if group:
+        elements = partition_text(text="\n\n".join(group))
+        if on_batch:
+            on_batch(elements, 1.0)
+        yield elements
+
+
+def iter_element_batches(tmp_path: str, ext: str, on_batch=None, log=_noop, ckpt=None):
+    """
+    Yield element batches for the streaming pipeline: one per preflight run
+    for PDFs (extraction tier chosen per page), streamed paragraph batches for
+    txt/md, one batch for everything else.
+    on_batch(elements, fraction_done) runs before each yield.
+    With a checkpoint, batches already partitioned by an earlier attempt are
+    replayed from it and new ones saved to it (txt/md re-read the file —
+    that's cheaper than storing it).
+    """
+    if ext in ("txt", "md"):
+        yield from iter_text_batches(tmp_path, on_batch)
+        return
+    if ext != "pdf":
+        if ckpt and ckpt.element_batches():
+            elements = ckpt.load_elements(0)
+        else:
+            elements = partition_non_pdf(tmp_path, ext)
+            if ckpt:
+                ckpt.save_elements(0, elements)
+        if on_batch:
+            on_batch(elements, 1.0)
+        yield elements
+        return
+
+    from extraction import iter_pdf_ranges, plan_page_runs, profile_pdf
+
+    # ── preflight: pick each page's tier before any extraction starts ──
+    profile = profile_pdf(tmp_path)
+    n_pages = max(len(profile), 1)
+    plan    = plan_page_runs(profile, PAGES_PER_RANGE)
+    routes  = {}
+    for p in profile:
+        routes[p["route"]] = routes.get(p["route"], 0) + 1
+    plan_msg = " · ".join(f"{n} {PAGE_ROUTE_LABELS.get(r, r)}" for r, n in sorted(routes.items()))
+    log(f"Preflight plan: {len(profile)} pages in {len(plan)} runs — {plan_msg}")
+
+    # one batch per plan run, so a checkpoint's batches are a prefix of the plan
+    done = min(ckpt.element_batches(), len(plan)) if ckpt else 0
+    if done:
+        log(f"Resuming: pages 1–{plan[done - 1][1]} already partitioned", "success")
+    for i in range(done):
+        elements = ckpt.load_elements(i)
+        if on_batch:
+            on_batch(elements, plan[i][1] / n_pages)
+        yield elements
+
+    for i, (first, last, elements, tier, errors) in enumerate(iter_pdf_ranges(
+        tmp_path,
+        plan[done:],
+        workers=PARTITION_WORKERS,
+        ocr_workers=OCR_WORKERS,
+    ), start=done):
+        for err in errors:
+            log(f"Pages {first + 1}–{last}: {err}", "error")
+        log(f"Pages {first + 1}–{last} ({tier or 'no text found'}): {len(elements)} elements")
+        if ckpt:
+            ckpt.save_elements(i, elements)
+        if on_batch:
+            on_batch(elements, last / n_pages)
+        yield elements
+
+
+# ── Pipeline ──────────────────────────────────────────────────────────────────
+
+def run(path: str, ext: str, cache_key: str, settings: dict, log=_noop, progress=_noop) -> dict:
+    """
+    Index the file at `path` into the ingest_cache entry `cache_key` and
+    return its meta. `settings` is the app's PIPELINE_SETTINGS.
+    log(msg, level) and progress(fraction, message) report back.
+
+    Progress is checkpointed (checkpoint.py) under the cache key: partitioned
+    element batches, per-chunk summaries, and the entry written so far
+    up to the last embedded chunk. A retry after a failure or a killed
+    worker re-chunks from the saved elements, skips finished chunks and
+    carries on from there.
+    """
+    meta = ingest_cache.load_meta(cache_key)
+    if meta:
+        log("Already in the ingestion cache — nothing to do", "success")
+        return meta
+
+    ckpt = checkpoint.Checkpoint(cache_key)     # waits (bounded) if another job has this key
+    meta = ingest_cache.load_meta(cache_key)
+    if meta:
+        ckpt.close()
+        log("Indexed by an identical job meanwhile — nothing to do", "success")
+        return meta
+    try:
+        return _run(path, ext, cache_key, settings, ckpt, log, progress)
+    finally:
+        ckpt.close()
+
+
+def _run(path, ext, cache_key, settings, ckpt, log, progress) -> dict:
+    from langchain_core.documents import Document
+    from concurrent.futures import as_completed
+    import embedding_model
+    from extraction import iter_title_chunks
+
+    # ── document info & images (persistent stores — only the refs are saved) ──
+    doc = ckpt.state.get("doc")
+    if doc and all(blob_store.exists(h) for h in doc["blobs"]) \
+            and (not doc["doc_hash"] or page_cache.has_source(doc["doc_hash"])):
+        log(f"Resuming from checkpoint: {ckpt.state.get('chunks_done', 0)} chunks already indexed",
+            "success")
+    else:
+        with open(path, "rb") as f:
+            file_bytes = f.read()
+        doc = {"doc_hash": "", "page_count": 0, "blobs": []}
+        if ext == "pdf":
+            from extraction import pdf_page_count
+            # PDFs keep their source so pages can be rendered on demand
+            doc["doc_hash"]   = page_cache.document_hash(file_bytes)
+            page_cache.register_source(doc["doc_hash"], path)
+            doc["page_count"] = pdf_page_count(path)
+        elif ext == "docx":
+            doc["blobs"] = extract_images_from_docx(path)
+            log(f"{len(doc['blobs'])} images from DOCX", "success")
+        elif ext == "pptx":
+            doc["blobs"] = extract_images_from_pptx(path)
+            log(f"{len(doc['blobs'])} images from PPTX", "success")
+        del file_bytes
+        ckpt.update(doc=doc)
+    doc_hash, page_count, loose_images = doc["doc_hash"], doc["page_count"], doc["blobs"]
+
+    embeddings  = embedding_model.get_embeddings(settings["embed_model"],
+                                                 backend=settings["embed_backend"])
+    if embeddings.backend != settings["embed_backend"]:
+        # the app resolved the backend; vectors from another one would be mislabelled
+        raise RuntimeError(f"Embedding backend {settings['embed_backend']} is unavailable "
+                           f"in this worker ({embeddings.backend} loaded)")
+    model       = settings.get("llm_model", llm_client.DEFAULT_MODEL)
+    chunks_done = ckpt.state.get("chunks_done", 0)
+    writer      = ingest_cache.EntryWriter(cache_key, tmp_dir=ckpt.entry_dir,
+                                           resume=ckpt.state.get("writer") if chunks_done else None)
+    counts      = {"elements": 0, "chunks": 0, "summed": 0}
+    frac        = [0.0]
+
+    def on_batch(elements, fraction):
+        counts["elements"] += len(elements)
+        frac[0] = min(fraction, 1.0)
+        progress(frac[0], f"{counts['elements']} elements · {counts['chunks']} chunks")
+
+    def flush(pending, upto: int):
+        """Embed one batch of (id, Document), write it to the cache entry, checkpoint."""
+        vectors = embeddings.embed_documents([d.page_content for _, d in pending])
+        writer.add(
+            [{"id": i, "page_content": d.page_content, "metadata": d.metadata} for i, d in pending],
+            vectors,
+        )
+        ckpt.update(chunks_done=upto, writer=writer.position())
+
+    chunk_kwargs = {
+        "max_characters":             settings["max_chars"],
+        "new_after_n_chars":          settings["new_after"],
+        "combine_text_under_n_chars": settings["combine"],
+    }
+    native_kwargs = {**chunk_kwargs, "overlap": settings.get("overlap", 0)}
+
+    def native_chunks(elements: list) -> list:
+        """Fallback for when chunk_by_title fails: the native sentence-aware chunker."""
+        from chunker import chunk_elements
+        log("chunk_by_title failed — used the native chunker", "error")
+        return chunk_elements(elements, **native_kwargs)
+
+    pending   = []        # (id, Document) awaiting embedding
+    inflight  = []        # summary futures of the current chunk batch
+    near_dups = dedup.NearDupIndex(settings.get("dedup_hamming", dedup.HAMMING))
+    backrefs  = {}        # canonical id -> near-duplicates collapsed into it
+    pool      = llm_limits.get_thread_pool()
+    g         = 0         # chunk index over the whole document
+    try:
+        element_batches = iter_element_batches(path, ext, on_batch=on_batch, log=log, ckpt=ckpt)
+        if settings.get("chunker") == "native":
+            from chunker import chunk_elements
+            chunk_batches = iter_title_chunks(element_batches, chunker=chunk_elements, **native_kwargs)
+        else:
+            chunk_batches = iter_title_chunks(element_batches, fallback=native_chunks, **chunk_kwargs)
+        n_total = 0
+        if loose_images:
+            # images are shared out over the whole document; DOCX/PPTX come
+            # as one element batch, so collecting its chunks costs nothing extra
+            chunk_batches = list(chunk_batches)
+            n_total       = sum(len(c) for c in chunk_batches)
+        for chunks in chunk_batches:
+            # summaries run concurrently (bounded per provider by
+            # llm_limits); results are consumed in chunk order
+            jobs = []
+            for chunk in chunks:
+                cd    = separate(chunk, bool(doc_hash), loose_images, g, n_total)
+                # ids follow the chunk's position, so a resumed run and its
+                # checkpointed records agree on them
+                cid   = hashlib.sha256(f"{cache_key}:{g}".encode()).hexdigest()[:32]
+                canon = near_dups.add("\n".join([cd["text"], *cd["tables"]]), cid)
+                g    += 1
+                if canon is not None:
+                    # repeated header/template slide: one back-reference, no
+                    # summary, no vector
+                    backrefs.setdefault(canon, []).append({"chunk": g - 1, "pages": cd["pages"]})
+                    continue
+                if g <= chunks_done:
+                    continue                      # embedded by an earlier attempt
+                fut = None
+                if (cd["tables"] or cd["images"] or cd["pages"]) and g - 1 not in ckpt.summaries:
+                    refs = ([("page", doc_hash, p) for p in cd["pages"]]
+                            + [("blob", h) for h in cd["images"]])
+                    # lazy: pages past the byte budget are never rendered
+                    images = (resolve_image(r) for r in refs)
+                    fut    = pool.submit(ai_summary, cd["text"], cd["tables"], images, model)
+                jobs.append((g - 1, cid, cd, fut))
+            inflight = {f: n for n, _, _, f in jobs if f}
+            for fut in as_completed(inflight):
+                counts["summed"] += 1
+                if not fut.exception():
+                    ckpt.save_summary(inflight[fut], fut.result())
+                progress(frac[0], f"{counts['summed']} chunk summaries done")
+
+            for n, cid, cd, fut in jobs:
+                enhanced = ckpt.summaries.get(n, cd["text"])
+                if fut is not None:
+                    try:
+                        enhanced = fut.result()
+                    except Exception as e:
+                        log(f"AI summary error: {e}", "error")
+                pending.append((cid, Document(
+                    page_content=enhanced,
+                    metadata={"original_content": json.dumps({
+                        "raw_text":     cd["text"],
+                        "tables_html":  cd["tables"],
+                        "image_refs":   cd["images"],
+                        "doc_hash":     doc_hash,
+                        "pages":        cd["pages"],
+                    })}
+                )))
+                if len(pending) >= EMBED_BATCH_SIZE:
+                    flush(pending, n + 1)
+                    pending = []
+            counts["chunks"] += len(chunks)
+        if pending:
+            flush(pending, g)
+
+        # final check — if still empty after all fallbacks, abort cleanly
+        if not counts["elements"]:
+            raise ValueError(
+                "Could not extract any text from this document after trying "
+                "three methods (unstructured, PyMuPDF text layer, OCR). "
+                "The file may be corrupted, password-protected, or contain "
+                "only non-readable content."
+            )
+
+        meta = {
+            "elements":   counts["elements"],
+            "chunks":     counts["chunks"],
+            "duplicates": near_dups.duplicates,
+            "dedup_rate": near_dups.rate(),
+            "backrefs":   backrefs,
+            "page_count": page_count,
+            "doc_hash":   doc_hash,
+            "blobs":      loose_images,
+            "settings":   settings,
+        }
+        writer.commit(meta=meta)
+        ckpt.clear()
+    except Exception:
+        for f in inflight:
+            f.cancel()
+        writer.close()                 # kept for the next attempt
+        log("Progress is checkpointed — running the same file again resumes here", "error")
+        raise
+
+    log(f"{counts['summed']} chunk summaries", "success")
+    log(f"{near_dups.duplicates}/{near_dups.seen} chunks collapsed as near-duplicates "
+        f"({near_dups.rate():.0%})", "success")
+    log(f"{counts['elements']} elements → {counts['chunks']} chunks", "success")
+    progress(1.0, "Indexed")
+    committed = ingest_cache.load_meta(cache_key)     # ours, or an identical job's that won
+    if committed is None:
+        raise RuntimeError("Could not write the ingestion cache entry")
+    return committed
@@ -0,0 +1,121 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+# ════════════════════════════════════════════════════════
+# Persistent cache for LLM outputs (chunk descriptions, summary batches).
+#
+# Key = SHA-256 over the model name, every text block of the prompt (tables
+# are part of the prompt text) and the hash of every attached image, so the
+# same chunk re-ingested after a failure or a re-upload costs no network
+# call. Stored in one SQLite file; once it grows past MAX_BYTES the least
+# recently used rows are deleted. Hit/miss counters are kept in the same
+# file, so the Logs tab counts the ingestion workers' calls too.
+# ════════════════════════════════════════════════════════
+
+DB_PATH   = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+_LOCK     = threading.Lock()
+_CONN     = None
+_COUNTERS = ("hits", "misses", "writes", "evicted")
+
+
+def _conn() -> sqlite3.Connection:
+    global _CONN
+    if _CONN is None:
+        _CONN = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _CONN.execute("PRAGMA journal_mode=WAL")
+        _CONN.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, used REAL NOT NULL)"
+        )
+        _CONN.execute("CREATE INDEX IF NOT EXISTS llm_cache_used ON llm_cache(used)")
+        _CONN.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        _CONN.commit()
+    return _CONN
+
+
+def _count(name: str, n: int = 1):
+    """Add to a shared counter. Caller holds _LOCK and commits."""
+    if n:
+        _conn().execute("INSERT INTO counters (name, value) VALUES (?, ?)"
+                        " ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, n))
+
+
+def key_for(model: str, content: list) -> str:
+    """Cache key for a LangChain content list (text + image_url blocks)."""
+    h = hashlib.sha256(model.encode())
+    for block in content:
+        if block.get("type") == "text":
+            h.update(b"T" + block["text"].encode())
+        elif block.get("type") == "image_url":
+            url = block["image_url"]["url"]
+            h.update(b"I" + hashlib.sha256(url.encode()).digest())
+    return h.hexdigest()
+
+
+def get(key: str):
+    """Cached value or None. Counts a hit or a miss."""
+    try:
+        with _LOCK:
+            row = _conn().execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                _count("misses")
+                _conn().commit()
+                return None
+            _conn().execute("UPDATE llm_cache SET used = ? WHERE key = ?", (time.time(), key))
+            _count("hits")
+            _conn().commit()
+            return row[0]
+    except sqlite3.Error:
+        return None
+
+
+def put(key: str, value: str):
+    now = time.time()
+    try:
+        with _LOCK:
+            _conn().execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created, used) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode()), now, now),
+            )
+            _count("writes")
+            _evict()
+            _conn().commit()
+    except sqlite3.Error:
+        pass
+
+
+def _evict():
+    """Delete least-recently-used rows until under 90% of MAX_BYTES. Caller holds _LOCK."""
+    total = _conn().execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+    if total <= MAX_BYTES:
+        return
+    target = MAX_BYTES * 0.9
+    rows   = _conn().execute("SELECT key, size FROM llm_cache ORDER BY used").fetchall()
+    drop   = []
+    for key, size in rows:
+        if total <= target:
+            break
+        drop.append((key,))
+        total -= size
+    _conn().executemany("DELETE FROM llm_cache WHERE key = ?", drop)
+    _count("evicted", len(drop))
+
+
+def stats() -> dict:
+    """Counters (all processes) plus current entry count and payload size."""
+    out = dict.fromkeys(_COUNTERS, 0)
+    try:
+        with _LOCK:
+            out.update(_conn().execute("SELECT name, value FROM counters").fetchall())
+            out["entries"], out["bytes"] = _conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+    except sqlite3.Error:
+        out["entries"], out["bytes"] = 0, 0
+    return out
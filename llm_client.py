@@ -0,0 +1,92 @@
+import llm_cache
+import llm_limits
+
+# ════════════════════════════════════════════════════════
+# Gemini → Groq LLM calls, importable outside the Streamlit script so
+# ingestion workers (ingest_jobs) make the same calls as the app.
+#
+#   Tier 1 — Gemini (vision-capable, 20 req/day free).
+#   Tier 2 — Groq / llama-3.3-70b (text+tables only, 14,400 req/day free).
+# ════════════════════════════════════════════════════════
+
+DEFAULT_MODEL = "models/gemini-2.5-flash"
+GROQ_MODEL    = "llama-3.3-70b-versatile"
+
+
+def is_quota_error(e: Exception) -> bool:
+    s = str(e)
+    return "429" in s or "RESOURCE_EXHAUSTED" in s or "quota" in s.lower()
+
+
+def groq_messages(gemini_messages):
+    """
+    Convert a LangChain HumanMessage list (which may contain image_url blocks)
+    into plain-text-only messages safe for Groq (no vision support).
+    Images are dropped; everything else is kept.
+    """
+    from langchain_core.messages import HumanMessage as HM
+    plain_parts = []
+    for msg in gemini_messages:
+        if hasattr(msg, "content"):
+            if isinstance(msg.content, str):
+                plain_parts.append(msg.content)
+            elif isinstance(msg.content, list):
+                for block in msg.content:
+                    if isinstance(block, dict) and block.get("type") == "text":
+                        plain_parts.append(block["text"])
+                    # image_url blocks are silently dropped — Groq can't handle them
+    return [HM(content="\n\n".join(plain_parts))]
+
+
+def invoke_with_fallback(messages, model: str = DEFAULT_MODEL, on_fallback=None):
+    """
+    Returns (response, provider). On a quota/rate-limit error from Gemini,
+    calls on_fallback() and switches to Groq. Any non-quota error is re-raised.
+    """
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    # ── Tier 1: Gemini ───────────────────────────────────
+    try:
+        llm = ChatGoogleGenerativeAI(model=model, temperature=0)
+        with llm_limits.slot("gemini"):
+            return llm.invoke(messages), "gemini"
+    except Exception as e:
+        if not is_quota_error(e):
+            raise
+        # quota hit → fall through to Groq
+        if on_fallback:
+            on_fallback()
+
+    # ── Tier 2: Groq ────────────────────────────────────
+    try:
+        from langchain_groq import ChatGroq
+        groq_llm  = ChatGroq(model=GROQ_MODEL, temperature=0)
+        groq_msgs = groq_messages(messages)   # strip image blocks
+        with llm_limits.slot("groq"):
+            return groq_llm.invoke(groq_msgs), "groq"
+    except Exception as e2:
+        if is_quota_error(e2):
+            raise RuntimeError(
+                "Both Gemini and Groq have hit their rate limits. "
+                "Please wait a few minutes and try again."
+            ) from e2
+        raise
+
+
+def invoke_cached(content: list, validate=None, model: str = DEFAULT_MODEL) -> str:
+    """
+    invoke_with_fallback for a single-message prompt, memoised on disk by
+    llm_cache. Safe to call off the script thread. Answers that fail
+    `validate`, or Groq fallbacks for prompts with images (Groq never saw
+    them), are returned but not cached.
+    """
+    from langchain_core.messages import HumanMessage
+    key = llm_cache.key_for(model, content)
+    hit = llm_cache.get(key)
+    if hit is not None:
+        return hit
+    response, provider = invoke_with_fallback([HumanMessage(content=content)], model)
+    has_images = any(b.get("type") == "image_url" for b in content)
+    if (provider == "gemini" or not has_images) and (validate is None or validate(response.content)):
+        llm_cache.put(key, response.content)
+    return response.content
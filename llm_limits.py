@@ -0,0 +1,82 @@
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:            # no advisory locks (Windows): limits are per process
+    fcntl = None
+
+# ════════════════════════════════════════════════════════
+# Machine-wide concurrency limits for LLM calls.
+#
+# Rate limits are per API key, and the key is shared by every session on
+# this server and by the ingestion worker processes (ingest_jobs). A slot
+# is an exclusive flock on one of N files under SLOT_DIR, so the limit holds
+# across processes, and the OS frees a dead process's slots. A per-process
+# semaphore in front keeps waiting threads off the disk. The state lives
+# here rather than in app.py (which Streamlit re-executes on every
+# interaction). invoke_with_fallback takes a slot for whichever provider it
+# is calling. Chunk summaries during ingestion fan out over a shared thread
+# pool and queue on those slots.
+# ════════════════════════════════════════════════════════
+
+PROVIDER_LIMITS = {
+    "gemini": int(os.getenv("GEMINI_CONCURRENCY", "4")),
+    "groq":   int(os.getenv("GROQ_CONCURRENCY", "8")),
+}
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", str(sum(PROVIDER_LIMITS.values()))))
+SLOT_DIR        = os.getenv("LLM_SLOT_DIR", "llm_slots")
+SLOT_POLL_SECS  = 0.05          # first back-off while every slot is taken (doubles, max 1s)
+
+_SEMAPHORES = {p: threading.BoundedSemaphore(max(1, n)) for p, n in PROVIDER_LIMITS.items()}
+_POOL       = None
+_POOL_LOCK  = threading.Lock()
+
+
+@contextmanager
+def slot(provider: str):
+    """Hold one of `provider`'s concurrent-request slots for the duration."""
+    sem = _SEMAPHORES.get(provider)
+    if sem is None:
+        yield
+        return
+    with sem:
+        fh = _acquire_file_slot(provider)
+        try:
+            yield
+        finally:
+            if fh is not None:
+                fh.close()                     # releases the flock
+
+
+def _acquire_file_slot(provider: str):
+    """Open, exclusively locked slot file for `provider` (None without fcntl)."""
+    if fcntl is None:
+        return None
+    os.makedirs(SLOT_DIR, exist_ok=True)
+    n     = max(1, PROVIDER_LIMITS[provider])
+    delay = SLOT_POLL_SECS
+    while True:
+        for i in random.sample(range(n), n):
+            fh = open(os.path.join(SLOT_DIR, f"{provider}.{i}.lock"), "w")
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fh
+            except OSError:
+                fh.close()
+        time.sleep(delay * random.uniform(0.5, 1.0))
+        delay = min(delay * 2, 1.0)
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """Shared pool for I/O-bound LLM work (summaries)."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=max(1, SUMMARY_WORKERS),
+                                       thread_name_prefix="llm")
+        return _POOL
@@ -0,0 +1,162 @@
+import os
+import base64
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+import image_norm
+
+# ════════════════════════════════════════════════════════
+# On-demand PDF page renders with a size-bounded disk cache.
+#
+#   <CACHE_DIR>/sources/<doc_hash>.pdf                 — the uploaded PDF
+#   <CACHE_DIR>/renders/<doc_hash>/<page>_<dpi>.<ext>  — cached renders
+#
+# Chunks store (doc_hash, page numbers) instead of images; a page is only
+# rendered the first time a chunk summary, chat answer or the Summary tab
+# asks for it. Renders are evicted least-recently-used (by mtime, touched on
+# every hit) once the render directory exceeds MAX_BYTES. The app and the
+# ingestion workers share the directory, so its size is re-read from disk
+# every EVICT_EVERY bytes a process writes rather than tracked in memory.
+# Renders go through image_norm before they are cached, so what is stored is
+# what gets uploaded.
+# Sources are kept until drop_source() — they are the only way to re-render.
+# ════════════════════════════════════════════════════════
+
+CACHE_DIR   = os.getenv("PAGE_CACHE_DIR", "page_cache")
+MAX_BYTES   = int(os.getenv("PAGE_CACHE_MAX_MB", "512")) * 1024 * 1024
+DEFAULT_DPI = 150
+
+_LOCK       = threading.Lock()    # PyMuPDF documents are not thread-safe
+_OPEN_DOCS  = OrderedDict()       # doc_hash → open fitz.Document (small LRU)
+_MAX_OPEN   = 8
+_written    = 0                   # bytes this process rendered since its last eviction pass
+EVICT_EVERY = MAX_BYTES // 20
+
+
+def document_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _source_path(doc_hash: str) -> str:
+    return os.path.join(CACHE_DIR, "sources", f"{doc_hash}.pdf")
+
+
+def _render_path(doc_hash: str, page: int, dpi: int) -> str:
+    return os.path.join(CACHE_DIR, "renders", doc_hash, f"{page}_{dpi}.{image_norm.EXT}")
+
+
+def register_source(doc_hash: str, pdf_path: str):
+    """Keep a copy of the PDF so its pages can be rendered later."""
+    dest = _source_path(doc_hash)
+    if os.path.exists(dest):
+        return
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.copyfile(pdf_path, tmp)
+    os.replace(tmp, dest)
+
+
+def has_source(doc_hash: str) -> bool:
+    return bool(doc_hash) and os.path.exists(_source_path(doc_hash))
+
+
+def drop_source(doc_hash: str):
+    """Delete a document's source PDF and all of its renders."""
+    with _LOCK:
+        doc = _OPEN_DOCS.pop(doc_hash, None)
+        if doc is not None:
+            doc.close()
+        try:
+            os.remove(_source_path(doc_hash))
+        except OSError:
+            pass
+        shutil.rmtree(os.path.join(CACHE_DIR, "renders", doc_hash), ignore_errors=True)
+
+
+def _open(doc_hash: str):
+    import fitz  # PyMuPDF
+    doc = _OPEN_DOCS.get(doc_hash)
+    if doc is not None:
+        _OPEN_DOCS.move_to_end(doc_hash)
+        return doc
+    doc = fitz.open(_source_path(doc_hash))
+    _OPEN_DOCS[doc_hash] = doc
+    if len(_OPEN_DOCS) > _MAX_OPEN:
+        _OPEN_DOCS.popitem(last=False)[1].close()
+    return doc
+
+
+def _render_files():
+    root = os.path.join(CACHE_DIR, "renders")
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if not name.endswith(".tmp"):
+                yield os.path.join(dirpath, name)
+
+
+def _evict():
+    """Drop least-recently-used renders until under 90% of MAX_BYTES."""
+    entries = []
+    for p in _render_files():
+        try:
+            st = os.stat(p)
+            entries.append((st.st_mtime, st.st_size, p))
+        except OSError:
+            pass
+    total = sum(size for _, size, _ in entries)
+    if total <= MAX_BYTES:
+        return
+    entries.sort()
+    for _, size, p in entries:
+        if total <= MAX_BYTES * 0.9:
+            break
+        try:
+            os.remove(p)
+            total -= size
+        except OSError:
+            pass
+
+
+def get_page_bytes(doc_hash: str, page: int, dpi: int = DEFAULT_DPI) -> bytes:
+    """Normalised image bytes for a 1-based page, rendered on first use. b"" if unavailable."""
+    global _written
+    path = _render_path(doc_hash, page, dpi)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)                    # mark as recently used
+        return data
+    except OSError:
+        pass
+
+    if not has_source(doc_hash):
+        return b""
+    import fitz
+    with _LOCK:
+        try:
+            doc = _open(doc_hash)
+            if not 1 <= page <= doc.page_count:
+                return b""
+            matrix = fitz.Matrix(dpi / 72, dpi / 72)   # 72 is PDF's default DPI
+            data   = doc[page - 1].get_pixmap(matrix=matrix, alpha=False).tobytes("png")
+        except Exception:
+            return b""
+        data = image_norm.normalise(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        _written += len(data)
+        if _written >= EVICT_EVERY:
+            _written = 0
+            _evict()
+    return data
+
+
+def get_page(doc_hash: str, page: int, dpi: int = DEFAULT_DPI) -> str:
+    """Base64 image for a 1-based page ("" if unavailable)."""
+    data = get_page_bytes(doc_hash, page, dpi)
+    return base64.b64encode(data).decode() if data else ""
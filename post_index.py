@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ════════════════════════════════════════════════════════
+# Post-index enrichment tasks (document summary, …) that run after a
+# document is searchable, off the Streamlit script thread.
+#
+# Tasks live here rather than in session state so they survive reruns and
+# a session can poll them by key. A task is fn(*args, progress=cb) and must
+# not touch st.*: it reports with progress(done, total, message) and
+# returns its result, which the session picks up with get(). Results are
+# kept until discard()ed or RESULT_TTL_SECS after they finish. cancel()
+# drops a task and stops it at its next progress() call.
+# ════════════════════════════════════════════════════════
+
+WORKERS         = int(os.getenv("POST_INDEX_WORKERS", "2"))
+RESULT_TTL_SECS = 3600
+
+_LOCK  = threading.Lock()
+_POOL  = None
+_TASKS = {}    # key -> {"future", "progress", "started", "finished", "cancelled"}
+
+
+class Cancelled(Exception):
+    """Raised from progress() inside a task that was cancel()ed."""
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _POOL
+    with _LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix="post-index")
+        return _POOL
+
+
+def submit(key: str, fn, *args, **kwargs):
+    """Run fn(*args, **kwargs, progress=...) in the background under `key`."""
+    task = {"future": None, "progress": {"done": 0, "total": 0, "message": "Queued"},
+            "started": time.time(), "finished": None, "cancelled": False}
+
+    def progress(done: int, total: int, message: str = ""):
+        if task["cancelled"]:
+            raise Cancelled()
+        task["progress"] = {"done": done, "total": total, "message": message}
+
+    def run():
+        try:
+            return fn(*args, progress=progress, **kwargs)
+        finally:
+            task["finished"] = time.time()
+
+    task["future"] = _pool().submit(run)
+    with _LOCK:
+        _prune()
+        _TASKS[key] = task
+
+
+def get(key: str) -> dict:
+    """{"state": "running"|"done"|"failed", "progress", "result", "error"}, or None."""
+    with _LOCK:
+        task = _TASKS.get(key)
+    if task is None:
+        return None
+    fut = task["future"]
+    if not fut.done():
+        return {"state": "running", "progress": task["progress"], "result": None, "error": None}
+    err = fut.exception()
+    return {"state": "failed" if err else "done", "progress": task["progress"],
+            "result": None if err else fut.result(), "error": str(err) if err else None}
+
+
+def discard(key: str):
+    with _LOCK:
+        _TASKS.pop(key, None)
+
+
+def cancel(key: str):
+    """Drop task `key`; it never starts if still queued, else stops at its next progress()."""
+    with _LOCK:
+        task = _TASKS.pop(key, None)
+    if task is not None:
+        task["cancelled"] = True
+        task["future"].cancel()
+
+
+def _prune():
+    """Forget results nobody collected. Caller holds _LOCK."""
+    cutoff = time.time() - RESULT_TTL_SECS
+    for key in [k for k, t in _TASKS.items() if t["finished"] and t["finished"] < cutoff]:
+        del _TASKS[key]
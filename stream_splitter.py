@@ -0,0 +1,155 @@
+import os
+
+# ════════════════════════════════════════════════════════
+# Streaming text splitter for files too large to load whole.
+#
+# Reads a file in blocks through a buffered text stream (universal newlines,
+# incremental UTF-8 decoding — the same text TextLoader would produce), cuts
+# it on a literal separator as it goes and merges the pieces into chunks
+# with exactly CharacterTextSplitter's greedy merge rules, so the chunk
+# texts are identical to
+#   CharacterTextSplitter(separator, chunk_size, chunk_overlap).split_text(text)
+# Only the pieces of the chunk being built are held in memory. A stretch
+# with no separator (a log dump with single newlines) is cut at its last
+# newline, or hard, once it reaches MAX_PIECE_CHARS, so memory stays bounded;
+# output matches CharacterTextSplitter for inputs without such stretches.
+# Each chunk carries the start/end character offsets of the source span it
+# was built from.
+# ════════════════════════════════════════════════════════
+
+BLOCK_CHARS     = 1 << 20
+MAX_PIECE_CHARS = 1 << 20
+SAMPLE_BYTES    = 1 << 20      # read by detect_encoding
+
+
+def iter_splits(stream, separator: str = "\n\n", block_chars: int = BLOCK_CHARS,
+                max_piece: int = MAX_PIECE_CHARS):
+    """
+    Yield (piece, start_offset) for the non-empty pieces between separators.
+    A piece that would exceed `max_piece` is cut at its last newline, or at
+    `max_piece` if it has none.
+    """
+    buf, base = "", 0            # base = source offset of buf[0]
+    while True:
+        block = stream.read(block_chars)
+        buf  += block
+        pos   = 0
+        while True:
+            i = buf.find(separator, pos)
+            if i < 0:
+                break
+            if i > pos:
+                yield buf[pos:i], base + pos
+            pos = i + len(separator)
+        while len(buf) - pos > max_piece:
+            cut = buf.rfind("\n", pos, pos + max_piece)
+            if cut > pos:
+                yield buf[pos:cut], base + pos
+                pos = cut + 1
+            else:
+                yield buf[pos:pos + max_piece], base + pos
+                pos += max_piece
+        if not block:
+            if pos < len(buf):
+                yield buf[pos:], base + pos
+            return
+        buf, base = buf[pos:], base + pos
+
+
+def iter_file_splits(path: str, separator: str = "\n\n", encoding: str = "utf-8",
+                     block_chars: int = BLOCK_CHARS, errors: str = "strict"):
+    with open(path, encoding=encoding, errors=errors) as f:
+        yield from iter_splits(f, separator, block_chars)
+
+
+def detect_encoding(path: str, sample_bytes: int = SAMPLE_BYTES) -> str:
+    """
+    Encoding of a text file from its first `sample_bytes`: a BOM, else UTF-8
+    if the sample decodes, else charset_normalizer's guess (if installed),
+    else cp1252. Never reads the whole file.
+    """
+    import codecs
+    with open(path, "rb") as f:
+        sample = f.read(sample_bytes)
+    for bom, enc in ((codecs.BOM_UTF8, "utf-8-sig"),
+                     (codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"),
+                     (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")):
+        if sample.startswith(bom):
+            return enc
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)   # may end mid-character
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    try:
+        from charset_normalizer import from_bytes
+        best = from_bytes(sample).best()
+        if best is not None:
+            return best.encoding
+    except Exception:
+        pass
+    return "cp1252"
+
+
+def merge_splits(splits, separator: str = "\n\n", chunk_size: int = 1000, chunk_overlap: int = 0):
+    """
+    CharacterTextSplitter._merge_splits over a stream of (piece, offset).
+    Yields (chunk_text, start, end) with whitespace stripped, as it does.
+    """
+    sep_len = len(separator)
+    current, total = [], 0                  # [(piece, offset)], joined length
+
+    def join():
+        text     = separator.join(p for p, _ in current)
+        stripped = text.strip()
+        if not stripped:
+            return None
+        # offsets from the outermost pieces with content — empty pieces between
+        # repeated separators are dropped, so the join can be shorter than the span
+        first = next((p, o) for p, o in current if p.strip())
+        last  = next((p, o) for p, o in reversed(current) if p.strip())
+        start = first[1] + len(first[0]) - len(first[0].lstrip())
+        end   = last[1] + len(last[0].rstrip())
+        return stripped, start, end
+
+    for piece, offset in splits:
+        n = len(piece)
+        if total + n + (sep_len if current else 0) > chunk_size and current:
+            doc = join()
+            if doc is not None:
+                yield doc
+            while total > chunk_overlap or (
+                total + n + (sep_len if current else 0) > chunk_size and total > 0
+            ):
+                total  -= len(current[0][0]) + (sep_len if len(current) > 1 else 0)
+                current = current[1:]
+        current.append((piece, offset))
+        total += n + (sep_len if len(current) > 1 else 0)
+
+    if current:
+        doc = join()
+        if doc is not None:
+            yield doc
+
+
+def iter_file_chunks(path: str, chunk_size: int = 1000, chunk_overlap: int = 0,
+                     separator: str = "\n\n", encoding: str = "utf-8"):
+    """Yield (chunk_text, start, end) for a file without loading it whole."""
+    yield from merge_splits(iter_file_splits(path, separator, encoding),
+                            separator, chunk_size, chunk_overlap)
+
+
+def iter_file_documents(path: str, chunk_size: int = 1000, chunk_overlap: int = 0,
+                        separator: str = "\n\n", encoding: str = "utf-8"):
+    """LangChain Documents for a file, with source and start/end offsets in metadata."""
+    from langchain_core.documents import Document
+    for text, start, end in iter_file_chunks(path, chunk_size, chunk_overlap, separator, encoding):
+        yield Document(page_content=text,
+                       metadata={"source": path, "start_index": start, "end_index": end})
+
+
+def file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0